@@ -0,0 +1,534 @@
+import contextlib
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from completion_index import output_base
+from metrics import merge_seconds
+from progress_log import YTDLP_PROGRESS_TEMPLATE, format_progress, parse_progress_line
+from retry_policy import classify_failure, FAILURE_EXPIRED, FAILURE_PERMANENT, FAILURE_TRANSIENT
+from scheduler import (EpisodeJob, ENGINE_YTDLP, ENGINE_YTDLP_ARIA2C, ENGINE_ARIA2C, ENGINE_NATIVE,
+                       ENGINES, OUTPUT_REMUX, OUTPUT_STREAM, OUTPUT_TS)
+from settings import state_path
+
+# 按站点/CDN主机选择后端的配置（引擎为 auto 时使用），例如
+# {"default": "yt-dlp", "hosts": {"cdn.example.com": "aria2c", "example.org": "native"}}
+# 主机名也匹配其子域名，先按m3u8链接的主机、再按剧集页面的主机查找，最长的匹配优先
+BACKENDS_CONFIG_FILE = "backends.json"
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+# yt-dlp+aria2c：每个文件的连接数和最小分块
+ARIA2C_CONNECTIONS = 16
+ARIA2C_MIN_SPLIT = "1M"
+# 同时下载的分片数（未指定 --segment-workers 时）
+DEFAULT_FRAGMENT_WORKERS = 8
+# aria2c直接下载时分片保存在 {输出文件名}.segments/ 中，全部完成后按顺序合并
+SEGMENTS_DIR_SUFFIX = ".segments"
+ARIA2C_INPUT_FILE = "input.txt"
+# aria2c 的日志（记录每个完成的分片）和从日志中整理出的已完成分片列表（文件名 大小）
+ARIA2C_LOG_FILE = "aria2c.log"
+ARIA2C_DONE_FILE = "done.txt"
+PROGRESS_INTERVAL = 1
+# yt-dlp 分片下载的中间文件：{文件名}.part 为按顺序追加的分片，{文件名}.ytdl 记录已追加的分片序号
+YTDLP_PART_SUFFIX = ".part"
+YTDLP_STATE_SUFFIX = ".ytdl"
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# 校验时每次读取的字节数（TS包大小的整数倍）
+TS_CHECK_CHUNK = TS_PACKET_SIZE * 4096
+
+# aria2c 退出码对应的失败类型，其余按输出文本判断
+_ARIA2C_EXIT_CODES = {
+    3: FAILURE_EXPIRED,      # 资源不存在（链接过期）
+    4: FAILURE_EXPIRED,
+    24: FAILURE_EXPIRED,     # HTTP认证失败
+    9: FAILURE_PERMANENT,    # 磁盘空间不足
+    16: FAILURE_PERMANENT,
+    17: FAILURE_PERMANENT,
+    18: FAILURE_PERMANENT,
+    28: FAILURE_PERMANENT,   # 参数错误
+}
+_ARIA2C_STATUS_RE = re.compile(r"status=(401|403|404|410)\b")
+# aria2c 日志中一个文件下载完成（校验长度后）的记录；以 LC_ALL=C 运行，消息不会被翻译
+_ARIA2C_COMPLETE_RE = re.compile(r"Download complete: (.+?)\s*$", re.M)
+# yt-dlp 下载完成后开始合并/修复封装时输出的行，用于统计后处理耗时
+_YTDLP_POSTPROCESS_RE = re.compile(r"^\[(Merger|Fixup\w*|VideoRemuxer|VideoConvertor)\]", re.M)
+
+class BackendError(Exception):
+    """启动下载前的准备或下载后的收尾失败，failure 为失败类型（retry_policy.FAILURE_*）"""
+
+    def __init__(self, message: str, failure: str = FAILURE_TRANSIENT):
+        super().__init__(message)
+        self.failure = failure
+
+def output_mode(job: EpisodeJob) -> str:
+    return job.extra.get("output_mode") or OUTPUT_REMUX
+
+class DownloadBackend:
+    """下载后端：外部下载程序的命令构造、进度解析、退出结果判断和续传方式
+
+    core_downloader.download_episode 依次调用 prepare → 启动 build_command 的子进程并等待
+    （需要时另开线程运行 watch_progress）→ classify_exit → finish。
+    in_process 的后端（native）不启动子进程，由 download_episode_native 处理。
+    """
+    name = ""
+    tools = ()
+    in_process = False
+    # 下载期间需要另开线程运行 watch_progress 时为 True
+    # （子进程不输出可解析的进度时写入结构化进度，或从输出中记录阶段的开始时间）
+    watches_progress = False
+
+    def available(self) -> bool:
+        return all(shutil.which(tool) for tool in self.tools)
+
+    def supports_resume(self, job: EpisodeJob) -> bool:
+        """失败或停止后重新下载时能否从已下载的部分继续"""
+        return True
+
+    def prepare(self, job: EpisodeJob, logger):
+        """启动前的准备，返回传给之后各步骤的上下文；失败时抛出 BackendError"""
+        return None
+
+    def environment(self) -> Optional[Dict[str, str]]:
+        """子进程的环境变量，None 表示继承当前进程"""
+        return None
+
+    def build_command(self, job: EpisodeJob, context) -> Optional[List[str]]:
+        """下载命令；返回None表示没有需要下载的内容"""
+        raise NotImplementedError
+
+    def parse_progress(self, line: str) -> Optional[Dict]:
+        return parse_progress_line(line)
+
+    def watch_progress(self, job: EpisodeJob, context, progress_log: str, stop: threading.Event):
+        pass
+
+    def classify_exit(self, returncode: int, output: str, stopped: bool) -> Optional[str]:
+        """成功返回None，否则返回失败类型"""
+        if returncode == 0:
+            return None
+        return classify_failure(returncode, output, stopped=stopped)
+
+    def finish(self, job: EpisodeJob, context, logger):
+        """子进程成功退出后的收尾（合并、封装）；失败时抛出 BackendError"""
+
+def _ts_intact(path: str) -> bool:
+    """MPEG-TS 文件是否由完整的包组成（长度为188的整数倍，每个包以同步字节开头）"""
+    if os.path.getsize(path) % TS_PACKET_SIZE:
+        return False
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(TS_CHECK_CHUNK), b""):
+            if chunk[::TS_PACKET_SIZE].strip(bytes([TS_SYNC_BYTE])):
+                return False
+    return True
+
+def _discard_ytdl_state(state_file: str, part_file: str):
+    for path in (state_file, part_file):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+def verify_ytdl_resume(base: str, logger=None) -> Optional[int]:
+    """检查 yt-dlp 上次中断留下的 .part/.ytdl，返回将从第几个分片之后继续（没有可续传的内容时返回None）
+
+    .ytdl 无法解析、记录了分片但 .part 为空、TS 数据不完整（中断在追加分片的过程中）或同步字节错误时
+    删除这两个文件，整集重新下载，不把损坏的部分拼进输出。
+    yt-dlp 不记录每个分片的边界和校验值，这里只能检查整体结构，不能像 native 引擎那样逐个分片校验。
+    """
+    logger = logger or logging.getLogger(__name__)
+    resume_from = None
+    for state_file in glob.glob(glob.escape(base) + ".*" + YTDLP_STATE_SUFFIX):
+        part_file = state_file[:-len(YTDLP_STATE_SUFFIX)] + YTDLP_PART_SUFFIX
+        name = os.path.basename(part_file)
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                index = int(json.load(f)["downloader"]["current_fragment"]["index"])
+            size = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f"{os.path.basename(state_file)} 无法解析，从头下载")
+            _discard_ytdl_state(state_file, part_file)
+            continue
+        if index <= 0:
+            continue
+        if size == 0:
+            logger.warning(f"{name} 不存在或为空，与已完成 {index} 个分片的记录不符，从头下载")
+            _discard_ytdl_state(state_file, part_file)
+            continue
+        with open(part_file, 'rb') as f:
+            is_ts = f.read(1) == bytes([TS_SYNC_BYTE])
+        if is_ts and not _ts_intact(part_file):
+            logger.warning(f"{name} 中的TS数据不完整或已损坏，从头下载")
+            _discard_ytdl_state(state_file, part_file)
+            continue
+        checked = "TS数据完整，" if is_ts else ""
+        logger.info(f"{name}: {checked}从第 {index} 个分片之后继续 (已下载 {size} 字节)")
+        resume_from = index
+    return resume_from
+
+class _YtDlpRun:
+    """一次 yt-dlp 下载的状态：后处理（合并、修复封装）开始的时间"""
+
+    def __init__(self):
+        self.postprocess_started: Optional[float] = None
+
+class YtDlpBackend(DownloadBackend):
+    name = ENGINE_YTDLP
+    tools = ("yt-dlp",)
+    watches_progress = True
+
+    def supports_resume(self, job: EpisodeJob) -> bool:
+        # ffmpeg直接读取HLS时没有分片文件
+        return output_mode(job) != OUTPUT_STREAM
+
+    def prepare(self, job: EpisodeJob, logger) -> _YtDlpRun:
+        if self.supports_resume(job):
+            verify_ytdl_resume(output_base(job.output_dir, job.title, job.ep_num), logger)
+        return _YtDlpRun()
+
+    def watch_progress(self, job: EpisodeJob, context: _YtDlpRun, progress_log: str, stop: threading.Event):
+        """读取新增的输出，记录开始后处理的时间（进度由 yt-dlp 自己写入）"""
+        offset, pending = 0, ""
+        while context.postprocess_started is None and not stop.wait(PROGRESS_INTERVAL):
+            try:
+                with open(progress_log, 'r', encoding='utf-8', errors='replace') as f:
+                    f.seek(offset)
+                    data = f.read()
+                    offset = f.tell()
+            except OSError:
+                continue
+            # 只检查完整的行，半行留到下次
+            lines, _, pending = (pending + data).rpartition("\n")
+            if _YTDLP_POSTPROCESS_RE.search(lines):
+                context.postprocess_started = time.monotonic()
+
+    def finish(self, job: EpisodeJob, context: _YtDlpRun, logger):
+        if context is not None and context.postprocess_started is not None:
+            # 轮询间隔内开始的后处理按轮询到的时间计，误差不超过 PROGRESS_INTERVAL
+            merge_seconds.observe(time.monotonic() - context.postprocess_started)
+
+    def downloader_args(self, job: EpisodeJob) -> List[str]:
+        return []
+
+    def build_command(self, job: EpisodeJob, context) -> List[str]:
+        base = output_base(job.output_dir, job.title, job.ep_num)
+        mode = output_mode(job)
+        cmd = [
+            'yt-dlp',
+            '--user-agent', USER_AGENT,
+            '--newline',
+            '--progress',
+            # 输出紧凑的结构化进度，monitor.py 只需读取日志末尾
+            '--progress-template', YTDLP_PROGRESS_TEMPLATE,
+            '--socket-timeout', '60',
+        ]
+        if mode == OUTPUT_STREAM:
+            # 由ffmpeg直接读取HLS并写出MP4，没有分片文件和合并步骤（不支持续传）
+            cmd += ['-o', base + ".%(ext)s", '--downloader', 'm3u8:ffmpeg']
+        elif mode == OUTPUT_TS:
+            # 分片依次追加到单个TS文件，不再封装
+            cmd += ['-o', base + ".ts", '--hls-use-mpegts', '--fixup', 'never']
+        else:
+            cmd += ['-o', base + ".%(ext)s", '--merge-output-format', 'mp4']
+        if mode != OUTPUT_STREAM:
+            # 从 .part/.ytdl 记录的分片之后继续（yt-dlp 的默认行为，显式指定以免被用户配置文件关闭）；
+            # 这两个文件已在 prepare 中检查
+            cmd.append('--continue')
+        cmd += self.downloader_args(job)
+        if job.extra.get("proxy"):
+            # 经本地限速代理下载，与其它剧集共享全局带宽限制
+            cmd += ['--proxy', job.extra["proxy"]]
+        cmd.append(job.m3u8_url)
+        return cmd
+
+class YtDlpAria2cBackend(YtDlpBackend):
+    """yt-dlp 解析播放列表和合并，分片由 aria2c 多连接并发下载"""
+    name = ENGINE_YTDLP_ARIA2C
+    tools = ("yt-dlp", "aria2c")
+
+    def downloader_args(self, job: EpisodeJob) -> List[str]:
+        if output_mode(job) == OUTPUT_STREAM:
+            return []
+        workers = job.extra.get("segment_workers") or DEFAULT_FRAGMENT_WORKERS
+        return ['--downloader', 'aria2c', '--concurrent-fragments', str(workers),
+                '--downloader-args',
+                f'aria2c:-x {ARIA2C_CONNECTIONS} -s {ARIA2C_CONNECTIONS} -k {ARIA2C_MIN_SPLIT} '
+                '--console-log-level=warn']
+
+class _Aria2cPlan:
+    """aria2c直接下载一集的分片列表
+
+    分片是否完成以 aria2c 日志中的 "Download complete" 记录为准，不根据文件或控制文件是否存在推断：
+    服务器没有返回长度、或控制文件写出前被终止时，残缺的分片文件与完成的无法区分。
+    完成记录连同当时的文件大小整理到 done.txt，之后大小不符的分片视为未完成。
+    """
+
+    def __init__(self, downloader, fragments, segments_dir: str):
+        self.downloader = downloader
+        self.fragments = fragments
+        self.segments_dir = segments_dir
+        self.pending = 0
+        self.completed: Dict[str, int] = {}
+        self._log_offset = 0
+
+    def fragment_path(self, pos: int) -> str:
+        return os.path.join(self.segments_dir, f"{pos:05d}.ts")
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.segments_dir, ARIA2C_LOG_FILE)
+
+    @property
+    def done_path(self) -> str:
+        return os.path.join(self.segments_dir, ARIA2C_DONE_FILE)
+
+    def load(self):
+        """读取 done.txt 和上次运行留下的日志，整理后删除日志（下次运行重新写入）"""
+        try:
+            with open(self.done_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    name, _, size = line.strip().rpartition(" ")
+                    if name and size.isdigit():
+                        self.completed[name] = int(size)
+        except FileNotFoundError:
+            pass
+        self.read_log()
+        with open(self.done_path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{name} {size}\n" for name, size in self.completed.items())
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.log_path)
+        self._log_offset = 0
+
+    def read_log(self):
+        """读取日志中新增的完成记录"""
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # 只处理完整的行
+        end = data.rfind(b"\n") + 1
+        self._log_offset += end
+        for match in _ARIA2C_COMPLETE_RE.finditer(data[:end].decode('utf-8', 'replace')):
+            name = os.path.basename(match.group(1))
+            with contextlib.suppress(OSError):
+                self.completed[name] = os.path.getsize(os.path.join(self.segments_dir, name))
+
+    def mark_all_done(self):
+        """aria2c 正常退出（退出码0）表示输入文件中的下载全部成功"""
+        for pos in range(len(self.fragments)):
+            path = self.fragment_path(pos)
+            with contextlib.suppress(OSError):
+                self.completed.setdefault(os.path.basename(path), os.path.getsize(path))
+
+    def is_done(self, pos: int) -> bool:
+        path = self.fragment_path(pos)
+        size = self.completed.get(os.path.basename(path))
+        if size is None:
+            return False
+        try:
+            return os.path.getsize(path) == size
+        except OSError:
+            return False
+
+class Aria2cBackend(DownloadBackend):
+    """aria2c 直接下载媒体播放列表中的分片，完成后按顺序合并（必要时解密）并封装"""
+    name = ENGINE_ARIA2C
+    tools = ("aria2c",)
+    watches_progress = True
+
+    def prepare(self, job: EpisodeJob, logger) -> _Aria2cPlan:
+        # 延迟导入，只用yt-dlp时不需要加载requests
+        import requests
+        from hls_downloader import HlsDownloader, HlsDownloadError
+
+        downloader = HlsDownloader(variant_policy=job.extra.get("variant_policy"), logger=logger)
+        try:
+            playlist = downloader.load_playlist(job.m3u8_url)
+        except (requests.RequestException, ValueError, HlsDownloadError) as e:
+            raise BackendError(f"获取播放列表失败: {e}", classify_failure(None, str(e)))
+        fragments = ([playlist.init_segment] if playlist.init_segment else []) + playlist.segments
+        if any(fragment.byterange for fragment in fragments):
+            raise BackendError("aria2c 不支持 EXT-X-BYTERANGE 分片，请改用 native 引擎", FAILURE_PERMANENT)
+        job.expected_duration = playlist.total_duration or None
+
+        plan = _Aria2cPlan(downloader, fragments, output_base(job.output_dir, job.title, job.ep_num) + SEGMENTS_DIR_SUFFIX)
+        os.makedirs(plan.segments_dir, exist_ok=True)
+        plan.load()
+        # 已完成的分片不再列出；未完成的由 --continue 从断点继续
+        with open(os.path.join(plan.segments_dir, ARIA2C_INPUT_FILE), 'w', encoding='utf-8') as f:
+            for pos, fragment in enumerate(fragments):
+                if not plan.is_done(pos):
+                    plan.pending += 1
+                    f.write(f"{fragment.url}\n  out={os.path.basename(plan.fragment_path(pos))}\n")
+        return plan
+
+    def build_command(self, job: EpisodeJob, context: _Aria2cPlan) -> Optional[List[str]]:
+        if context.pending == 0:
+            return None
+        workers = job.extra.get("segment_workers") or DEFAULT_FRAGMENT_WORKERS
+        cmd = [
+            'aria2c',
+            '--input-file', os.path.join(context.segments_dir, ARIA2C_INPUT_FILE),
+            '--dir', context.segments_dir,
+            '--max-concurrent-downloads', str(workers),
+            '--max-connection-per-server', str(min(workers, ARIA2C_CONNECTIONS)),
+            '--split', '1',
+            '--continue=true',
+            '--auto-file-renaming=false',
+            '--file-allocation=none',
+            '--max-tries', '5',
+            '--retry-wait', '2',
+            '--timeout', '60',
+            '--user-agent', USER_AGENT,
+            '--summary-interval', '0',
+            '--console-log-level', 'warn',
+            # 完成记录写入日志，续传时据此判断哪些分片已完整
+            '--log', context.log_path,
+            '--log-level', 'notice',
+        ]
+        if job.extra.get("proxy"):
+            cmd.append(f"--all-proxy={job.extra['proxy']}")
+        return cmd
+
+    def environment(self) -> Dict[str, str]:
+        # 日志消息不翻译，_ARIA2C_COMPLETE_RE 才能匹配
+        return {**os.environ, "LC_ALL": "C", "LANGUAGE": "C"}
+
+    def watch_progress(self, job: EpisodeJob, context: _Aria2cPlan, progress_log: str,
+                       stop: threading.Event):
+        """aria2c 只输出单个分片的进度，按日志中的完成记录和分片文件大小计算整集进度"""
+        total = len(context.fragments)
+        started = time.time()
+        initial = None
+        while True:
+            stopping = stop.wait(PROGRESS_INTERVAL)
+            context.read_log()
+            done, done_bytes, bytes_now = 0, 0, 0
+            for pos in range(total):
+                try:
+                    size = os.path.getsize(context.fragment_path(pos))
+                except OSError:
+                    continue
+                bytes_now += size
+                if context.is_done(pos):
+                    done += 1
+                    done_bytes += size
+            if initial is None:
+                initial = bytes_now
+            speed = (bytes_now - initial) / max(time.time() - started, 1e-6)
+            estimate = done_bytes / done * total if done else None
+            eta = (estimate - bytes_now) / speed if estimate and speed else None
+            with open(progress_log, 'a', encoding='utf-8') as f:
+                f.write(format_progress(bytes_now, estimate, speed, eta, done, total))
+            if stopping:
+                return
+
+    def classify_exit(self, returncode: int, output: str, stopped: bool) -> Optional[str]:
+        if returncode == 0:
+            return None
+        if not stopped and returncode in _ARIA2C_EXIT_CODES:
+            return _ARIA2C_EXIT_CODES[returncode]
+        if not stopped and _ARIA2C_STATUS_RE.search(output or ""):
+            return FAILURE_EXPIRED
+        return classify_failure(returncode, output, stopped=stopped)
+
+    def finish(self, job: EpisodeJob, context: _Aria2cPlan, logger):
+        import requests
+        from hls_downloader import HlsDownloadError, remux_to_mp4
+
+        context.mark_all_done()
+        missing = [pos for pos in range(len(context.fragments)) if not context.is_done(pos)]
+        if missing:
+            raise BackendError(f"aria2c 退出但有 {len(missing)} 个分片未完成")
+        base = output_base(job.output_dir, job.title, job.ep_num)
+        try:
+            with open(base + ".ts", 'wb') as out:
+                for pos, fragment in enumerate(context.fragments):
+                    with open(context.fragment_path(pos), 'rb') as f:
+                        data = f.read()
+                    try:
+                        out.write(context.downloader.decrypt(fragment, data))
+                    except (HlsDownloadError, ValueError):
+                        # 分片可能损坏，删除后重试时重新下载
+                        with contextlib.suppress(OSError):
+                            os.remove(context.fragment_path(pos))
+                        raise
+        except (HlsDownloadError, ValueError, requests.RequestException) as e:
+            # 获取密钥失败（如链接过期）、分片解密失败
+            raise BackendError(f"分片解密失败: {e}", classify_failure(None, str(e)))
+        except OSError as e:
+            raise BackendError(f"合并分片失败: {e}", classify_failure(None, str(e)))
+        shutil.rmtree(context.segments_dir, ignore_errors=True)
+        if output_mode(job) != OUTPUT_TS and remux_to_mp4(base + ".ts", base + ".mp4"):
+            logger.info(f"第 {job.ep_num} 集已封装为MP4")
+
+class NativeBackend(DownloadBackend):
+    """进程内HLS引擎（hls_downloader），由 core_downloader.download_episode_native 处理"""
+    name = ENGINE_NATIVE
+    in_process = True
+
+    def available(self) -> bool:
+        try:
+            import requests  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+_BACKENDS: Dict[str, DownloadBackend] = {
+    backend.name: backend
+    for backend in (YtDlpBackend(), YtDlpAria2cBackend(), Aria2cBackend(), NativeBackend())
+}
+
+def get_backend(name: str) -> DownloadBackend:
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"不支持的下载引擎: {name}")
+
+def load_backend_config() -> Dict:
+    try:
+        with open(state_path(BACKENDS_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+# 已提示过不可用的后端，每个只提示一次
+_warned = set()
+
+def _match_host(host: str, mapping: Dict[str, str]) -> Optional[str]:
+    best = None
+    for pattern, engine in mapping.items():
+        pattern = pattern.lower().lstrip("*.")
+        if host == pattern or host.endswith("." + pattern):
+            if best is None or len(pattern) > len(best[0]):
+                best = (pattern, engine)
+    return best[1] if best else None
+
+def select_engine(m3u8_url: str, page_url: Optional[str] = None, config: Optional[Dict] = None,
+                  logger=None) -> str:
+    """按配置为一集选择后端：先匹配m3u8链接的主机（CDN），再匹配剧集页面的主机
+
+    配置的后端不存在或所需程序未安装时退回 yt-dlp，yt-dlp 也未安装时退回 native。
+    """
+    logger = logger or logging.getLogger(__name__)
+    config = load_backend_config() if config is None else config
+    hosts = config.get("hosts") or {}
+    engine = None
+    for url in (m3u8_url, page_url):
+        if url and engine is None:
+            engine = _match_host(urlparse(url).netloc.lower().split(":")[0], hosts)
+    engine = engine or config.get("default") or ENGINE_YTDLP
+    if engine in ENGINES and get_backend(engine).available():
+        return engine
+    fallback = ENGINE_YTDLP if get_backend(ENGINE_YTDLP).available() else ENGINE_NATIVE
+    if engine not in _warned:
+        _warned.add(engine)
+        logger.warning(f"下载引擎 {engine} 不可用，改用 {fallback}")
+    return fallback
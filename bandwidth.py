@@ -0,0 +1,287 @@
+import json
+import os
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+import logging
+from typing import List, Optional, Tuple
+
+from rate_limiter import TokenBucket
+from settings import state_path
+
+# 全局带宽配置文件，修改后运行中的守护进程会自动生效
+BANDWIDTH_CONFIG_FILE = "bandwidth.json"
+# 检查配置文件/时间表的周期（秒）
+CONFIG_POLL_INTERVAL = 5
+# 每次读写的块大小，令牌桶容量不能小于它
+CHUNK_SIZE = 64 * 1024
+
+_RATE_RE = re.compile(r'^\s*([\d.]+)\s*([kmg]?)(i?)(b|bit|bits|bps|byte|bytes)?(/s)?\s*$', re.I)
+
+def parse_rate(text: Optional[str]) -> Optional[float]:
+    """解析速率，返回字节/秒；None/0/none/unlimited 表示不限速
+
+    带 bit/bps 后缀按比特计算（如 20Mbit、20Mbps），否则按字节（如 2M、500K，与yt-dlp一致）。
+    """
+    if text is None:
+        return None
+    text = str(text).strip()
+    if text.lower() in ("", "0", "none", "unlimited", "off", "full"):
+        return None
+    match = _RATE_RE.match(text)
+    if not match:
+        raise ValueError(f"无法解析的速率: {text}")
+    number, prefix, binary, unit, _ = match.groups()
+    base = 1024 if binary or not unit or unit.lower() in ("byte", "bytes") else 1000
+    value = float(number) * base ** " kmg".index(prefix.lower() or " ")
+    if unit and unit.lower() in ("bit", "bits", "bps") or (unit == "b"):
+        value /= 8
+    return value or None
+
+def format_rate(rate: Optional[float]) -> str:
+    if not rate:
+        return "不限速"
+    return f"{rate * 8 / 1000 / 1000:.1f}Mbit/s"
+
+def _parse_clock(text: str) -> int:
+    hours, minutes = text.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+class BandwidthSchedule:
+    """按一天中的时间段限速，例如 "08:00-20:00=20Mbit,20:00-08:00=0"（0为不限速）"""
+
+    def __init__(self, rules: List[Tuple[int, int, Optional[float]]]):
+        self.rules = rules
+
+    @classmethod
+    def parse(cls, spec: str) -> "BandwidthSchedule":
+        rules = []
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            span, rate = item.split("=", 1)
+            start, end = span.split("-", 1)
+            rules.append((_parse_clock(start), _parse_clock(end), parse_rate(rate)))
+        return cls(rules)
+
+    def rate_at(self, when: Optional[float] = None) -> Optional[float]:
+        local = time.localtime(when)
+        minute = local.tm_hour * 60 + local.tm_min
+        for start, end, rate in self.rules:
+            # 结束时间小于开始时间表示跨越午夜
+            inside = start <= minute < end if start < end else (minute >= start or minute < end)
+            if inside:
+                return rate
+        return None
+
+def load_config() -> dict:
+    try:
+        with open(state_path(BANDWIDTH_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_config(limit: Optional[str] = None, schedule: Optional[str] = None, **changes):
+    """更新全局带宽配置（先校验再写入），运行中的守护进程几秒内生效"""
+    config = load_config()
+    if limit is not None:
+        parse_rate(limit)
+        config["limit"] = limit
+    if schedule is not None:
+        if schedule:
+            BandwidthSchedule.parse(schedule)
+        config["schedule"] = schedule
+    config.update(changes)
+    path = state_path(BANDWIDTH_CONFIG_FILE)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return config
+
+def current_rate(when: Optional[float] = None) -> Optional[float]:
+    """按当前配置计算的限速（字节/秒），None表示不限速"""
+    config = load_config()
+    rate = parse_rate(config.get("limit"))
+    if rate is None and config.get("schedule"):
+        rate = BandwidthSchedule.parse(config["schedule"]).rate_at(when)
+    return rate
+
+def config_exists() -> bool:
+    return os.path.exists(state_path(BANDWIDTH_CONFIG_FILE))
+
+class BandwidthLimiter:
+    """守护进程内所有剧集共享的总带宽限制
+
+    速率来自全局配置：固定限速(limit)优先，否则按时间表(schedule)；
+    配置文件变化或进入新的时间段时调整令牌桶速率，已在下载的剧集无需重启。
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._bucket = TokenBucket(rate=1, capacity=CHUNK_SIZE * 4)
+        self._rate: Optional[float] = None
+        self._config_mtime = None
+        self._schedule: Optional[BandwidthSchedule] = None
+        self._fixed: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh()
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+
+    def _reload_config(self):
+        try:
+            mtime = os.stat(state_path(BANDWIDTH_CONFIG_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        config = load_config()
+        try:
+            self._fixed = parse_rate(config.get("limit"))
+            self._schedule = BandwidthSchedule.parse(config["schedule"]) if config.get("schedule") else None
+        except ValueError as e:
+            self.logger.error(f"带宽配置无效，保持原设置: {e}")
+
+    def refresh(self):
+        """重新读取配置并按当前时间计算速率"""
+        self._reload_config()
+        rate = self._fixed
+        if rate is None and self._schedule is not None:
+            rate = self._schedule.rate_at()
+        if rate != self._rate:
+            self.logger.info(f"带宽限制: {format_rate(self._rate)} -> {format_rate(rate)}")
+            self._rate = rate
+            if rate:
+                # 桶容量约半秒的流量，且至少容纳几个读写块
+                self._bucket.set_rate(rate, max(CHUNK_SIZE * 4, rate / 2))
+
+    def consume(self, nbytes: int):
+        """传输nbytes字节前（或后）调用，超出限制时阻塞"""
+        if not self._rate:
+            return
+        while nbytes > 0:
+            # 单次取令牌不能超过桶容量
+            step = min(nbytes, int(self._bucket.capacity))
+            self._bucket.acquire(step)
+            nbytes -= step
+
+    def _run(self):
+        while not self._stop.wait(CONFIG_POLL_INTERVAL):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"刷新带宽配置出错: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="bandwidth", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+class _ProxyHandler(socketserver.BaseRequestHandler):
+    """最小的HTTP代理：支持CONNECT隧道和普通HTTP转发，下行流量经过共享限速"""
+
+    def _read_head(self) -> bytes:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.request.recv(8192)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) > 65536:
+                break
+        return data
+
+    def handle(self):
+        client = self.request
+        head = self._read_head()
+        if not head:
+            return
+        header_block, _, body = head.partition(b"\r\n\r\n")
+        lines = header_block.split(b"\r\n")
+        try:
+            method, target, version = lines[0].decode("latin-1").split(" ", 2)
+        except ValueError:
+            return
+
+        try:
+            if method.upper() == "CONNECT":
+                host, _, port = target.rpartition(":")
+                upstream = socket.create_connection((host, int(port or 443)), timeout=60)
+                client.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+                pending = body
+            else:
+                # 绝对URI: http://host[:port]/path
+                match = re.match(r"http://([^/:]+)(?::(\d+))?(/.*)?$", target)
+                if not match:
+                    client.sendall(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+                    return
+                host, port, path = match.group(1), int(match.group(2) or 80), match.group(3) or "/"
+                upstream = socket.create_connection((host, port), timeout=60)
+                headers = [line for line in lines[1:]
+                           if not line.lower().startswith((b"proxy-", b"connection:", b"keep-alive:"))]
+                # 每个连接只转发一个请求，避免客户端复用连接访问其它主机
+                request = [f"{method} {path} {version}".encode("latin-1")] + headers + [b"Connection: close"]
+                pending = b"\r\n".join(request) + b"\r\n\r\n" + body
+        except (OSError, ValueError):
+            try:
+                client.sendall(b"HTTP/1.1 502 Bad Gateway\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            return
+
+        with upstream:
+            if pending:
+                upstream.sendall(pending)
+            self._relay(client, upstream)
+
+    def _relay(self, client: socket.socket, upstream: socket.socket):
+        limiter: BandwidthLimiter = self.server.limiter
+        sockets = [client, upstream]
+        while True:
+            readable, _, errored = select.select(sockets, [], sockets, 120)
+            if errored or not readable:
+                return
+            for sock in readable:
+                try:
+                    data = sock.recv(CHUNK_SIZE)
+                except OSError:
+                    return
+                if not data:
+                    return
+                if sock is upstream:
+                    limiter.consume(len(data))
+                    client.sendall(data)
+                else:
+                    upstream.sendall(data)
+
+class ThrottlingProxy(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """本地限速代理，yt-dlp 通过 --proxy 使用它，所有剧集共享同一个带宽限制"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, limiter: BandwidthLimiter, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _ProxyHandler)
+        self.limiter = limiter
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="throttling-proxy", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""离线端到端基准：对本地模拟站点跑完整的 解析剧集页面 → 提取m3u8 → 下载 流程
+
+用法:
+    python benchmarks/bench_e2e.py                                  # 默认场景，输出一行JSON
+    python benchmarks/bench_e2e.py --latency 50 --bandwidth 40Mbit --error-rate 0.05
+    python benchmarks/bench_e2e.py -j 6 --segment-workers 16 --results results.jsonl
+    python benchmarks/bench_e2e.py --shared-segments 5 --segment-cache 1G  # 各集共用片头分片
+
+模拟站点（benchmarks/fake_site.py）在单独的进程中运行，CPU和内存只统计下载器本身。
+每次运行使用临时的全局状态目录和下载目录（--keep 保留），不会读写 ~/.ov_downloader。
+结果为一行JSON（git版本、场景参数、各阶段耗时、字节数/秒、CPU、峰值RSS、站点统计、
+下载器内部指标），
+--results 追加写入文件，便于跨版本对比。全部剧集下载完成时退出码为0。
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 全局状态目录在导入任何下载器模块之前设置（settings 在导入时读取）
+WORKDIR = tempfile.mkdtemp(prefix="ov_bench_")
+os.environ["OV_DOWNLOADER_HOME"] = os.path.join(WORKDIR, "home")
+
+from fake_site import add_site_arguments
+
+def git_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def start_site(args):
+    """在子进程中启动模拟站点，返回 (进程, 站点信息)"""
+    cmd = [sys.executable, os.path.join(ROOT, "benchmarks", "fake_site.py"),
+           "--episodes", str(args.episodes), "--segments", str(args.segments),
+           "--segment-size", args.segment_size, "--latency", str(args.latency),
+           "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+           "--shared-segments", str(args.shared_segments)]
+    if args.bandwidth:
+        cmd += ["--bandwidth", args.bandwidth]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError("模拟站点启动失败")
+    return process, json.loads(line)
+
+def site_stats(series_url: str):
+    base = series_url.split("/show/")[0]
+    with urllib.request.urlopen(f"{base}/__stats", timeout=10) as response:
+        return json.loads(response.read())
+
+def usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_utime + children.ru_utime, self_usage.ru_stime + children.ru_stime,
+            max(self_usage.ru_maxrss, children.ru_maxrss))
+
+def run(args, site_url: str, output_root: str):
+    """跑一遍完整流程，返回各阶段的测量结果"""
+    from core_downloader import resolve_m3u8_urls, run_series
+    from bandwidth import parse_rate
+    from metrics import metrics, segment_cache_requests_total, segment_cache_saved_bytes_total
+    from ov_downloader import sort_episodes, build_series
+    from rate_limiter import site_limiter
+    from state_store import open_store, EP_COMPLETED
+    from url_parser import parse_video_page
+
+    logger = logging.getLogger("bench")
+    # 默认不让站点令牌桶成为瓶颈，测量下载器本身
+    site_limiter.configure(args.site_rate, args.site_rate)
+
+    phases = {}
+    started = time.perf_counter()
+    result = parse_video_page(site_url)
+    phases["parse_s"] = time.perf_counter() - started
+    if not result:
+        raise RuntimeError("剧集页面解析失败")
+
+    sorted_episodes = sort_episodes(result)
+    output_dir = os.path.join(output_root, result["title"])
+    os.makedirs(output_dir, exist_ok=True)
+    series = build_series(result, sorted_episodes, range(1, len(sorted_episodes) + 1), output_dir, site_url)
+
+    mark = time.perf_counter()
+    series["m3u8_urls"] = resolve_m3u8_urls(series["urls"], series["episode_numbers"], output_dir,
+                                            logger, args.extract_workers)
+    phases["extract_s"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    run_series([series], logger, max_workers=args.jobs, per_host_limit=args.per_host,
+               engine=args.engine, segment_workers=args.segment_workers, max_retries=args.retries,
+               adaptive=args.adaptive, output_mode=args.output_mode,
+               segment_cache=parse_rate(args.segment_cache))
+    phases["download_s"] = time.perf_counter() - mark
+    wall = time.perf_counter() - started
+
+    completed = len(open_store(output_dir).episodes_in_state(EP_COMPLETED))
+    hits = segment_cache_requests_total.value(result="hit")
+    misses = segment_cache_requests_total.value(result="miss")
+    output_bytes = sum(entry.stat().st_size for entry in os.scandir(output_dir)
+                       if entry.is_file() and entry.name.endswith((".ts", ".mp4")))
+    return {
+        "title": result["title"],
+        "episodes_found": len(sorted_episodes),
+        "episodes_resolved": len(series["m3u8_urls"]),
+        "episodes_completed": completed,
+        "wall_s": round(wall, 3),
+        "phases": {name: round(value, 3) for name, value in phases.items()},
+        "bytes": output_bytes,
+        "bytes_per_s": round(output_bytes / phases["download_s"]) if phases["download_s"] else None,
+        "segment_cache": {"hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+                          "bytes_saved": int(segment_cache_saved_bytes_total.value())},
+        # 各阶段的计时和计数（metrics.py），定位瓶颈在站点、CDN还是本地磁盘
+        "metrics": metrics.snapshot(buckets=False)["metrics"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准")
+    add_site_arguments(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=3, help="同时下载的集数")
+    parser.add_argument("--per-host", type=int, default=3, help="每个CDN主机同时下载的集数")
+    parser.add_argument("--engine", default="native", help="下载引擎 (默认: native)")
+    parser.add_argument("--output", dest="output_mode", default="ts", help="输出方式 (默认: ts，不需要ffmpeg)")
+    parser.add_argument("--segment-workers", type=int, help="native引擎每集的分片并发数")
+    parser.add_argument("--extract-workers", type=int, default=4, help="并发提取m3u8链接的线程数")
+    parser.add_argument("--retries", type=int, default=3, help="每集失败后的最大重试次数")
+    parser.add_argument("--adaptive", action="store_true", help="自适应调整每个主机的并发数")
+    parser.add_argument("--segment-cache", help="分片缓存上限，例如 1G（配合 --shared-segments，默认不启用）")
+    parser.add_argument("--site-rate", type=float, default=1000.0, help="站点页面请求令牌桶速率 (次/秒)")
+    parser.add_argument("--results", help="把结果追加写入该文件（每行一个JSON）")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（下载结果和状态库）")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出下载日志")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+
+    process, site = start_site(args)
+    try:
+        cpu_user, cpu_system, _ = usage()
+        # 下载流程中的print输出到stderr，stdout只保留结果JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run(args, site["url"], os.path.join(WORKDIR, "downloads"))
+        user, system, peak_rss = usage()
+        results.update({
+            "cpu_user_s": round(user - cpu_user, 3),
+            "cpu_system_s": round(system - cpu_system, 3),
+            "cpu_percent": round((user - cpu_user + system - cpu_system) / results["wall_s"] * 100, 1),
+            "peak_rss_kib": peak_rss if sys.platform != "darwin" else peak_rss // 1024,
+            "server": site_stats(site["url"]),
+        })
+    finally:
+        process.terminate()
+        process.wait()
+        if args.keep:
+            print(f"临时目录: {WORKDIR}", file=sys.stderr)
+        else:
+            shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    record = {
+        "benchmark": "e2e",
+        "version": git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "scenario": {**site["config"], "jobs": args.jobs, "per_host": args.per_host, "engine": args.engine,
+                     "output_mode": args.output_mode, "segment_workers": args.segment_workers,
+                     "extract_workers": args.extract_workers, "adaptive": args.adaptive,
+                     "segment_cache": args.segment_cache},
+        "results": results,
+    }
+    line = json.dumps(record, ensure_ascii=False)
+    print(line)
+    if args.results:
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    sys.exit(0 if results["episodes_completed"] == results["episodes_found"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""多目录总览基准：逐个目录读取 vs monitor.FleetScanner（首次扫描、未变化、少量变化）
+
+用法:
+    python benchmarks/bench_fleet.py                 # 2000个剧集目录
+    python benchmarks/bench_fleet.py --dirs 5000 --active 50
+
+在临时目录中生成剧集目录（状态库、部分目录有正在下载的集和进度日志），
+逐个目录读取的方式相当于对每个目录运行一次 monitor.py（不含进程启动开销）。
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monitor import FleetScanner, get_active_downloads, get_download_status, get_progress
+from progress_log import format_progress
+from state_store import StateStore, STATE_DB_FILE, EP_COMPLETED, EP_FAILED
+
+def generate(root: str, dirs: int, active: int):
+    """每个目录20集：15集完成、1集失败、其余排队，前 active 个目录有一集正在下载"""
+    for index in range(dirs):
+        path = os.path.join(root, f"剧集{index:05d}")
+        os.makedirs(path)
+        store = StateStore(os.path.join(path, STATE_DB_FILE))
+        for ep in range(1, 17):
+            store.transition(ep, EP_COMPLETED if ep <= 15 else EP_FAILED)
+        store.set_meta("queue", list(range(1, 21)))
+        if index < active:
+            store.set_active(20, os.getpid(), "https://cdn.example.com/index.m3u8", "native")
+            with open(os.path.join(path, "ep_20_progress.log"), "w") as f:
+                f.write(format_progress(5e6, 1e7, 2e6, 2.5, 10, 20))
+        store.close()
+
+def per_directory(root: str):
+    """旧方式：每个目录分别读取状态和进度"""
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        active = get_active_downloads(path)
+        get_download_status(path)
+        for ep_num in active:
+            get_progress(path, int(ep_num))
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="多目录总览基准")
+    parser.add_argument("--dirs", type=int, default=2000, help="剧集目录数")
+    parser.add_argument("--active", type=int, default=20, help="有正在下载剧集的目录数")
+    parser.add_argument("--touch", type=int, default=10, help="两次扫描之间有写入的目录数")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="ov_fleet_")
+    try:
+        _, seconds = timed(lambda: generate(root, args.dirs, args.active))
+        print(f"生成 {args.dirs} 个剧集目录: {seconds:.1f} s")
+
+        _, seconds = timed(lambda: per_directory(root))
+        print(f"  逐个目录读取              {seconds * 1000:8.1f} ms")
+
+        scanner = FleetScanner(root, use_cache_file=False)
+        snapshot, seconds = timed(scanner.refresh)
+        print(f"  总览 首次扫描             {seconds * 1000:8.1f} ms  "
+              f"({len(snapshot['series'])} 个目录, 重新读取 {snapshot['changed']})")
+        snapshot, seconds = timed(scanner.refresh)
+        print(f"  总览 未变化               {seconds * 1000:8.1f} ms  (重新读取 {snapshot['changed']})")
+
+        for index in range(args.touch):
+            store = StateStore(os.path.join(root, f"剧集{index:05d}", STATE_DB_FILE))
+            store.transition(17, EP_COMPLETED)
+            store.close()
+        snapshot, seconds = timed(scanner.refresh)
+        print(f"  总览 {args.touch} 个目录有变化{'':<6}{seconds * 1000:8.1f} ms  (重新读取 {snapshot['changed']})")
+        totals = {key: sum(item[key] for item in snapshot["series"]) for key in ("active", "completed", "failed")}
+        print(f"  合计: 下载中 {totals['active']}, 完成 {totals['completed']}, 失败 {totals['failed']}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""m3u8链接提取基准：逐条正则的旧实现 vs 合并扫描 vs 按站点记忆的规则
+
+用法:
+    python benchmarks/bench_m3u8_scan.py                  # 典型页面 + 病态页面
+    python benchmarks/bench_m3u8_scan.py --sizes 25 50 100 200
+    python benchmarks/bench_m3u8_scan.py page1.html ...   # 保存下来的真实分集页面
+
+典型页面会先校验新旧实现的结果一致；病态页面（大量没有结尾的 player_ 对象、
+内含大量 http: 的超长脚本）展示旧实现的耗时随页面大小平方增长，而新实现保持线性。
+"""
+import argparse
+import html
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m3u8_extractor import scan_m3u8, normalize_m3u8_url, decrypt_url, _UNESCAPE_RE
+
+PAGE_URL = "https://www.example.com/play/386769-1-1.html"
+M3U8 = "https://cdn.example.com/20240101/abc/index.m3u8"
+
+def reference_scan(html_text: str, page_url: str):
+    """旧实现：每条规则各自用 re.search(..., re.DOTALL) 扫描全文"""
+    extraction_patterns = [
+        (r'player_\w+\s*=\s*({.*?});', lambda m: json.loads(m.group(1)).get('url')),
+        (r'play_url\s*=\s*["\'](.*?\.m3u8)["\']', lambda m: m.group(1)),
+        (r'var\s+url\s*=\s*["\'](.*?)["\']', lambda m: decrypt_url(m.group(1))),
+        (r'<iframe[^>]+src=["\'](.*?)["\']', lambda m: urljoin(page_url, m.group(1))),
+        (r'(https?:[\\/]+[^\s"\']+\.m3u8)', lambda m: m.group(1)),
+    ]
+    for pattern, processor in extraction_patterns:
+        try:
+            match = re.search(pattern, html_text, re.DOTALL)
+            if match:
+                normalized_url = normalize_m3u8_url(processor(match))
+                if normalized_url:
+                    return normalized_url
+        except (json.JSONDecodeError, AttributeError, KeyError):
+            continue
+    return None
+
+def filler(kib: int) -> str:
+    """普通页面内容：导航、图片、统计脚本"""
+    block = ('<div class="item"><a href="/play/1-1-%d.html"><img src="https://img.example.com/%d.jpg">'
+             '第%d集</a></div>\n<script>var _hmt=_hmt||[];(function(){var hm=document.createElement("script");'
+             'hm.src="https://hm.example.com/hm.js?%d";})();</script>\n')
+    parts, size, i = [], 0, 0
+    while size < kib * 1024:
+        part = block % (i, i, i, i)
+        parts.append(part)
+        size += len(part)
+        i += 1
+    return "".join(parts)
+
+def typical_pages(kib: int):
+    """每条规则各一个典型页面，链接都放在页面后部"""
+    escaped = M3U8.replace("/", "\\/")
+    body = filler(kib)
+    return {
+        "player_json": body + '<script>var player_aaaa={"flag":"play","encrypt":0,'
+                              f'"url":"{escaped}","id":"386769"}};</script>',
+        "play_url": body + f'<script>var play_url = "{M3U8}";</script>',
+        "var_url": body + f'<script>var url = "{M3U8}";</script>',
+        "iframe": body + '<iframe width="100%" src="/player/index.m3u8" allowfullscreen></iframe>',
+        "generic": body + f'<video data-src="{M3U8}"></video>',
+        "none": body,
+    }
+
+def pathological_pages(kib: int):
+    """旧实现会平方级回溯的页面：
+
+    unterminated_player  大量没有 "};" 结尾的 player_ 对象
+    long_token           不含空白和引号、内含大量 http: 的超长脚本
+    """
+    count = kib * 1024 // 12
+    return {
+        "unterminated_player": "<p>player_x={</p>" * count + f'<script>var url = "{M3U8}";</script>',
+        "long_token": "<script>" + "http://a.js;" * count + f'</script><video src="{M3U8}">',
+    }
+
+def timed(func, repeat: int):
+    timings = []
+    result = func()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+def compare(name: str, html_text: str, repeat: int):
+    old, old_s = timed(lambda: reference_scan(html_text, PAGE_URL), repeat)
+    (new, rule), new_s = timed(lambda: scan_m3u8(html_text, PAGE_URL), repeat)
+    _, memo_s = timed(lambda: scan_m3u8(html_text, PAGE_URL, rule), repeat)
+    match = "一致" if new == old else "不一致!"
+    print(f"  {name:<20} {len(html_text) / 1024:6.0f} KiB  旧 {old_s * 1000:8.2f} ms  "
+          f"单遍 {new_s * 1000:7.2f} ms  记忆规则 {memo_s * 1000:7.2f} ms  "
+          f"命中 {rule or '-':<12} {match}")
+    return new == old
+
+def main():
+    parser = argparse.ArgumentParser(description="m3u8链接提取基准")
+    parser.add_argument("pages", nargs="*", help="保存的分集页面HTML文件")
+    parser.add_argument("--kib", type=int, default=200, help="典型页面大小 (KiB)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[12, 25, 50],
+                        help="病态页面大小 (KiB)")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数（取中位数）")
+    args = parser.parse_args()
+
+    ok = True
+    if args.pages:
+        print("== 保存的页面 ==")
+        for path in args.pages:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                html_text = _UNESCAPE_RE.sub(r'\1', html.unescape(f.read()))
+            ok &= compare(os.path.basename(path), html_text, args.repeat)
+    else:
+        print("== 典型页面 ==")
+        for name, page in typical_pages(args.kib).items():
+            ok &= compare(name, page, args.repeat)
+        print("== 病态页面 ==")
+        for kib in args.sizes:
+            for name, page in pathological_pages(kib).items():
+                ok &= compare(name, page, 1)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
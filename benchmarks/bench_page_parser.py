@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""剧集页面解析基准：BeautifulSoup旧实现 vs page_parser 单遍解析
+
+用法:
+    python benchmarks/bench_page_parser.py                 # 生成的合集页面（默认3000个链接）
+    python benchmarks/bench_page_parser.py --links 10000
+    python benchmarks/bench_page_parser.py page1.html ...  # 保存下来的真实页面
+
+每个输入都会先校验各实现的输出与旧实现完全一致，再统计耗时。
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_parser import parse_series_page, BACKEND_HTMLPARSER, BACKEND_LXML, _lxml_html
+from url_parser import normalize_page, extract_title, extract_episode_urls
+
+BASE_URL = "https://www.example.com/show/386769.html"
+
+def generate_page(links: int, seed: int = 1) -> str:
+    """模拟大型合集页面：多个播放源、嵌套标签、导航链接、转义的脚本数据"""
+    rng = random.Random(seed)
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8">',
+             '<title>《测试剧集》全集在线观看 - 示例站 | 高清</title>',
+             '<script>var player_data={"url":"https:\\/\\/cdn.example.com\\/a.m3u8"};</script>',
+             '</head><body><div class="nav">']
+    for i in range(50):
+        parts.append(f'<a href="/list/{i}.html">分类{i}</a>')
+    parts.append('</div><h1>测试剧集</h1>')
+    sources = max(1, links // 500)
+    per_source = links // sources
+    for source in range(sources):
+        parts.append(f'<div class="playlist"><h3>播放源{source}</h3><ul>')
+        for ep in range(1, per_source + 1):
+            text = f"第{ep:02d}集" if rng.random() > 0.1 else f"<span>第</span>{ep}<em>集</em>"
+            parts.append(f'<li><a href="/play/386769-{source}-{ep}.html" title="第{ep}集">{text}</a></li>')
+        parts.append('</ul></div>')
+    parts.append('<div class="footer"><a href="/about.html">关于 &amp; 联系</a><p>未闭合段落</div>')
+    parts.append('</body></html>')
+    return "".join(parts)
+
+def reference_parse(html_text: str, url: str):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_text, 'html.parser')
+    return extract_title(soup, url), extract_episode_urls(soup, url)
+
+def timed(func, repeat: int):
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+def bench(name: str, raw: str, url: str, repeat: int):
+    started = time.perf_counter()
+    html_text = normalize_page(raw)
+    normalize_ms = (time.perf_counter() - started) * 1000
+
+    implementations = [("bs4 html.parser (旧)", lambda: reference_parse(html_text, url)),
+                       ("单遍 html.parser", lambda: parse_series_page(html_text, url, BACKEND_HTMLPARSER))]
+    if _lxml_html is not None:
+        implementations.append(("单遍 lxml", lambda: parse_series_page(html_text, url, BACKEND_LXML)))
+
+    print(f"\n== {name}: {len(raw) / 1024:.0f} KiB, 预处理 {normalize_ms:.1f} ms ==")
+    expected, baseline = None, None
+    for label, func in implementations:
+        result, seconds = timed(func, repeat)
+        if expected is None:
+            expected, baseline = result, seconds
+            match = "基准"
+        else:
+            match = "一致" if result == expected else "不一致!"
+        print(f"  {label:<22} {seconds * 1000:8.1f} ms  x{baseline / seconds:5.1f}  "
+              f"{len(result[1])} 集  {match}")
+
+def main():
+    parser = argparse.ArgumentParser(description="剧集页面解析基准")
+    parser.add_argument("pages", nargs="*", help="保存的HTML页面文件")
+    parser.add_argument("--links", type=int, default=3000, help="生成页面的分集链接数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个实现重复次数（取中位数）")
+    parser.add_argument("--url", default=BASE_URL, help="解析页面时使用的页面URL")
+    args = parser.parse_args()
+
+    if args.pages:
+        for path in args.pages:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                bench(os.path.basename(path), f.read(), args.url, args.repeat)
+    else:
+        bench(f"生成页面 ({args.links} 个分集链接)", generate_page(args.links), args.url, args.repeat)
+
+if __name__ == "__main__":
+    main()
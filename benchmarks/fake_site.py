@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""本地模拟视频站点，供离线端到端基准使用（不访问真实网站）
+
+    python benchmarks/fake_site.py --episodes 12 --segments 30 --segment-size 256K \\
+        --latency 20 --bandwidth 50Mbit --error-rate 0.02
+
+启动后在标准输出打印一行JSON（剧集页面URL和端口），按 Ctrl+C 退出。提供的页面：
+
+    /show/<id>.html             剧集页面，链接结构与真实站点相同（第X集，URL带 -）
+    /play/<id>-1-<n>.html       分集页面，m3u8链接在 player_aaaa JSON 中（转义的 \\/）
+    /hls/<n>/index.m3u8         媒体播放列表
+    /hls/<n>/<i>.ts             分片，内容按集数和序号确定，可以校验
+    /hls/shared/<i>.ts          各集共用的片头分片（--shared-segments，每集播放列表的前几个分片）
+    /__stats                    请求数、发送字节数、注入的错误数（JSON）
+
+延迟作用于每个请求；带宽为整个站点共享的上限；错误只注入分片请求（模拟不稳定的CDN），
+页面请求出错会触发 fetch_page 的长时间退避，不适合测量。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bandwidth import parse_rate
+from rate_limiter import TokenBucket
+
+SERIES_ID = 386769
+SERIES_TITLE = "离线测试剧集"
+# 带宽限制时每次发送的字节数
+SEND_CHUNK_SIZE = 64 * 1024
+
+@dataclass
+class SiteConfig:
+    episodes: int = 12
+    segments: int = 30
+    segment_size: int = 256 * 1024
+    segment_duration: float = 4.0
+    latency_ms: float = 0.0
+    bandwidth: Optional[float] = None  # 字节/秒，None为不限
+    error_rate: float = 0.0
+    seed: int = 1
+    shared_segments: int = 0
+
+def segment_payload(ep_num: int, index: int, size: int) -> bytes:
+    """确定性的分片内容：TS同步字节开头，按 (集数, 序号) 生成，不同分片内容不同"""
+    block = hashlib.sha256(f"{ep_num}:{index}".encode()).digest()
+    data = (b"\x47" + block * (188 // len(block) + 1))[:188]
+    return (data * (size // len(data) + 1))[:size]
+
+def series_page(config: SiteConfig) -> str:
+    links = "".join(f'<li><a href="/play/{SERIES_ID}-1-{n}.html" title="第{n}集">第{n:02d}集</a></li>'
+                    for n in range(1, config.episodes + 1))
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>《{SERIES_TITLE}》全集 - 示例站</title>'
+            f'</head><body><div class="nav"><a href="/">首页</a><a href="/list/1.html">电视剧</a></div>'
+            f'<h1>{SERIES_TITLE}</h1><div class="playlist"><ul>{links}</ul></div></body></html>')
+
+def episode_page(base_url: str, ep_num: int) -> str:
+    m3u8 = f"{base_url}/hls/{ep_num}/index.m3u8".replace("/", "\\/")
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{SERIES_TITLE} 第{ep_num}集</title>'
+            f'</head><body><div id="player"></div><script>var player_aaaa={{"flag":"play","encrypt":0,'
+            f'"url":"{m3u8}","id":"{SERIES_ID}","nid":{ep_num}}};</script></body></html>')
+
+def media_playlist(config: SiteConfig) -> str:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{int(config.segment_duration + 0.999)}",
+             "#EXT-X-MEDIA-SEQUENCE:0"]
+    for index in range(config.segments):
+        uri = f"../shared/{index}.ts" if index < config.shared_segments else f"{index}.ts"
+        lines += [f"#EXTINF:{config.segment_duration:.3f},", uri]
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+class FakeSite:
+    """在后台线程中运行的模拟站点"""
+
+    def __init__(self, config: SiteConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        self._bucket = (TokenBucket(config.bandwidth, max(config.bandwidth, SEND_CHUNK_SIZE))
+                        if config.bandwidth else None)
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes_sent": 0, "errors_injected": 0, "not_found": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def series_url(self) -> str:
+        return f"{self.base_url}/show/{SERIES_ID}.html"
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                self.stats[name] += delta
+
+    def _inject_error(self) -> bool:
+        if self.config.error_rate <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.config.error_rate
+
+    def route(self, path: str):
+        """返回 (状态码, 内容类型, 内容)"""
+        config = self.config
+        parts = path.split("?")[0].strip("/").split("/")
+        if path.startswith("/__stats"):
+            with self._stats_lock:
+                return 200, "application/json", json.dumps(self.stats).encode()
+        if parts == ["show", f"{SERIES_ID}.html"]:
+            return 200, "text/html; charset=utf-8", series_page(config).encode()
+        if len(parts) == 2 and parts[0] == "play" and parts[1].endswith(".html"):
+            ep_num = int(parts[1][:-5].rsplit("-", 1)[-1])
+            if 1 <= ep_num <= config.episodes:
+                return 200, "text/html; charset=utf-8", episode_page(self.base_url, ep_num).encode()
+        if (len(parts) == 3 and parts[0] == "hls" and parts[1] == "shared" and parts[2].endswith(".ts")
+                and parts[2][:-3].isdigit() and int(parts[2][:-3]) < config.shared_segments):
+            if self._inject_error():
+                self._count(errors_injected=1)
+                return 503, "text/plain", b"injected error"
+            return 200, "video/mp2t", segment_payload(0, int(parts[2][:-3]), config.segment_size)
+        if len(parts) == 3 and parts[0] == "hls" and parts[1].isdigit():
+            ep_num = int(parts[1])
+            if 1 <= ep_num <= config.episodes:
+                if parts[2] == "index.m3u8":
+                    return 200, "application/vnd.apple.mpegurl", media_playlist(config).encode()
+                index = parts[2][:-3]
+                if parts[2].endswith(".ts") and index.isdigit() and int(index) < config.segments:
+                    if self._inject_error():
+                        self._count(errors_injected=1)
+                        return 503, "text/plain", b"injected error"
+                    return 200, "video/mp2t", segment_payload(ep_num, int(index), config.segment_size)
+        self._count(not_found=1)
+        return 404, "text/plain", b"not found"
+
+    def _handler_class(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive，与真实CDN一样复用连接
+
+            def do_GET(self):
+                site._count(requests=1)
+                if site.config.latency_ms:
+                    time.sleep(site.config.latency_ms / 1000)
+                status, content_type, body = site.route(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    for offset in range(0, len(body), SEND_CHUNK_SIZE):
+                        chunk = body[offset:offset + SEND_CHUNK_SIZE]
+                        if site._bucket is not None:
+                            site._bucket.acquire(len(chunk))
+                        self.wfile.write(chunk)
+                        site._count(bytes_sent=len(chunk))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-site", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def add_site_arguments(parser: argparse.ArgumentParser):
+    """模拟站点的参数，bench_e2e.py 共用"""
+    parser.add_argument("--episodes", type=int, default=SiteConfig.episodes, help="集数")
+    parser.add_argument("--segments", type=int, default=SiteConfig.segments, help="每集分片数")
+    parser.add_argument("--segment-size", default="256K", help="每个分片大小，例如 256K、1M")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟 (毫秒)")
+    parser.add_argument("--bandwidth", help="站点总带宽上限，例如 50Mbit、4M (默认不限)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="分片请求返回503的概率")
+    parser.add_argument("--seed", type=int, default=SiteConfig.seed, help="错误注入的随机种子")
+    parser.add_argument("--shared-segments", type=int, default=0, help="每集开头各集共用的分片数（片头）")
+
+def site_config(args) -> SiteConfig:
+    return SiteConfig(episodes=args.episodes, segments=args.segments,
+                      segment_size=int(parse_rate(args.segment_size)),
+                      latency_ms=args.latency, bandwidth=parse_rate(args.bandwidth) if args.bandwidth else None,
+                      error_rate=args.error_rate, seed=args.seed, shared_segments=args.shared_segments)
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟视频站点")
+    add_site_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="监听端口 (默认随机)")
+    args = parser.parse_args()
+
+    site = FakeSite(site_config(args), args.host, args.port)
+    site.start()
+    print(json.dumps({"url": site.series_url, "port": site.server.server_address[1],
+                      "config": asdict(site.config)}), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        site.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+from typing import Dict, List, Optional, Set, Tuple
+
+from state_store import StateStore, open_store, EP_COMPLETED
+
+# 输出文件可能的扩展名，按优先级（remux/stream 为 .mp4，ts 为 .ts，yt-dlp 也可能合并为 .mkv）
+OUTPUT_EXTENSIONS = (".mp4", ".ts", ".mkv")
+# 实际时长短于播放列表总时长的这个比例时视为截断（封装后的时长与 EXTINF 之和略有出入）
+DURATION_TOLERANCE = 0.95
+PROBE_TIMEOUT = 60
+HASH_CHUNK_SIZE = 1024 * 1024
+# 损坏的输出文件改名保留，不直接删除
+CORRUPT_SUFFIX = ".corrupt"
+
+# 检查结果
+OUTPUT_OK = "ok"
+OUTPUT_MISSING = "missing"
+OUTPUT_CORRUPT = "corrupt"
+
+def output_base(output_dir: str, title: str, ep_num: int) -> str:
+    """输出文件名（不含扩展名），与下载引擎使用的 {title}_第{ep}集 一致"""
+    return os.path.join(output_dir, f"{title}_第{ep_num}集")
+
+def find_output(output_dir: str, title: str, ep_num: int) -> Optional[str]:
+    base = output_base(output_dir, title, ep_num)
+    for ext in OUTPUT_EXTENSIONS:
+        if os.path.isfile(base + ext):
+            return base + ext
+    return None
+
+def probe_duration(path: str) -> Optional[float]:
+    """用ffprobe读取媒体时长（秒）；没有ffprobe时返回None，文件无法解析时返回0"""
+    if not shutil.which('ffprobe'):
+        return None
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', path],
+            capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    try:
+        return float(result.stdout.strip()) if result.returncode == 0 else 0.0
+    except ValueError:
+        return 0.0
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def record_output(store: StateStore, ep_num: int, path: str, duration: Optional[float] = None,
+                  with_hash: bool = False) -> Dict:
+    """把输出文件记入完成索引（大小、修改时间、时长，可选内容哈希）"""
+    st = os.stat(path)
+    sha256 = content_hash(path) if with_hash else None
+    store.record_output(ep_num, path, st.st_size, st.st_mtime_ns, duration, sha256)
+    return {"path": path, "size": st.st_size, "duration": duration, "sha256": sha256}
+
+def record_completion(output_dir: str, title: str, ep_num: int,
+                      expected_duration: Optional[float] = None,
+                      with_hash: bool = False) -> Tuple[bool, str]:
+    """下载成功后检查输出文件并记入完成索引，返回 (是否完整, 原因)
+
+    有ffprobe时读取实际时长：无法解析或明显短于播放列表总时长（expected_duration）视为截断。
+    """
+    path = find_output(output_dir, title, ep_num)
+    if path is None:
+        return False, "下载结束但没有找到输出文件"
+    duration = probe_duration(path)
+    if duration == 0:
+        return False, f"输出文件无法解析: {os.path.basename(path)}"
+    if duration and expected_duration and duration < expected_duration * DURATION_TOLERANCE:
+        return False, f"输出文件被截断: 时长 {duration:.0f}/{expected_duration:.0f} 秒"
+    record_output(open_store(output_dir), ep_num, path, duration, with_hash)
+    return True, ""
+
+def check_output(store: StateStore, output_dir: str, title: str, ep_num: int,
+                 completed: bool, verify_hash: bool = False) -> Tuple[str, str]:
+    """检查某一集的输出是否完整（只读本地文件，不访问网络），返回 (OUTPUT_*, 原因)
+
+    有索引记录时比较大小；修改时间变化时重新读取时长，verify_hash 时比较内容哈希。
+    没有记录但状态为已完成（completed，旧版本下载的）且输出文件可以解析时补录索引。
+    """
+    record = store.get_output(ep_num)
+    if record is None:
+        path = find_output(output_dir, title, ep_num)
+        if not completed:
+            # 未完成的文件由下载引擎续传
+            return OUTPUT_MISSING, ""
+        if path is None:
+            return OUTPUT_MISSING, "输出文件不存在"
+        duration = probe_duration(path)
+        if duration == 0:
+            return OUTPUT_CORRUPT, f"输出文件无法解析: {os.path.basename(path)}"
+        record_output(store, ep_num, path, duration, verify_hash)
+        return OUTPUT_OK, ""
+
+    path = record["path"]
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return OUTPUT_MISSING, "输出文件不存在"
+    if st.st_size != record["size"]:
+        kind = "被截断" if st.st_size < record["size"] else "大小变化"
+        return OUTPUT_CORRUPT, f"输出文件{kind}: {st.st_size}/{record['size']} 字节"
+    if verify_hash and record["sha256"]:
+        if content_hash(path) != record["sha256"]:
+            return OUTPUT_CORRUPT, "输出文件内容校验不一致"
+    elif st.st_mtime_ns != record["mtime_ns"]:
+        duration = probe_duration(path)
+        if duration == 0 or (duration and record["duration"]
+                             and duration < record["duration"] * DURATION_TOLERANCE):
+            return OUTPUT_CORRUPT, "输出文件已被修改且时长不完整"
+        store.record_output(ep_num, path, st.st_size, st.st_mtime_ns,
+                            duration or record["duration"], record["sha256"])
+    return OUTPUT_OK, ""
+
+def discard_output(store: StateStore, output_dir: str, title: str, ep_num: int, logger=None):
+    """损坏的输出改名为 *.corrupt，清除索引和完成状态，重新下载时写入新文件"""
+    logger = logger or logging.getLogger(__name__)
+    record = store.get_output(ep_num)
+    path = record["path"] if record else find_output(output_dir, title, ep_num)
+    if path and os.path.exists(path):
+        try:
+            os.replace(path, path + CORRUPT_SUFFIX)
+            logger.warning(f"已将损坏的输出改名为 {os.path.basename(path)}{CORRUPT_SUFFIX}")
+        except OSError as e:
+            logger.warning(f"无法改名损坏的输出 {path}: {e}")
+    store.forget_episode(ep_num)
+
+def completed_episodes(output_dir: str, title: str, episode_numbers=None,
+                       verify_hash: bool = False, logger=None) -> Set[int]:
+    """按完成索引确认输出完整的剧集；丢失或损坏的剧集清除完成状态，之后会重新下载
+
+    episode_numbers 为空时检查所有已完成的剧集。
+    """
+    logger = logger or logging.getLogger(__name__)
+    if not os.path.isdir(output_dir):
+        return set()
+    store = open_store(output_dir)
+    completed = set(store.episodes_in_state(EP_COMPLETED))
+    candidates = completed | set(store.output_episodes())
+    if episode_numbers is not None:
+        candidates &= set(episode_numbers)
+    done = set()
+    for ep_num in sorted(candidates):
+        state, reason = check_output(store, output_dir, title, ep_num, ep_num in completed, verify_hash)
+        if state == OUTPUT_OK:
+            done.add(ep_num)
+            continue
+        if reason:
+            logger.warning(f"第 {ep_num} 集需要重新下载: {reason}")
+        if state == OUTPUT_CORRUPT:
+            discard_output(store, output_dir, title, ep_num, logger)
+        else:
+            store.forget_episode(ep_num)
+    return done
+
+def skip_completed(urls: List[str], episode_numbers: List[int], output_dir: str, title: str,
+                   verify_hash: bool = False, logger=None) -> Tuple[List[str], List[int]]:
+    """在解析m3u8链接和入队之前去掉输出已完整的剧集，返回剩余的 (urls, episode_numbers)"""
+    logger = logger or logging.getLogger(__name__)
+    done = completed_episodes(output_dir, title, episode_numbers, verify_hash, logger)
+    if not done:
+        return list(urls), list(episode_numbers)
+    logger.info(f"⏭️ 已下载完成，跳过: {sorted(done)}")
+    remaining = [(url, ep_num) for url, ep_num in zip(urls, episode_numbers) if ep_num not in done]
+    return [url for url, _ in remaining], [ep_num for _, ep_num in remaining]
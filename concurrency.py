@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from progress_log import read_latest_progress
+from retry_policy import FAILURE_STOPPED
+from scheduler import EpisodeScheduler
+from settings import state_path
+from state_store import StateStore, STATE_DB_FILE
+
+# 采样周期（秒）
+DEFAULT_SAMPLE_INTERVAL = 30
+# 吞吐提升不足这个比例视为持平
+IMPROVEMENT_THRESHOLD = 0.10
+# 回退或减半后保持不变的采样周期数
+HOLD_TICKS = 4
+
+@dataclass
+class HostState:
+    """单个CDN主机的AIMD状态"""
+    limit: int
+    best_rate: float = 0.0
+    rate_before_increase: Optional[float] = None
+    errors: int = 0
+    hold: int = 0
+    dirty: bool = False
+
+class AdaptiveConcurrencyController:
+    """按CDN主机自适应调整并发数（AIMD）
+
+    定期从正在下载的剧集的进度记录中采样各主机的总字节速率：
+    - 有排队任务且并发已用满时，加一个并发（加性增）；
+    - 加并发后吞吐没有明显提升，退回上一个并发并保持一段时间；
+    - 采样周期内出现下载错误（403/429/5xx 等），并发减半（乘性减）。
+    每个主机收敛后的并发数保存在全局状态库中，下次运行直接从该值开始。
+    """
+
+    def __init__(self, scheduler: EpisodeScheduler, interval: float = DEFAULT_SAMPLE_INTERVAL,
+                 store: Optional[StateStore] = None, logger=None):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.store = store or StateStore(state_path(STATE_DB_FILE))
+        self.logger = logger or logging.getLogger(__name__)
+        self._hosts: Dict[str, HostState] = {}
+        self._last_bytes: Dict[str, float] = {}
+        self._last_tick = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _host_state(self, host: str) -> HostState:
+        """首次见到主机时加载上次运行记住的并发数（调用方持有锁）"""
+        state = self._hosts.get(host)
+        if state is None:
+            saved = self.store.host_stats_get(host)
+            if saved:
+                state = HostState(limit=saved["concurrency"], best_rate=saved["best_rate"])
+            else:
+                state = HostState(limit=self.scheduler.per_host_limit)
+            self._hosts[host] = state
+            self.scheduler.set_host_limit(host, state.limit)
+        return state
+
+    def prepare_host(self, host: str):
+        """任务入队前调用，使调度器一开始就使用记住的并发数"""
+        with self._lock:
+            self._host_state(host)
+
+    def record_result(self, host: str, success: bool, failure: Optional[str] = None):
+        """下载结束时调用，失败（用户停止除外）计为该主机的错误"""
+        if success or failure == FAILURE_STOPPED:
+            return
+        with self._lock:
+            self._host_state(host).errors += 1
+
+    def _sample_rates(self, elapsed: float) -> Dict[str, float]:
+        """各主机在上个周期内的字节速率"""
+        rates: Dict[str, float] = {}
+        seen = set()
+        for job in self.scheduler.running_jobs():
+            progress_log = os.path.join(job.output_dir, f"ep_{job.ep_num}_progress.log")
+            record = read_latest_progress(progress_log) or {}
+            downloaded = record.get("downloaded")
+            if downloaded is None:
+                continue
+            seen.add(job.key)
+            previous = self._last_bytes.get(job.key)
+            self._last_bytes[job.key] = downloaded
+            # 新任务或重试后日志重置时只建立基线
+            if previous is None or downloaded < previous:
+                continue
+            rates[job.host] = rates.get(job.host, 0.0) + (downloaded - previous) / elapsed
+        for key in list(self._last_bytes):
+            if key not in seen:
+                del self._last_bytes[key]
+        return rates
+
+    def tick(self):
+        """执行一次采样和调整"""
+        now = time.monotonic()
+        elapsed = max(now - self._last_tick, 1e-6)
+        self._last_tick = now
+        rates = self._sample_rates(elapsed)
+        pending = self.scheduler.pending_hosts()
+        running: Dict[str, int] = {}
+        for job in self.scheduler.running_jobs():
+            running[job.host] = running.get(job.host, 0) + 1
+
+        with self._lock:
+            for host in set(rates) | set(pending) | set(running):
+                state = self._host_state(host)
+                self._adjust(host, state, rates.get(host, 0.0),
+                             pending.get(host, 0), running.get(host, 0))
+                if state.dirty:
+                    self.store.host_stats_put(host, state.limit, state.best_rate)
+                    state.dirty = False
+
+    def _adjust(self, host: str, state: HostState, rate: float, pending: int, running: int):
+        old_limit = state.limit
+        errors, state.errors = state.errors, 0
+
+        if errors:
+            state.limit = max(1, state.limit // 2)
+            state.rate_before_increase = None
+            state.hold = HOLD_TICKS
+        elif state.hold > 0:
+            state.hold -= 1
+        elif state.rate_before_increase is not None:
+            # 上个周期刚加过并发，检查吞吐是否真的提升
+            if rate < state.rate_before_increase * (1 + IMPROVEMENT_THRESHOLD):
+                state.limit = max(1, state.limit - 1)
+                state.hold = HOLD_TICKS
+            state.rate_before_increase = None
+        elif rate > 0 and pending and running >= state.limit and state.limit < self.scheduler.max_workers:
+            state.rate_before_increase = rate
+            state.limit += 1
+            # 新加的任务第一个周期只建立速率基线，隔一个周期再评估
+            state.hold = 1
+
+        if rate > state.best_rate:
+            state.best_rate = rate
+            state.dirty = True
+        if state.limit != old_limit:
+            state.dirty = True
+            self.scheduler.set_host_limit(host, state.limit)
+            self.logger.info(f"主机 {host} 并发 {old_limit} -> {state.limit} "
+                             f"(速率 {rate / 1024 / 1024:.2f}MiB/s, 错误 {errors})")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                self.logger.error(f"自适应并发采样出错: {e}")
+
+    def start(self):
+        self._last_tick = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="adaptive-concurrency", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
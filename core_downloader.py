@@ -1,36 +1,50 @@
 import subprocess
 import os
+import shutil
 import logging
 import sys
 import psutil
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import time
-import random
 import json
 import signal
+import threading
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
 from m3u8_extractor import extract_m3u8_url
+from m3u8_cache import M3u8Cache, resolve_variant
+from hls_playlist import VariantPolicy
+from progress_log import read_tail, read_latest_progress
+from metrics import (MetricsFlusher, METRICS_FILE, episode_download_seconds, episodes_total,
+                     retries_total, downloaded_bytes_total, m3u8_extract_seconds, m3u8_resolved_total)
+from state_store import open_store, EP_FAILED, EP_RETRYING
+from completion_index import record_completion, discard_output, skip_completed
+from segment_cache import SegmentCache
+from backends import BackendError, get_backend, select_engine, load_backend_config
+from concurrency import AdaptiveConcurrencyController
+from bandwidth import BandwidthLimiter, ThrottlingProxy, config_exists, current_rate, format_rate
+from retry_policy import (classify_failure, backoff_delay, DEFAULT_MAX_RETRIES,
+                          FAILURE_EXPIRED, FAILURE_PERMANENT, FAILURE_STOPPED, FAILURE_TRANSIENT)
+from scheduler import (EpisodeJob, EpisodeScheduler, DEFAULT_MAX_WORKERS, DEFAULT_PER_HOST_LIMIT,
+                       ENGINE_YTDLP, ENGINE_NATIVE, ENGINE_AUTO, OUTPUT_REMUX, OUTPUT_STREAM, OUTPUT_TS)
 import re
 from urllib.parse import urlparse
 
-# 缓存m3u8链接的文件名
+# 旧版按目录缓存m3u8链接的文件名（已迁移到全局缓存 m3u8_cache.M3u8Cache）
 M3U8_CACHE_FILE = "m3u8_cache.json"
 PROCESS_MANAGER_FILE = "download_manager.pid"
 
-# 修改下载状态文件路径
-DOWNLOAD_STATUS_FILE = "download_status.json"
-ACTIVE_DOWNLOADS_FILE = "active_downloads.json"  # 改为JSON格式
+# 下载状态和活动下载保存在每个下载目录的SQLite状态库中（state_store.STATE_DB_FILE），
+# 旧版的 download_status.json / active_downloads.json 会在首次打开时自动导入
 
-# 在文档1的顶部添加
-STOP_FLAG_FILE = "stop_flag"
+# 判断失败类型时读取的下载日志末尾字节数
+FAILURE_TAIL_BYTES = 16384
 
-def check_stop_flag(output_dir: str) -> bool:
-    """检查是否设置了停止标志"""
-    return os.path.exists(os.path.join(output_dir, STOP_FLAG_FILE))
+# 并发提取m3u8链接的线程数（实际请求速率由站点令牌桶限制）
+DEFAULT_EXTRACT_WORKERS = 4
 
-def set_stop_flag(output_dir: str):
-    """设置停止标志"""
-    with open(os.path.join(output_dir, STOP_FLAG_FILE), 'w') as f:
-        f.write('1')
+# 旧版本的停止标志文件，现在停止请求通过信号送达，只在启动时清除遗留的文件
+STOP_FLAG_FILE = "stop_flag"
 
 def clear_stop_flag(output_dir: str):
     """清除停止标志"""
@@ -39,70 +53,123 @@ def clear_stop_flag(output_dir: str):
     except FileNotFoundError:
         pass
 
+class DownloadSupervisor:
+    """跟踪守护进程内的下载子进程
+
+    下载线程阻塞在 process.wait() 上，子进程一退出就立刻唤醒；
+    停止请求通过信号(SIGTERM/SIGINT)送达，立即终止所有子进程，不再轮询停止标志文件。
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def on_stop(self, callback):
+        """注册收到停止请求时调用的回调（例如停止调度器）"""
+        self._callbacks.append(callback)
+
+    def register(self, key: str, process: subprocess.Popen):
+        with self._lock:
+            self._processes[key] = process
+        # 注册前已收到停止请求时也要终止
+        if self.job_stopped(key):
+            self._terminate(process)
+
+    def cancel(self, key: str):
+        """取消单个剧集：终止其下载进程，进程内引擎通过 job_stopped 感知"""
+        with self._lock:
+            self._cancelled.add(key)
+            process = self._processes.get(key)
+        if process is not None:
+            self._terminate(process)
+
+    def uncancel(self, key: str):
+        """剧集重新入队时清除取消标记"""
+        with self._lock:
+            self._cancelled.discard(key)
+
+    def job_stopped(self, key: str) -> bool:
+        return self.stop_event.is_set() or key in self._cancelled
+
+    def unregister(self, key: str):
+        with self._lock:
+            self._processes.pop(key, None)
+
+    def _terminate(self, process: subprocess.Popen):
+        if process.poll() is not None:
+            return
+        try:
+            # 子进程使用独立的进程组，连同yt-dlp启动的ffmpeg一起终止
+            if sys.platform != "win32":
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.terminate()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def request_stop(self):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        for callback in self._callbacks:
+            callback()
+        with self._lock:
+            processes = list(self._processes.values())
+        for process in processes:
+            self._terminate(process)
+
+    def install_signal_handlers(self):
+        """SIGTERM/SIGINT 即为停止请求（monitor.py --stop 发送SIGTERM）"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self.request_stop())
+
+# 守护进程内唯一的下载监管器
+supervisor = DownloadSupervisor()
+
 def get_download_status(output_dir: str) -> Dict:
     """获取下载状态"""
-    status_file = os.path.join(output_dir, DOWNLOAD_STATUS_FILE)
-    if os.path.exists(status_file):
-        with open(status_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"completed": [], "failed": [], "progress": {}}
+    return open_store(output_dir).get_status()
 
 def save_download_status(output_dir: str, status: Dict, original_url: Optional[str] = None):
     """保存下载状态，并包含原始脚本入参URL"""
-    status_file = os.path.join(output_dir, DOWNLOAD_STATUS_FILE)
-
     # 如果提供了原始URL，将其添加到状态中
     if original_url:
         status["original_url"] = original_url
 
-    with open(status_file, 'w', encoding='utf-8') as f:
-        json.dump(status, f, ensure_ascii=False, indent=2)
+    open_store(output_dir).save_status(status)
 
-def update_active_downloads(output_dir: str, ep_num: int, pid: int, m3u8_url: str):
-    """更新活动下载记录"""
-    active_file = os.path.join(output_dir, ACTIVE_DOWNLOADS_FILE)
-    active_data = {}
+def record_original_url(output_dir: str, original_url: str):
+    """记录原始脚本入参URL，不改动各集状态"""
+    open_store(output_dir).set_meta("original_url", original_url)
 
-    if os.path.exists(active_file):
-        with open(active_file, 'r', encoding='utf-8') as f:
-            active_data = json.load(f)
+def record_queue(output_dir: str, episode_numbers: List[int]):
+    """记录本次排队下载的集数，供监控计算整体剩余时间"""
+    open_store(output_dir).set_meta("queue", list(episode_numbers))
 
-    active_data[str(ep_num)] = {
-        "pid": pid,
-        "m3u8_url": m3u8_url,
-        "start_time": time.strftime('%Y-%m-%d %H:%M:%S')
-    }
+def update_active_downloads(output_dir: str, ep_num: int, pid: int, m3u8_url: str,
+                            engine: str = ENGINE_YTDLP):
+    """更新活动下载记录"""
+    open_store(output_dir).set_active(ep_num, pid, m3u8_url, engine)
 
-    with open(active_file, 'w', encoding='utf-8') as f:
-        json.dump(active_data, f, ensure_ascii=False, indent=2)
+def finish_active_download(output_dir: str, ep_num: int, success: bool):
+    """在同一事务中记录结果并移除活动记录"""
+    open_store(output_dir).finish_active(ep_num, success)
 
 def remove_active_download(output_dir: str, ep_num: int):
     """移除完成或失败的下载记录"""
-    active_file = os.path.join(output_dir, ACTIVE_DOWNLOADS_FILE)
-    if os.path.exists(active_file):
-        with open(active_file, 'r', encoding='utf-8') as f:
-            active_data = json.load(f)
-
-        if str(ep_num) in active_data:
-            del active_data[str(ep_num)]
-
-            with open(active_file, 'w', encoding='utf-8') as f:
-                json.dump(active_data, f, ensure_ascii=False, indent=2)
+    open_store(output_dir).remove_active(ep_num)
 
 def load_m3u8_cache(output_dir):
-    """加载缓存的m3u8链接"""
+    """加载旧版按目录保存的m3u8链接缓存（仅用于迁移到全局缓存）"""
     cache_file = os.path.join(output_dir, M3U8_CACHE_FILE)
     if os.path.exists(cache_file):
         with open(cache_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     return {}
 
-def save_m3u8_cache(output_dir, cache_data):
-    """保存m3u8链接缓存"""
-    cache_file = os.path.join(output_dir, M3U8_CACHE_FILE)
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(cache_data, f, ensure_ascii=False, indent=2)
-
 def daemonize():
     """使进程成为守护进程"""
     # 在开始前检查停止标志
@@ -147,6 +214,16 @@ def write_pid_file(output_dir):
     with open(pid_file, 'w') as f:
         f.write(str(os.getpid()))
 
+def remove_pid_file(output_dir):
+    """删除PID文件（仅当记录的是本进程时）"""
+    pid_file = os.path.join(output_dir, PROCESS_MANAGER_FILE)
+    try:
+        with open(pid_file, 'r') as f:
+            if f.read().strip() == str(os.getpid()):
+                os.remove(pid_file)
+    except (FileNotFoundError, ValueError):
+        pass
+
 def extract_anthology_and_episode(url):
     """从URL中提取anthology和集数"""
     path = urlparse(url).path  # 获取URL的路径部分
@@ -167,90 +244,449 @@ def extract_anthology_and_episode(url):
 
     return anthology, episode_number
 
-def download_episodes(urls, output_dir, title, episode_numbers, logger=None):
+def download_episode_native(job: EpisodeJob, logger=None, segment_workers=None) -> bool:
+    """使用进程内HLS引擎下载单集"""
+    # 延迟导入，只用yt-dlp时不需要加载requests
+    from hls_downloader import HlsDownloader, remux_to_mp4, DEFAULT_SEGMENT_WORKERS
+
     if logger is None:
         logger = logging.getLogger(__name__)
 
-    # 加载已有的缓存
-    m3u8_cache = load_m3u8_cache(output_dir)
+    output_dir, ep_num = job.output_dir, job.ep_num
+    progress_log = os.path.join(output_dir, f"ep_{ep_num}_progress.log")
+    open(progress_log, 'w').close()
+
+    base_name = os.path.join(output_dir, f"{job.title}_第{ep_num}集")
+    ts_file = base_name + ".ts"
+
+    # 进程内下载没有独立的子进程，记录守护进程自身的PID
+    update_active_downloads(output_dir, ep_num, os.getpid(), job.m3u8_url, engine=ENGINE_NATIVE)
+
+    bandwidth = job.extra.get("bandwidth")
+    downloader = HlsDownloader(
+        workers=segment_workers or DEFAULT_SEGMENT_WORKERS,
+        should_stop=lambda: supervisor.job_stopped(job.key),
+        progress_log=progress_log,
+        throttle=bandwidth.consume if bandwidth else None,
+        variant_policy=job.extra.get("variant_policy"),
+        segment_cache=job.extra.get("segment_cache"),
+        # 流式封装的ffmpeg子进程交给 supervisor，停止时直接终止
+        register_process=lambda process: supervisor.register(job.key, process),
+        logger=logger
+    )
+    store = open_store(output_dir)
+    attempt_id = store.start_attempt(ep_num, job.m3u8_url)
+    output_mode = job.extra.get("output_mode") or OUTPUT_REMUX
+    if output_mode == OUTPUT_STREAM and not shutil.which('ffmpeg'):
+        logger.warning("未找到ffmpeg，改为输出单个TS文件")
+        output_mode = OUTPUT_TS
+
+    if output_mode == OUTPUT_STREAM:
+        # 分片按顺序直接送入ffmpeg，不写中间文件
+        try:
+            success = downloader.download_remux(job.m3u8_url, base_name + ".mp4")
+        finally:
+            supervisor.unregister(job.key)
+    else:
+        # 分片日志记录已写入的分片，失败/停止后重新下载时只补缺失部分
+        journal = store.fragment_journal(ep_num)
+        success = downloader.download(job.m3u8_url, ts_file, journal=journal)
+        if success:
+            journal.clear()
+            if output_mode == OUTPUT_REMUX and remux_to_mp4(ts_file, base_name + ".mp4"):
+                logger.info(f"第 {ep_num} 集已封装为MP4")
+
+    if success:
+        job.expected_duration = downloader.last_duration
+    else:
+        job.failure = classify_failure(None, downloader.last_error or "",
+                                       stopped=supervisor.job_stopped(job.key))
+    store.finish_attempt(attempt_id, None, success, job.failure)
+    return success
 
-    # 先提取所有m3u8链接并缓存（这部分保持在前台）
-    logger.info("⏳ 正在提取m3u8链接...")
-    for url, ep_num in zip(urls, episode_numbers):
-        if str(ep_num) not in m3u8_cache:
+def download_episode(job: EpisodeJob, logger=None) -> bool:
+    """用 job.engine 对应的后端下载单集，阻塞直到下载结束，返回是否成功
+
+    失败时 job.failure 记录失败类型；剧集最终状态由 process_episode 决定。
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    backend = get_backend(job.engine)
+    if backend.in_process:
+        return download_episode_native(job, logger, job.extra.get("segment_workers"))
+
+    output_dir, ep_num = job.output_dir, job.ep_num
+    progress_log = os.path.join(output_dir, f"ep_{ep_num}_progress.log")
+    # 清空进度日志
+    open(progress_log, 'w').close()
+    store = open_store(output_dir)
+
+    try:
+        context = backend.prepare(job, logger)
+        cmd = backend.build_command(job, context)
+    except BackendError as e:
+        logger.error(f"第 {ep_num} 集无法开始下载: {e}")
+        job.failure = e.failure
+        store.finish_attempt(store.start_attempt(ep_num, job.m3u8_url), None, False, job.failure)
+        return False
+
+    returncode = 0
+    if cmd is not None:
+        # 追加方式打开，watch_progress 写入的进度记录与下载程序的输出不会互相覆盖
+        with open(progress_log, 'a') as log_f:
+            try:
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=log_f,
+                    stderr=subprocess.STDOUT,
+                    env=backend.environment(),
+                    preexec_fn=os.setsid if sys.platform != "win32" else None
+                )
+            except OSError as e:
+                logger.error(f"无法启动 {cmd[0]}: {e}")
+                job.failure = FAILURE_PERMANENT
+                store.finish_attempt(store.start_attempt(ep_num, job.m3u8_url), None, False, job.failure)
+                return False
+
+        # 更新活动下载记录
+        update_active_downloads(output_dir, ep_num, process.pid, job.m3u8_url, engine=backend.name)
+        attempt_id = store.start_attempt(ep_num, job.m3u8_url)
+
+        watcher, watch_stop = None, threading.Event()
+        if backend.watches_progress:
+            watcher = threading.Thread(target=backend.watch_progress,
+                                       args=(job, context, progress_log, watch_stop),
+                                       name=f"progress-{ep_num}", daemon=True)
+            watcher.start()
+
+        # 阻塞等待子进程退出，停止请求由 supervisor 直接终止子进程
+        supervisor.register(job.key, process)
+        try:
+            process.wait()
+        finally:
+            supervisor.unregister(job.key)
+            watch_stop.set()
+            if watcher is not None:
+                watcher.join()
+        returncode = process.returncode
+    else:
+        attempt_id = store.start_attempt(ep_num, job.m3u8_url)
+
+    stopped = supervisor.job_stopped(job.key)
+    if stopped:
+        logger.info(f"已终止第 {ep_num} 集的下载")
+
+    output = ""
+    if returncode != 0:
+        try:
+            output = "\n".join(read_tail(progress_log, FAILURE_TAIL_BYTES))
+        except OSError:
+            pass
+    job.failure = backend.classify_exit(returncode, output, stopped)
+    if job.failure is None:
+        try:
+            backend.finish(job, context, logger)
+        except BackendError as e:
+            logger.error(f"第 {ep_num} 集下载后处理失败: {e}")
+            job.failure = e.failure
+
+    success = job.failure is None
+    if success:
+        # 外部下载程序内部的分片请求无法逐个统计，按最后一条进度记录计入字节数
+        downloaded = (read_latest_progress(progress_log) or {}).get("downloaded")
+        if downloaded:
+            downloaded_bytes_total.inc(downloaded, engine=backend.name)
+
+    store.finish_attempt(attempt_id, returncode, success, job.failure)
+    return success
+
+def select_variant(cache: M3u8Cache, page_url: str, m3u8_url: str,
+                   policy: VariantPolicy, logger=None) -> Tuple[str, Optional[str]]:
+    """按策略选择主播放列表中的版本并记入缓存，返回 (下载链接, 版本描述)"""
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    entry = cache.peek(page_url) or {}
+    if entry.get("variant_url") == m3u8_url and entry.get("variant_policy") == policy.spec:
+        return m3u8_url, entry.get("variant_info") or None
+    try:
+        variant_url, info = resolve_variant(m3u8_url, policy)
+    except Exception as e:
+        # 选择失败时退回原链接，由下载器按默认（最高码率）处理
+        logger.warning(f"读取主播放列表失败，使用默认版本: {e}")
+        return m3u8_url, None
+    cache.set_variant(page_url, policy, variant_url, info)
+    return variant_url, info
+
+def re_resolve_m3u8(job: EpisodeJob, logger=None) -> Optional[str]:
+    """链接过期时重新解析m3u8并更新全局缓存"""
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    cache = M3u8Cache(logger=logger)
+    cache.invalidate(job.page_url)
+    m3u8_url = extract_m3u8_url(job.page_url)
+    if m3u8_url:
+        cache.put(job.page_url, m3u8_url)
+        policy = job.extra.get("variant_policy")
+        if policy is not None:
+            m3u8_url, _ = select_variant(cache, job.page_url, m3u8_url, policy, logger)
+        logger.info(f"第 {job.ep_num} 集的m3u8链接已重新解析")
+    return m3u8_url
+
+def process_episode(job: EpisodeJob, scheduler: EpisodeScheduler, logger=None,
+                    max_retries: int = DEFAULT_MAX_RETRIES, controller=None) -> bool:
+    """下载单集并决定最终状态：成功、放弃，或按失败类型重新排到队尾"""
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    host = job.host
+    started = time.monotonic()
+    success = download_episode(job, logger)
+    episode_download_seconds.observe(time.monotonic() - started, engine=job.engine,
+                                     result="ok" if success else "failed")
+    if success:
+        # 检查输出文件并记入完成索引，截断或无法解析的输出按临时失败重新下载
+        success, problem = record_completion(job.output_dir, job.title, job.ep_num, job.expected_duration,
+                                             job.extra.get("hash_outputs", False))
+        if not success:
+            logger.error(f"第 {job.ep_num} 集: {problem}")
+            job.failure = FAILURE_TRANSIENT
+            discard_output(open_store(job.output_dir), job.output_dir, job.title, job.ep_num, logger)
+    if controller is not None:
+        controller.record_result(host, success, job.failure)
+
+    if success:
+        episodes_total.inc(result="completed")
+        finish_active_download(job.output_dir, job.ep_num, True)
+        return True
+
+    if (job.failure in (FAILURE_STOPPED, FAILURE_PERMANENT)
+            or job.attempt >= max_retries or supervisor.job_stopped(job.key)):
+        episodes_total.inc(result="failed")
+        finish_active_download(job.output_dir, job.ep_num, False)
+        logger.error(f"第 {job.ep_num} 集下载失败 ({job.failure}, 已重试 {job.attempt} 次)")
+        return False
+
+    # 重试使用新的任务对象，排到队尾，不阻塞其它剧集
+    retry = dataclasses.replace(job, attempt=job.attempt + 1, failure=None)
+    delay = backoff_delay(retry.attempt)
+    if job.failure == FAILURE_EXPIRED:
+        m3u8_url = re_resolve_m3u8(job, logger)
+        if m3u8_url:
+            retry.m3u8_url = m3u8_url
+            delay = 0
+
+    episodes_total.inc(result="retrying")
+    retries_total.inc(failure=job.failure or "unknown")
+    open_store(job.output_dir).transition(job.ep_num, EP_RETRYING)
+    resume = "" if get_backend(job.engine).supports_resume(job) else "，不支持续传，将从头下载"
+    logger.info(f"第 {job.ep_num} 集失败 ({job.failure})，{delay:.0f} 秒后第 {retry.attempt} 次重试{resume}")
+    scheduler.submit(retry, delay)
+    return False
+
+def fail_pending_retries(jobs: List[EpisodeJob], logger=None):
+    """被移除或因停止而丢弃的重试任务记为失败，不会一直显示为等待重试"""
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    for job in jobs:
+        if job.attempt:
+            open_store(job.output_dir).transition(job.ep_num, EP_FAILED)
+            logger.info(f"第 {job.ep_num} 集的重试已取消，记为失败")
+
+def resolve_m3u8_urls(urls, episode_numbers, output_dir, logger=None,
+                      extract_workers=DEFAULT_EXTRACT_WORKERS,
+                      variant_policy: Optional[VariantPolicy] = None) -> Dict[int, str]:
+    """解析各集的m3u8链接：优先使用全局缓存中仍有效的链接，只重新解析失效的
+
+    指定 variant_policy 时在这里完成主播放列表的版本选择，选中的版本记入缓存和下载状态。
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    cache = M3u8Cache(logger=logger)
+
+    # 把旧版按集数保存的目录缓存迁移到以页面URL为键的全局缓存
+    legacy_cache = load_m3u8_cache(output_dir)
+    if legacy_cache:
+        legacy_time = os.path.getmtime(os.path.join(output_dir, M3U8_CACHE_FILE))
+        for url, ep_num in zip(urls, episode_numbers):
+            if str(ep_num) in legacy_cache and not cache.peek(url):
+                cache.put(url, legacy_cache[str(ep_num)], resolved_at=legacy_time)
+
+    m3u8_urls = {}
+    variants = {}
+
+    def resolve_one(url, ep_num):
+        m3u8_url = cache.get(url, policy=variant_policy)
+        if m3u8_url:
+            m3u8_resolved_total.inc(source="cache")
+        else:
             logger.info(f"正在提取第 {ep_num} 集的m3u8链接...")
+            started = time.monotonic()
             m3u8_url = extract_m3u8_url(url)
+            m3u8_extract_seconds.observe(time.monotonic() - started, result="ok" if m3u8_url else "failed")
             if not m3u8_url:
+                m3u8_resolved_total.inc(source="failed")
                 logger.error(f"⚠️ 无法提取第 {ep_num} 集的m3u8链接")
-                continue
-            m3u8_cache[str(ep_num)] = m3u8_url
-            save_m3u8_cache(output_dir, m3u8_cache)
-            time.sleep(random.uniform(1, 3))
-
-    save_m3u8_cache(output_dir, m3u8_cache)
-    logger.info("✅ m3u8链接提取完成并已缓存")
+                return
+            m3u8_resolved_total.inc(source="extracted")
+            cache.put(url, m3u8_url)
+        if variant_policy is not None:
+            m3u8_url, info = select_variant(cache, url, m3u8_url, variant_policy, logger)
+            if info:
+                variants[str(ep_num)] = info
+        m3u8_urls[ep_num] = m3u8_url
 
-    # 关键修改点：将实际下载部分放入后台
-    def run_downloader():
-        clear_stop_flag(output_dir)  # 开始前清除停止标志
-        status = get_download_status(output_dir)
+    logger.info("⏳ 正在提取m3u8链接...")
+    # 并发解析/探测，请求间隔由 rate_limiter 的站点令牌桶控制
+    with ThreadPoolExecutor(max_workers=max(1, extract_workers)) as pool:
+        list(pool.map(lambda item: resolve_one(*item), zip(urls, episode_numbers)))
+
+    if variants:
+        store = open_store(output_dir)
+        store.set_meta("variants", {**store.get_meta("variants", {}), **variants})
+        logger.info(f"🎚️ 版本选择策略 {variant_policy.spec}: "
+                    + ", ".join(sorted(set(variants.values()))))
+
+    logger.info(f"✅ m3u8链接提取完成并已缓存 ({len(m3u8_urls)}/{len(urls)})")
+    return m3u8_urls
+
+def build_jobs(urls, episode_numbers, m3u8_urls: Dict[int, str], output_dir, title,
+               engine=ENGINE_YTDLP, extra=None, priority=0) -> List[EpisodeJob]:
+    """为已解析出m3u8链接的剧集创建下载任务（保持传入顺序）
+
+    engine 为 auto 时按 backends.json 为每集选择后端（按CDN主机或站点）。
+    """
+    config = load_backend_config() if engine == ENGINE_AUTO else None
+    jobs = []
+    for ep_num, url in zip(episode_numbers, urls):
+        m3u8_url = m3u8_urls.get(ep_num)
+        if not m3u8_url:
+            continue
+        job_engine = select_engine(m3u8_url, url, config) if engine == ENGINE_AUTO else engine
+        jobs.append(EpisodeJob(ep_num=ep_num, page_url=url, m3u8_url=m3u8_url,
+                               output_dir=output_dir, title=title, engine=job_engine,
+                               extra=dict(extra or {}), priority=priority))
+    return jobs
+
+def download_episodes(urls, output_dir, title, episode_numbers, logger=None, **options):
+    """下载一部剧的若干集（参数同 download_series）"""
+    download_series([{"urls": urls, "output_dir": output_dir, "title": title,
+                      "episode_numbers": episode_numbers}], logger, **options)
+
+def run_series(series: List[Dict], logger=None,
+               max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+               engine=ENGINE_YTDLP, segment_workers=None, max_retries=DEFAULT_MAX_RETRIES,
+               adaptive=False, bandwidth=False, variant_policy=None, output_mode=OUTPUT_REMUX,
+               hash_outputs=False, segment_cache=None):
+    """在当前进程中下载已解析出m3u8链接（series 各项的 m3u8_urls）的剧集，阻塞直到全部结束
+
+    hash_outputs 为 True 时，完成索引同时记录输出文件的内容哈希；
+    segment_cache 为分片缓存的大小上限（字节），native引擎下载前先查找本地缓存的相同分片。
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    output_dirs = [item["output_dir"] for item in series]
+    for output_dir in output_dirs:
+        clear_stop_flag(output_dir)  # 清除旧版本遗留的停止标志
+        write_pid_file(output_dir)
+    supervisor.install_signal_handlers()
+
+    scheduler = EpisodeScheduler(
+        worker=lambda job: process_episode(job, scheduler, logger, max_retries, controller),
+        max_workers=max_workers,
+        per_host_limit=per_host_limit,
+        on_dropped=lambda jobs: fail_pending_retries(jobs, logger),
+        logger=logger
+    )
+    supervisor.on_stop(scheduler.stop)
+
+    # 自适应并发：按实测吞吐和错误率调整每个CDN主机的并发数
+    controller = AdaptiveConcurrencyController(scheduler, logger=logger) if adaptive else None
+
+    # 全局带宽限制：所有剧集共享一个令牌桶，速率随配置文件/时间表实时调整
+    limiter, proxy = None, None
+    extra = {"segment_workers": segment_workers, "variant_policy": variant_policy,
+             "output_mode": output_mode, "hash_outputs": hash_outputs}
+    if segment_cache and engine in (ENGINE_NATIVE, ENGINE_AUTO):
+        extra["segment_cache"] = SegmentCache(segment_cache, logger=logger)
+    if bandwidth:
+        limiter = BandwidthLimiter(logger=logger)
+        limiter.start()
+        extra["bandwidth"] = limiter
+        if engine != ENGINE_NATIVE:
+            # 外部下载程序（yt-dlp/aria2c）经本地限速代理下载
+            proxy = ThrottlingProxy(limiter)
+            proxy.start()
+            extra["proxy"] = proxy.url
+
+    # 按队列顺序提交，调度器负责并发和每主机限流
+    for item in series:
+        jobs = build_jobs(item["urls"], item["episode_numbers"], item["m3u8_urls"],
+                          item["output_dir"], item["title"], engine, extra)
+        record_queue(item["output_dir"], [job.ep_num for job in jobs])
+        for job in jobs:
+            if controller is not None:
+                controller.prepare_host(job.host)
+            scheduler.submit(job)
+
+    if controller is not None:
+        controller.start()
+    # 各阶段的计时和计数定期写入下载目录的 metrics.json
+    flusher = MetricsFlusher([os.path.join(output_dir, METRICS_FILE) for output_dir in output_dirs],
+                             logger=logger)
+    flusher.start()
 
-        for ep_num, url in zip(episode_numbers, urls):
-            if check_stop_flag(output_dir):  # 检查停止标志
-                logger.info("检测到停止请求，终止下载")
-                break
+    try:
+        scheduler.run()
+    finally:
+        flusher.stop()
+        if controller is not None:
+            controller.stop()
+        if limiter is not None:
+            limiter.stop()
+        if proxy is not None:
+            proxy.stop()
+        for output_dir in output_dirs:
+            remove_pid_file(output_dir)
+
+def download_series(series: List[Dict], logger=None,
+                    max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                    engine=ENGINE_YTDLP, segment_workers=None,
+                    extract_workers=DEFAULT_EXTRACT_WORKERS, max_retries=DEFAULT_MAX_RETRIES,
+                    adaptive=False, bandwidth=False, variant_policy=None,
+                    output_mode=OUTPUT_REMUX, hash_outputs=False, segment_cache=None):
+    """在一个后台进程中下载多部剧，所有剧集进入同一个调度队列
+
+    series 中每一项包含 urls、output_dir、title、episode_numbers。
+    完成索引中输出完整的剧集直接跳过，不解析m3u8也不启动下载；
+    hash_outputs 为 True 时记录并校验输出文件的内容哈希；segment_cache 见 run_series。
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
 
-            str_ep_num = str(ep_num)
-            if str_ep_num not in m3u8_cache:
-                continue
+    # 跳过已完成的剧集（只检查本地文件）
+    for item in series:
+        item["urls"], item["episode_numbers"] = skip_completed(
+            item["urls"], item["episode_numbers"], item["output_dir"], item["title"], hash_outputs, logger)
+    series = [item for item in series if item["episode_numbers"]]
+    if not series:
+        logger.info("✅ 所选剧集都已下载完成")
+        return
 
-            m3u8_url = m3u8_cache[str_ep_num]
-            progress_log = os.path.join(output_dir, f"ep_{ep_num}_progress.log")
+    # 先提取所有m3u8链接并缓存（这部分保持在前台）
+    for item in series:
+        item["m3u8_urls"] = resolve_m3u8_urls(item["urls"], item["episode_numbers"], item["output_dir"],
+                                              logger, extract_workers, variant_policy)
 
-            # 清空进度日志
-            open(progress_log, 'w').close()
-
-            # 生成输出文件名
-            output_file = os.path.join(output_dir, f"{title}_第{ep_num}集.%(ext)s")
-
-            cmd = [
-                'yt-dlp',
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                '--newline',
-                '--progress',
-                '-o', output_file,
-                '--merge-output-format', 'mp4',
-                '--socket-timeout', '60',
-                '--verbose',
-                m3u8_url
-            ]
-
-            process = subprocess.Popen(
-                cmd,
-                stdout=open(progress_log, 'a'),
-                stderr=subprocess.STDOUT,
-                preexec_fn=os.setsid if sys.platform != "win32" else None
-            )
-
-            # 更新活动下载记录
-            update_active_downloads(output_dir, ep_num, process.pid, m3u8_url)
-
-            while process.poll() is None:
-                if check_stop_flag(output_dir):  # 检查停止标志
-                    process.terminate()
-                    logger.info(f"已终止第 {ep_num} 集的下载")
-                    break
-                time.sleep(10)
-
-            # 更新状态
-            if process.returncode == 0:
-                status["completed"].append(ep_num)
-            else:
-                status["failed"].append(ep_num)
+    # 指定了限速或已有全局带宽配置时启用，之后可用 monitor.py --limit 随时调整
+    bandwidth_enabled = bandwidth or config_exists()
 
-            # 移除活动记录
-            remove_active_download(output_dir, ep_num)
-            save_download_status(output_dir, status)
+    # 关键修改点：将实际下载部分放入后台
+    def run_downloader():
+        run_series(series, logger, max_workers, per_host_limit, engine, segment_workers,
+                   max_retries, adaptive, bandwidth_enabled, variant_policy, output_mode, hash_outputs,
+                   segment_cache)
 
     # 启动后台下载
     if sys.platform == "win32":
@@ -270,11 +706,21 @@ def download_episodes(urls, output_dir, title, episode_numbers, logger=None):
 
     # 给用户显示关键信息
     logger.info("✅ 后台下载已启动")
-    logger.info(f"📁 下载目录: {output_dir}")
-    logger.info("📋 可以通过以下方式查看详细进度:")
-    for ep_num in episode_numbers:
-        progress_log = os.path.join(output_dir, f"ep_{ep_num}_progress.log")
-        logger.info(f"  tail -f '{progress_log}'  # 查看第 {ep_num} 集进度")
-
-    logger.info(f"🛑 停止所有下载: python monitor.py {title} --stop")
-    logger.info(f"🔍 检查活动下载: python monitor.py {title}")
+    logger.info(f"🚦 并发设置: 同时下载 {max_workers} 集, 每个CDN主机最多 {per_host_limit} 集"
+                + (" (自适应调整)" if adaptive else ""))
+    logger.info(f"⚙️ 下载引擎: {engine}, 输出方式: {output_mode}")
+    if segment_cache and engine not in (ENGINE_NATIVE, ENGINE_AUTO):
+        logger.warning("分片缓存只用于 native 引擎，本次不启用")
+    if bandwidth_enabled:
+        logger.info(f"📶 全局带宽限制: {format_rate(current_rate())}"
+                    f" (调整: python monitor.py --limit 20Mbit)")
+    for item in series:
+        output_dir, title = item["output_dir"], item["title"]
+        logger.info(f"📁 下载目录: {output_dir}")
+        logger.info("📋 可以通过以下方式查看详细进度:")
+        for ep_num in item["episode_numbers"]:
+            progress_log = os.path.join(output_dir, f"ep_{ep_num}_progress.log")
+            logger.info(f"  tail -f '{progress_log}'  # 查看第 {ep_num} 集进度")
+
+        logger.info(f"🛑 停止所有下载: python monitor.py {title} --stop")
+        logger.info(f"🔍 检查活动下载: python monitor.py {title}")
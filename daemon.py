@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+import argparse
+import fcntl
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+from typing import Callable, Dict, Optional
+
+from bandwidth import BandwidthLimiter, ThrottlingProxy, config_exists
+from completion_index import skip_completed
+from concurrency import AdaptiveConcurrencyController
+from core_downloader import (supervisor, process_episode, resolve_m3u8_urls, build_jobs,
+                             fail_pending_retries, record_original_url, DEFAULT_EXTRACT_WORKERS)
+from daemon_client import socket_path, LOCK_FILE, LOG_FILE
+from hls_playlist import VariantPolicy
+from metrics import metrics, MetricsFlusher, METRICS_FILE, serve_metrics
+from rate_limiter import site_limiter
+from retry_policy import DEFAULT_MAX_RETRIES
+from scheduler import (EpisodeJob, EpisodeScheduler, DEFAULT_MAX_WORKERS, DEFAULT_PER_HOST_LIMIT,
+                       ENGINE_NATIVE, ENGINE_AUTO, ENGINES, OUTPUT_MODES, OUTPUT_REMUX)
+from segment_cache import SegmentCache
+from settings import state_path
+from state_store import open_store
+
+class DownloadDaemon:
+    """常驻下载守护进程，每台主机一个
+
+    监听 ~/.ov_downloader/daemon.sock（每行一个JSON请求/响应），提供
+    parse/enqueue/list/pause/resume/cancel/priority/configure/shutdown 命令。
+    所有剧集（不论属于哪部剧）共用一个调度器、一套HTTP/Cloudflare会话和带宽限制；
+    ov_downloader.py 和 monitor.py 只是发送请求的客户端。
+    各阶段的指标定期写入 ~/.ov_downloader/metrics.json，指定 metrics_port 时另外提供
+    Prometheus 格式的 http://127.0.0.1:<port>/metrics。
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS,
+                 per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                 adaptive: bool = False, logger=None, metrics_port: Optional[int] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.metrics_port = metrics_port
+        self.scheduler = EpisodeScheduler(
+            worker=self._process,
+            max_workers=max_workers,
+            per_host_limit=per_host_limit,
+            keep_alive=True,
+            on_dropped=lambda jobs: fail_pending_retries(jobs, self.logger),
+            logger=self.logger
+        )
+        self.adaptive = adaptive
+        self.controller: Optional[AdaptiveConcurrencyController] = None
+        self._metrics_server = None
+        self._config_lock = threading.Lock()
+        self._bandwidth_lock = threading.Lock()
+        self._limiter: Optional[BandwidthLimiter] = None
+        self._proxy: Optional[ThrottlingProxy] = None
+        self._segment_cache_lock = threading.Lock()
+        self._segment_cache: Optional[SegmentCache] = None
+        self._server: Optional[socketserver.BaseServer] = None
+
+    def _process(self, job: EpisodeJob):
+        process_episode(job, self.scheduler, self.logger,
+                        job.extra.get("max_retries", DEFAULT_MAX_RETRIES), self.controller)
+
+    def _bandwidth(self, engine: str) -> Dict:
+        """按需启动共享的带宽限制（外部下载程序yt-dlp/aria2c还需要本地限速代理）"""
+        with self._bandwidth_lock:
+            if self._limiter is None:
+                self._limiter = BandwidthLimiter(logger=self.logger)
+                self._limiter.start()
+            extra = {"bandwidth": self._limiter}
+            if engine != ENGINE_NATIVE:
+                if self._proxy is None:
+                    self._proxy = ThrottlingProxy(self._limiter)
+                    self._proxy.start()
+                extra["proxy"] = self._proxy.url
+            return extra
+
+    def _enable_adaptive(self):
+        with self._config_lock:
+            if self.controller is None:
+                self.controller = AdaptiveConcurrencyController(self.scheduler, logger=self.logger)
+                self.controller.start()
+                self.logger.info("已启用自适应并发")
+
+    def _start_metrics(self, port: int):
+        with self._config_lock:
+            if self._metrics_server is not None:
+                if port != self.metrics_port:
+                    self.logger.warning(f"指标已在端口 {self.metrics_port} 上提供，忽略端口 {port}")
+                return
+            try:
+                self._metrics_server = serve_metrics(port)
+                self.metrics_port = port
+                self.logger.info(f"指标: http://127.0.0.1:{port}/metrics")
+            except OSError as e:
+                self.logger.warning(f"无法监听指标端口 {port}: {e}")
+
+    def _shared_segment_cache(self, max_bytes: int) -> SegmentCache:
+        """所有native任务共用一个分片缓存，大小上限以最近一次请求为准"""
+        with self._segment_cache_lock:
+            if self._segment_cache is None:
+                self._segment_cache = SegmentCache(max_bytes, logger=self.logger)
+            self._segment_cache.max_bytes = int(max_bytes)
+            return self._segment_cache
+
+    # ---- 请求处理 ----
+    def handle(self, request: Dict) -> Dict:
+        handler = getattr(self, f"cmd_{request.get('cmd')}", None)
+        if handler is None:
+            return {"ok": False, "error": f"未知命令: {request.get('cmd')}"}
+        try:
+            return {"ok": True, **(handler(request) or {})}
+        except (KeyError, ValueError, TypeError) as e:
+            return {"ok": False, "error": f"参数错误: {e}"}
+        except Exception as e:
+            self.logger.error(f"处理请求 {request.get('cmd')} 出错: {e}", exc_info=True)
+            return {"ok": False, "error": str(e)}
+
+    def cmd_ping(self, request: Dict) -> Dict:
+        return {"pid": os.getpid()}
+
+    def cmd_parse(self, request: Dict) -> Dict:
+        """在守护进程中解析剧集页面，复用已经建立的会话和Cloudflare clearance"""
+        from url_parser import parse_video_page
+        if request.get("rate"):
+            site_limiter.configure(request["rate"], request.get("burst") or request["rate"])
+        result = parse_video_page(request["url"])
+        if not result:
+            raise ValueError("无法解析该页面")
+        return {"result": result}
+
+    def cmd_enqueue(self, request: Dict) -> Dict:
+        """加入一部剧的若干集；m3u8链接在后台解析，客户端立即返回"""
+        output_dir = os.path.abspath(request["output_dir"])
+        urls = list(request["urls"])
+        episode_numbers = [int(ep) for ep in request["episode_numbers"]]
+        engine = request.get("engine") or ENGINE_AUTO
+        output_mode = request.get("output_mode") or OUTPUT_REMUX
+        if engine not in ENGINES + (ENGINE_AUTO,) or output_mode not in OUTPUT_MODES:
+            raise ValueError(f"不支持的引擎或输出方式: {engine}, {output_mode}")
+        variant_policy = VariantPolicy.parse(request["variant"]) if request.get("variant") else None
+
+        os.makedirs(output_dir, exist_ok=True)
+        if request.get("original_url"):
+            record_original_url(output_dir, request["original_url"])
+        if request.get("max_workers") or request.get("per_host_limit"):
+            self.scheduler.configure(request.get("max_workers"), request.get("per_host_limit"))
+        if request.get("rate"):
+            site_limiter.configure(request["rate"], request.get("burst") or request["rate"])
+
+        extra = {
+            "segment_workers": request.get("segment_workers"),
+            "variant_policy": variant_policy,
+            "output_mode": output_mode,
+            "max_retries": request.get("max_retries", DEFAULT_MAX_RETRIES),
+            "hash_outputs": bool(request.get("hash_outputs")),
+        }
+        if request.get("bandwidth") or config_exists():
+            extra.update(self._bandwidth(engine))
+        if request.get("segment_cache") and engine in (ENGINE_NATIVE, ENGINE_AUTO):
+            extra["segment_cache"] = self._shared_segment_cache(request["segment_cache"])
+
+        def resolve_and_submit():
+            # 输出已完整的剧集不解析m3u8、不入队
+            remaining_urls, remaining = skip_completed(urls, episode_numbers, output_dir, request["title"],
+                                                       extra["hash_outputs"], self.logger)
+            if not remaining:
+                return
+            m3u8_urls = resolve_m3u8_urls(remaining_urls, remaining, output_dir, self.logger,
+                                          request.get("extract_workers") or DEFAULT_EXTRACT_WORKERS,
+                                          variant_policy)
+            jobs = build_jobs(urls, episode_numbers, m3u8_urls, output_dir, request["title"],
+                              engine, extra, int(request.get("priority") or 0))
+            # 已在队列中或正在下载的剧集不重复加入（批量清单重复运行时很常见）
+            known = {job.key for job in self.scheduler.running_jobs() + self.scheduler.queued_jobs()}
+            jobs = [job for job in jobs if job.key not in known]
+            # 同一目录的队列记录累加，供监控计算整体剩余时间
+            store = open_store(output_dir)
+            queue = store.get_meta("queue", [])
+            store.set_meta("queue", queue + [job.ep_num for job in jobs if job.ep_num not in queue])
+            for job in jobs:
+                supervisor.uncancel(job.key)
+                if self.controller is not None:
+                    self.controller.prepare_host(job.host)
+                self.scheduler.submit(job)
+            self.logger.info(f"已加入队列: {request['title']} {[job.ep_num for job in jobs]}")
+
+        threading.Thread(target=resolve_and_submit, name="enqueue", daemon=True).start()
+        return {"output_dir": output_dir, "episodes": episode_numbers}
+
+    def cmd_list(self, request: Dict) -> Dict:
+        def describe(job: EpisodeJob, state: str) -> Dict:
+            return {"state": state, "output_dir": job.output_dir, "title": job.title,
+                    "ep_num": job.ep_num, "priority": job.priority, "attempt": job.attempt,
+                    "host": job.host, "engine": job.engine, "not_before": job.not_before}
+
+        jobs = [describe(job, "running") for job in self.scheduler.running_jobs()]
+        jobs += [describe(job, "paused" if self.scheduler.is_paused(job.output_dir) else "queued")
+                 for job in self.scheduler.queued_jobs()]
+        return {"jobs": jobs, "max_workers": self.scheduler.max_workers,
+                "per_host_limit": self.scheduler.per_host_limit}
+
+    @staticmethod
+    def _matcher(request: Dict) -> Callable[[EpisodeJob], bool]:
+        """按下载目录（可选再按集数）选择任务"""
+        output_dir = os.path.abspath(request["output_dir"])
+        episodes = set(int(ep) for ep in request.get("episodes") or [])
+        return lambda job: job.output_dir == output_dir and (not episodes or job.ep_num in episodes)
+
+    def cmd_pause(self, request: Dict) -> Dict:
+        self.scheduler.pause(os.path.abspath(request["output_dir"]))
+        return {}
+
+    def cmd_resume(self, request: Dict) -> Dict:
+        self.scheduler.resume(os.path.abspath(request["output_dir"]))
+        return {}
+
+    def cmd_cancel(self, request: Dict) -> Dict:
+        """移除排队中的任务，并终止正在下载的任务"""
+        match = self._matcher(request)
+        removed = self.scheduler.remove(match)
+        fail_pending_retries(removed, self.logger)
+        running = [job for job in self.scheduler.running_jobs() if match(job)]
+        for job in running:
+            supervisor.cancel(job.key)
+        return {"removed": [job.ep_num for job in removed],
+                "stopped": [job.ep_num for job in running]}
+
+    def cmd_priority(self, request: Dict) -> Dict:
+        return {"updated": self.scheduler.set_priority(self._matcher(request), int(request["priority"]))}
+
+    def cmd_metrics(self, request: Dict) -> Dict:
+        return {"snapshot": metrics.snapshot(), "text": metrics.render_prometheus()}
+
+    def cmd_configure(self, request: Dict) -> Dict:
+        """修改运行中守护进程的设置（并发数、自适应并发、指标端口），客户端连接到已有的守护进程时发送"""
+        if request.get("max_workers") or request.get("per_host_limit"):
+            self.scheduler.configure(request.get("max_workers"), request.get("per_host_limit"))
+        if request.get("adaptive"):
+            self._enable_adaptive()
+        if request.get("metrics_port"):
+            self._start_metrics(int(request["metrics_port"]))
+        return {"max_workers": self.scheduler.max_workers, "per_host_limit": self.scheduler.per_host_limit,
+                "adaptive": self.controller is not None, "metrics_port": self.metrics_port
+                if self._metrics_server is not None else None}
+
+    def cmd_shutdown(self, request: Dict) -> Dict:
+        # 在单独的线程里停止，保证响应先发出去
+        threading.Thread(target=supervisor.request_stop, daemon=True).start()
+        return {}
+
+    # ---- 运行 ----
+    def serve(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        response = {"ok": False, "error": "无效的JSON请求"}
+                    else:
+                        response = daemon.handle(request)
+                    self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        path = socket_path()
+        try:
+            os.remove(path)  # 持有单实例锁时，残留的套接字文件一定是旧进程留下的
+        except FileNotFoundError:
+            pass
+        self._server = Server(path, Handler)
+        os.chmod(path, 0o600)
+        threading.Thread(target=self._server.serve_forever, name="control", daemon=True).start()
+
+        supervisor.install_signal_handlers()
+        supervisor.on_stop(self.scheduler.stop)
+        if self.adaptive:
+            self._enable_adaptive()
+        flusher = MetricsFlusher([state_path(METRICS_FILE)], logger=self.logger)
+        flusher.start()
+        if self.metrics_port:
+            self._start_metrics(self.metrics_port)
+        self.logger.info(f"下载守护进程已启动 (PID: {os.getpid()}, 套接字: {path})")
+
+        try:
+            self.scheduler.run()
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            if self.controller is not None:
+                self.controller.stop()
+            flusher.stop()
+            if self._metrics_server is not None:
+                self._metrics_server.shutdown()
+                self._metrics_server.server_close()
+            if self._limiter is not None:
+                self._limiter.stop()
+            if self._proxy is not None:
+                self._proxy.stop()
+            self.logger.info("下载守护进程已退出")
+
+def main():
+    parser = argparse.ArgumentParser(description="ov_downloader 常驻下载守护进程")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"同时下载的集数 (默认: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST_LIMIT,
+                        help=f"每个CDN主机同时下载的集数 (默认: {DEFAULT_PER_HOST_LIMIT})")
+    parser.add_argument("--adaptive", action="store_true", help="自适应调整每个CDN主机的并发数")
+    parser.add_argument("--metrics-port", type=int, help="在该端口提供Prometheus格式的 /metrics（仅本机）")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler(state_path(LOG_FILE), encoding='utf-8')]
+    )
+    logger = logging.getLogger("daemon")
+
+    # 每台主机只允许一个守护进程
+    lock_f = open(state_path(LOCK_FILE), "w")
+    try:
+        fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logger.info("已有守护进程在运行，退出")
+        sys.exit(0)
+    lock_f.write(str(os.getpid()))
+    lock_f.flush()
+
+    DownloadDaemon(args.jobs, args.per_host, args.adaptive, logger, args.metrics_port).serve()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+
+from settings import state_path
+
+# 守护进程的控制套接字、单实例锁和日志，都在全局状态目录中
+SOCKET_FILE = "daemon.sock"
+LOCK_FILE = "daemon.lock"
+LOG_FILE = "daemon.log"
+
+# 等待新启动的守护进程开始监听的时间（秒）
+START_TIMEOUT = 15
+# 普通请求的超时；parse 需要抓取网页，单独放宽
+REQUEST_TIMEOUT = 30
+PARSE_TIMEOUT = 300
+
+class DaemonError(Exception):
+    """守护进程不可用或返回错误"""
+
+def daemon_supported() -> bool:
+    return hasattr(socket, "AF_UNIX") and sys.platform != "win32"
+
+def socket_path() -> str:
+    return state_path(SOCKET_FILE)
+
+def request(cmd: str, timeout: float = REQUEST_TIMEOUT, **params) -> Dict:
+    """发送一条JSON请求并返回响应（一行JSON）；守护进程报错时抛出 DaemonError"""
+    payload = json.dumps({"cmd": cmd, **params}, ensure_ascii=False).encode("utf-8") + b"\n"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path())
+            sock.sendall(payload)
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError as e:
+        raise DaemonError(f"无法连接下载守护进程: {e}")
+
+    try:
+        response = json.loads(data.decode("utf-8"))
+    except ValueError:
+        raise DaemonError("守护进程返回了无效的响应")
+    if not response.get("ok"):
+        raise DaemonError(response.get("error") or "未知错误")
+    return response
+
+def is_running() -> bool:
+    if not daemon_supported() or not os.path.exists(socket_path()):
+        return False
+    try:
+        request("ping", timeout=5)
+        return True
+    except DaemonError:
+        return False
+
+def ensure_daemon(max_workers: Optional[int] = None, per_host_limit: Optional[int] = None,
+                  adaptive: bool = False, metrics_port: Optional[int] = None) -> bool:
+    """确保守护进程在运行，必要时在后台启动一个；返回是否可用
+
+    守护进程已在运行时把这些设置发给它（只会启用自适应并发和指标端口，不会关闭）。
+    """
+    if is_running():
+        if max_workers or per_host_limit or adaptive or metrics_port:
+            try:
+                applied = request("configure", max_workers=max_workers, per_host_limit=per_host_limit,
+                                  adaptive=adaptive, metrics_port=metrics_port)
+            except DaemonError as e:
+                print(f"⚠️ 无法修改已运行的下载守护进程的设置，本次的并发/自适应/指标端口设置未生效: {e}")
+            else:
+                if metrics_port and applied.get("metrics_port") != metrics_port:
+                    print(f"⚠️ 下载守护进程的指标端口为 {applied.get('metrics_port') or '无'}，"
+                          f"未改为 {metrics_port}（需要先 monitor.py --shutdown）")
+        return True
+
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "daemon.py")]
+    if max_workers:
+        cmd += ["--jobs", str(max_workers)]
+    if per_host_limit:
+        cmd += ["--per-host", str(per_host_limit)]
+    if adaptive:
+        cmd.append("--adaptive")
+    if metrics_port:
+        cmd += ["--metrics-port", str(metrics_port)]
+    with open(state_path(LOG_FILE), "a") as log_f:
+        subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log_f, stderr=subprocess.STDOUT,
+                         start_new_session=True, close_fds=True)
+
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if is_running():
+            return True
+        time.sleep(0.1)
+    return False
@@ -0,0 +1,422 @@
+import contextlib
+import os
+import shutil
+import logging
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from hls_playlist import Playlist, Segment, VariantPolicy, parse_playlist, best_variant
+from progress_log import format_progress
+from scheduler import ENGINE_NATIVE
+from metrics import (segment_fetch_seconds, downloaded_bytes_total, request_errors_total,
+                     disk_write_seconds, merge_seconds)
+
+# AES-128 解密为可选依赖（pycryptodome 或 cryptography）
+try:
+    from Crypto.Cipher import AES as _AES
+
+    def _aes_cbc_decrypt(key: bytes, iv: bytes, data: bytes) -> bytes:
+        return _AES.new(key, _AES.MODE_CBC, iv).decrypt(data)
+except ImportError:
+    try:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        def _aes_cbc_decrypt(key: bytes, iv: bytes, data: bytes) -> bytes:
+            decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+            return decryptor.update(data) + decryptor.finalize()
+    except ImportError:
+        _aes_cbc_decrypt = None
+
+DEFAULT_SEGMENT_WORKERS = 8
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+SEGMENT_RETRIES = 3
+SEGMENT_TIMEOUT = 60
+AES_BLOCK_SIZE = 16
+# 限速时每次读取的字节数
+THROTTLE_CHUNK_SIZE = 64 * 1024
+
+_session_lock = threading.Lock()
+_shared_session: Optional[requests.Session] = None
+
+def get_http_session() -> requests.Session:
+    """进程内共享的keep-alive连接池，多集、多分片复用TCP/TLS连接"""
+    global _shared_session
+    with _session_lock:
+        if _shared_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = DEFAULT_USER_AGENT
+            _shared_session = session
+        return _shared_session
+
+class HlsDownloadError(Exception):
+    pass
+
+class _StopRequested(HlsDownloadError):
+    pass
+
+class HlsDownloader:
+    """进程内HLS下载引擎：并发拉取分片，按顺序写入单个输出文件"""
+
+    def __init__(self, workers: int = DEFAULT_SEGMENT_WORKERS,
+                 session: Optional[requests.Session] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 should_stop: Optional[Callable[[], bool]] = None,
+                 progress_log: Optional[str] = None,
+                 throttle: Optional[Callable[[int], None]] = None,
+                 variant_policy: Optional[VariantPolicy] = None,
+                 segment_cache=None,
+                 register_process: Optional[Callable[[subprocess.Popen], None]] = None,
+                 logger=None):
+        self.workers = max(1, int(workers))
+        self.session = session or get_http_session()
+        self.headers = headers or {}
+        self.should_stop = should_stop or (lambda: False)
+        self.progress_log = progress_log
+        # 全局带宽限制（bandwidth.BandwidthLimiter.consume），按块消耗令牌
+        self.throttle = throttle
+        self.variant_policy = variant_policy
+        # 可选的本地分片缓存（segment_cache.SegmentCache），下载前先查找
+        self.segment_cache = segment_cache
+        # 登记启动的ffmpeg子进程（core_downloader.supervisor），停止请求时直接终止
+        self.register_process = register_process
+        self._cache_hits = 0
+        self._cache_saved = 0
+        self._cache_lock = threading.Lock()
+        self.logger = logger or logging.getLogger(__name__)
+        self._keys: Dict[str, bytes] = {}
+        self._keys_lock = threading.Lock()
+        # 最近一次失败的原因，供 retry_policy.classify_failure 判断失败类型
+        self.last_error: Optional[str] = None
+        # 最近一次下载的播放列表总时长（秒），供完成索引检查输出是否截断
+        self.last_duration: Optional[float] = None
+
+    def _get(self, url: str, byterange=None) -> bytes:
+        headers = dict(self.headers)
+        if byterange:
+            offset, length = byterange
+            headers['Range'] = f"bytes={offset}-{offset + length - 1}"
+        if self.throttle is None:
+            response = self.session.get(url, headers=headers, timeout=SEGMENT_TIMEOUT)
+            response.raise_for_status()
+            return response.content
+        with self.session.get(url, headers=headers, timeout=SEGMENT_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            for chunk in response.iter_content(THROTTLE_CHUNK_SIZE):
+                self.throttle(len(chunk))
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    def load_playlist(self, m3u8_url: str) -> Playlist:
+        """获取媒体播放列表，遇到主播放列表时选择一个版本"""
+        playlist = parse_playlist(self._get(m3u8_url).decode('utf-8', 'replace'), m3u8_url)
+        if playlist.master:
+            variant = self.variant_policy.select(playlist) if self.variant_policy else best_variant(playlist)
+            if variant is None:
+                raise HlsDownloadError("主播放列表中没有可用的版本")
+            playlist = parse_playlist(self._get(variant.url).decode('utf-8', 'replace'), variant.url)
+        if not playlist.segments:
+            raise HlsDownloadError("播放列表中没有分片")
+        return playlist
+
+    def _get_key(self, uri: str) -> bytes:
+        with self._keys_lock:
+            if uri in self._keys:
+                return self._keys[uri]
+        key = self._get(uri)
+        with self._keys_lock:
+            self._keys[uri] = key
+        return key
+
+    def _fetch_raw(self, segment: Segment) -> bytes:
+        """获取分片的原始数据：先查本地分片缓存，未命中时从CDN下载（带重试）"""
+        if self.segment_cache is not None:
+            data = self.segment_cache.get(segment.url, segment.byterange)
+            if data is not None:
+                with self._cache_lock:
+                    self._cache_hits += 1
+                    self._cache_saved += len(data)
+                return data
+
+        host = urlparse(segment.url).netloc.lower()
+        started = time.monotonic()
+        for attempt in range(SEGMENT_RETRIES):
+            try:
+                data = self._get(segment.url, segment.byterange)
+                break
+            except requests.RequestException:
+                request_errors_total.inc(stage="segment", host=host)
+                if attempt == SEGMENT_RETRIES - 1 or self.should_stop():
+                    raise
+                time.sleep(2 * (attempt + 1))
+        segment_fetch_seconds.observe(time.monotonic() - started, host=host)
+        downloaded_bytes_total.inc(len(data), engine=ENGINE_NATIVE)
+        if self.segment_cache is not None:
+            self.segment_cache.put(segment.url, segment.byterange, data)
+        return data
+
+    def fetch_segment(self, segment: Segment) -> bytes:
+        """下载单个分片，必要时解密"""
+        return self.decrypt(segment, self._fetch_raw(segment))
+
+    def decrypt(self, segment: Segment, data: bytes) -> bytes:
+        """按播放列表中的 EXT-X-KEY 解密分片（未加密时原样返回）"""
+        if segment.key and segment.key.method != 'NONE':
+            if segment.key.method != 'AES-128':
+                raise HlsDownloadError(f"不支持的加密方式: {segment.key.method}")
+            if _aes_cbc_decrypt is None:
+                raise HlsDownloadError("分片已加密，需要安装 pycryptodome 或 cryptography")
+            if len(data) % AES_BLOCK_SIZE:
+                raise HlsDownloadError(f"加密分片长度不是 {AES_BLOCK_SIZE} 的整数倍: {segment.url}")
+            iv = segment.key.iv or segment.sequence.to_bytes(16, 'big')
+            try:
+                data = _aes_cbc_decrypt(self._get_key(segment.key.uri), iv, data)
+            except ValueError as e:
+                raise HlsDownloadError(f"分片解密失败: {e}") from e
+            # 去除PKCS7填充；填充不合法说明密钥错误或分片损坏
+            if data:
+                pad = data[-1]
+                if not 1 <= pad <= AES_BLOCK_SIZE or data[-pad:] != bytes([pad]) * pad:
+                    raise HlsDownloadError(f"分片解密后填充无效（密钥错误或分片损坏）: {segment.url}")
+                data = data[:-pad]
+        return data
+
+    def _write_progress(self, done: int, total: int, bytes_done: int, started: float):
+        if not self.progress_log:
+            return
+        elapsed = max(time.time() - started, 1e-6)
+        speed = bytes_done / elapsed
+        estimate = bytes_done / done * total if done else None
+        eta = (estimate - bytes_done) / speed if estimate and speed else None
+        # 与yt-dlp进度模板相同的结构化记录，monitor.py 可以直接解析
+        with open(self.progress_log, 'a', encoding='utf-8') as f:
+            f.write(format_progress(bytes_done, estimate, speed, eta, done, total))
+
+    def _log_cache_stats(self, total: int):
+        if self.segment_cache is None or not self._cache_hits:
+            return
+        self.logger.info(f"分片缓存命中 {self._cache_hits}/{total} ({self._cache_hits / total:.0%})，"
+                         f"节省 {self._cache_saved / 1024 / 1024:.1f} MiB")
+
+    @staticmethod
+    def plan_signature(playlist: Playlist) -> str:
+        """分片布局的标识：分片数、总时长、是否有初始化分片"""
+        return f"{len(playlist.segments)}:{playlist.total_duration:.3f}:{int(bool(playlist.init_segment))}"
+
+    def _verify_resume(self, journal, signature: str, output_path: str) -> Tuple[int, int]:
+        """校验已记录的分片在输出文件中是否完整，返回 (可续传的分片数, 文件偏移)"""
+        records = journal.load(signature)
+        if not records or not os.path.exists(output_path):
+            journal.truncate(0)
+            return 0, 0
+
+        kept, offset = 0, 0
+        with open(output_path, 'rb') as f:
+            for pos, rec_offset, size, crc in records:
+                # 必须从0开始连续，且与前一个分片首尾相接
+                if pos != kept or rec_offset != offset:
+                    break
+                f.seek(rec_offset)
+                data = f.read(size)
+                if len(data) != size or zlib.crc32(data) != crc:
+                    break
+                kept += 1
+                offset += size
+
+        journal.truncate(kept)
+        return kept, offset
+
+    def _load_fragments(self, m3u8_url: str) -> Optional[Tuple[Playlist, List[Segment]]]:
+        try:
+            playlist = self.load_playlist(m3u8_url)
+        except (requests.RequestException, ValueError, HlsDownloadError) as e:
+            self.last_error = str(e)
+            self.logger.error(f"获取播放列表失败: {e}")
+            return None
+        self.last_duration = playlist.total_duration or None
+        with self._cache_lock:
+            self._cache_hits, self._cache_saved = 0, 0
+        return playlist, ([playlist.init_segment] if playlist.init_segment else []) + playlist.segments
+
+    def _ordered_fragments(self, fragments: List[Segment], start: int) -> Iterator[Tuple[int, bytes]]:
+        """并发下载 fragments[start:]，按顺序逐个产出 (位置, 数据)
+
+        乱序完成的分片最多在内存中缓存 workers*4 个；消费方写得慢时不再提交新的下载。
+        """
+        total = len(fragments)
+        window = self.workers * 4
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            submitted = start
+            try:
+                for next_write in range(start, total):
+                    while submitted < total and submitted < next_write + window:
+                        futures[submitted] = pool.submit(self.fetch_segment, fragments[submitted])
+                        submitted += 1
+                    if self.should_stop():
+                        raise _StopRequested("stopped")
+                    yield next_write, futures.pop(next_write).result()
+            finally:
+                for future in futures.values():
+                    future.cancel()
+
+    def download(self, m3u8_url: str, output_path: str, journal=None) -> bool:
+        """下载整个播放列表到output_path，返回是否成功
+
+        传入 journal（state_store.FragmentJournal）时，每写入一个分片就记录下来；
+        重试时先校验已写入的分片，只下载缺失的部分。
+        """
+        started = time.time()
+        loaded = self._load_fragments(m3u8_url)
+        if loaded is None:
+            return False
+        playlist, fragments = loaded
+        total = len(fragments)
+        resume_from, offset = 0, 0
+        if journal is not None:
+            resume_from, offset = self._verify_resume(journal, self.plan_signature(playlist), output_path)
+            if resume_from:
+                self.logger.info(f"续传: 已有 {resume_from}/{total} 个分片通过校验")
+
+        bytes_done = offset
+        last_progress = 0.0
+
+        try:
+            with open(output_path, 'r+b' if resume_from else 'wb') as out:
+                out.seek(offset)
+                out.truncate()
+
+                for pos, data in self._ordered_fragments(fragments, resume_from):
+                    write_started = time.monotonic()
+                    out.write(data)
+                    if journal is not None:
+                        # 先落盘再记录，记录过的分片一定在文件里
+                        out.flush()
+                        journal.commit(pos, offset, len(data), zlib.crc32(data))
+                    disk_write_seconds.observe(time.monotonic() - write_started)
+                    offset += len(data)
+                    bytes_done += len(data)
+
+                    now = time.time()
+                    if now - last_progress >= 1 or pos + 1 == total:
+                        self._write_progress(pos + 1, total, bytes_done, started)
+                        last_progress = now
+        except _StopRequested:
+            self.last_error = "stopped"
+            self.logger.info("检测到停止请求，终止分片下载")
+            return False
+        except (requests.RequestException, HlsDownloadError, OSError) as e:
+            self.last_error = str(e)
+            self.logger.error(f"分片下载失败: {e}")
+            return False
+
+        self._log_cache_stats(total)
+        return True
+
+    def download_remux(self, m3u8_url: str, target: str) -> bool:
+        """边下载边封装：按顺序把分片写入ffmpeg的标准输入，直接生成MP4
+
+        每个字节只落盘一次，不产生中间TS文件；代价是中断后只能从头下载（不支持分片续传）。
+        """
+        started = time.time()
+        loaded = self._load_fragments(m3u8_url)
+        if loaded is None:
+            return False
+        _, fragments = loaded
+
+        # ffmpeg的错误输出写入临时文件：写满管道会让ffmpeg停止读取标准输入，写入随之永久阻塞
+        with tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-i', 'pipe:0', '-c', 'copy',
+                 '-bsf:a', 'aac_adtstoasc', '-f', 'mp4', target],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr_file,
+                # 独立的进程组，停止请求可以直接终止
+                preexec_fn=os.setsid if sys.platform != "win32" else None
+            )
+            if self.register_process:
+                self.register_process(process)
+            return self._feed_ffmpeg(process, stderr_file, fragments, target, started)
+
+    @staticmethod
+    def _stderr_tail(stderr_file) -> str:
+        stderr_file.seek(0, os.SEEK_END)
+        stderr_file.seek(max(0, stderr_file.tell() - 500))
+        return stderr_file.read().decode('utf-8', 'replace')
+
+    def _feed_ffmpeg(self, process: subprocess.Popen, stderr_file, fragments: List[Segment],
+                     target: str, started: float) -> bool:
+        total = len(fragments)
+        bytes_done = 0
+        last_progress = 0.0
+        try:
+            for pos, data in self._ordered_fragments(fragments, 0):
+                # ffmpeg处理慢时写入阻塞，下载随之暂停，内存占用不会增长
+                process.stdin.write(data)
+                bytes_done += len(data)
+                now = time.time()
+                if now - last_progress >= 1 or pos + 1 == total:
+                    self._write_progress(pos + 1, total, bytes_done, started)
+                    last_progress = now
+        except (_StopRequested, requests.RequestException, HlsDownloadError, OSError) as e:
+            process.kill()
+            with contextlib.suppress(OSError):
+                process.stdin.close()
+            process.wait()
+            self.last_error = str(e)
+            if isinstance(e, _StopRequested) or self.should_stop():
+                self.last_error = "stopped"
+            elif isinstance(e, BrokenPipeError):
+                # ffmpeg提前退出，错误原因在它的输出里
+                self.last_error = f"ffmpeg 封装失败: {self._stderr_tail(stderr_file)}"
+            self.logger.error(f"流式封装中断: {self.last_error}")
+            _remove_quietly(target)
+            return False
+
+        with contextlib.suppress(BrokenPipeError):
+            process.stdin.close()
+        process.wait()
+        if process.returncode != 0:
+            self.last_error = "stopped" if self.should_stop() else \
+                f"ffmpeg 封装失败: {self._stderr_tail(stderr_file)}"
+            self.logger.error(self.last_error)
+            _remove_quietly(target)
+            return False
+        self._log_cache_stats(total)
+        return True
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def remux_to_mp4(source: str, target: str) -> bool:
+    """用ffmpeg把TS无损封装为MP4，ffmpeg不可用时保留原文件"""
+    if not shutil.which('ffmpeg'):
+        return False
+    with merge_seconds.time():
+        result = subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', source, '-c', 'copy',
+             '-bsf:a', 'aac_adtstoasc', target],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+    if result.returncode == 0:
+        os.remove(source)
+        return True
+    return False
@@ -0,0 +1,218 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+# 解析属性列表，例如: BANDWIDTH=1280000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+@dataclass
+class HlsKey:
+    """EXT-X-KEY 加密信息"""
+    method: str
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+@dataclass
+class Segment:
+    """媒体播放列表中的一个分片"""
+    index: int
+    url: str
+    duration: float
+    sequence: int
+    key: Optional[HlsKey] = None
+    byterange: Optional[Tuple[int, int]] = None  # (offset, length)
+
+@dataclass
+class Variant:
+    """主播放列表中的一个码率/分辨率"""
+    url: str
+    bandwidth: int = 0
+    width: int = 0
+    height: int = 0
+    codecs: str = ""
+
+@dataclass
+class Playlist:
+    """解析后的m3u8，master为True时只有variants，否则只有segments"""
+    url: str
+    master: bool = False
+    variants: List[Variant] = field(default_factory=list)
+    segments: List[Segment] = field(default_factory=list)
+    init_segment: Optional[Segment] = None
+    target_duration: float = 0
+    endlist: bool = False
+
+    @property
+    def total_duration(self) -> float:
+        return sum(seg.duration for seg in self.segments)
+
+def parse_attributes(text: str) -> Dict[str, str]:
+    """解析 #EXT-X-...: 后面的属性列表"""
+    attrs = {}
+    for key, value in _ATTR_RE.findall(text):
+        if value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        attrs[key] = value
+    return attrs
+
+def _parse_byterange(value: str, last_end: int) -> Tuple[int, int]:
+    if '@' in value:
+        length, offset = value.split('@', 1)
+        return int(offset), int(length)
+    return last_end, int(value)
+
+def parse_playlist(text: str, base_url: str) -> Playlist:
+    """解析m3u8文本（主播放列表或媒体播放列表）"""
+    lines = [line.strip() for line in text.splitlines()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise ValueError("不是有效的m3u8播放列表")
+
+    playlist = Playlist(url=base_url)
+    media_sequence = 0
+    duration = 0.0
+    key = None
+    byterange = None
+    byterange_end = 0
+    pending_variant = None
+
+    for line in lines[1:]:
+        if not line:
+            continue
+
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            width = height = 0
+            if 'RESOLUTION' in attrs and 'x' in attrs['RESOLUTION']:
+                w, h = attrs['RESOLUTION'].lower().split('x', 1)
+                width, height = int(w or 0), int(h or 0)
+            pending_variant = Variant(
+                url='',
+                bandwidth=int(attrs.get('BANDWIDTH', 0) or 0),
+                width=width,
+                height=height,
+                codecs=attrs.get('CODECS', '')
+            )
+            playlist.master = True
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            media_sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist.target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0] or 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = _parse_byterange(line.split(':', 1)[1], byterange_end)
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            else:
+                iv = attrs.get('IV')
+                key = HlsKey(
+                    method=method,
+                    uri=urljoin(base_url, attrs['URI']) if 'URI' in attrs else None,
+                    iv=bytes.fromhex(iv[2:] if iv.lower().startswith('0x') else iv) if iv else None
+                )
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            init_range = None
+            if 'BYTERANGE' in attrs:
+                init_range = _parse_byterange(attrs['BYTERANGE'], 0)
+            playlist.init_segment = Segment(index=-1, url=urljoin(base_url, attrs['URI']),
+                                            duration=0, sequence=-1, key=key, byterange=init_range)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist.endlist = True
+        elif line.startswith('#'):
+            continue
+        elif pending_variant is not None:
+            pending_variant.url = urljoin(base_url, line)
+            playlist.variants.append(pending_variant)
+            pending_variant = None
+        else:
+            sequence = media_sequence + len(playlist.segments)
+            playlist.segments.append(Segment(
+                index=len(playlist.segments),
+                url=urljoin(base_url, line),
+                duration=duration,
+                sequence=sequence,
+                key=key,
+                byterange=byterange
+            ))
+            if byterange:
+                byterange_end = byterange[0] + byterange[1]
+            duration = 0.0
+            byterange = None
+
+    return playlist
+
+def best_variant(playlist: Playlist) -> Optional[Variant]:
+    """默认选择码率最高的版本（与yt-dlp默认行为一致）"""
+    if not playlist.variants:
+        return None
+    return max(playlist.variants, key=lambda v: (v.bandwidth, v.height))
+
+def _parse_bitrate(value: str) -> int:
+    """比特率，支持 k/m 后缀，例如 3M、800k"""
+    value = value.strip().lower().rstrip("bps").rstrip("bit")
+    scale = {"k": 1000, "m": 1000 ** 2, "g": 1000 ** 3}.get(value[-1:], 1)
+    return int(float(value.rstrip("kmg")) * scale)
+
+@dataclass
+class VariantPolicy:
+    """主播放列表的版本选择策略
+
+    max_height / max_bitrate: 不超过该分辨率/码率的版本中选最高的；
+    min_height / min_bitrate: 满足条件的版本中选最小的（"不低于X的最小版本"）。
+    """
+    max_height: int = 0
+    max_bitrate: int = 0
+    min_height: int = 0
+    min_bitrate: int = 0
+
+    _KEYS = {"max-height": "max_height", "max-bitrate": "max_bitrate",
+             "min-height": "min_height", "min-bitrate": "min_bitrate"}
+
+    @classmethod
+    def parse(cls, spec: str) -> "VariantPolicy":
+        """解析 "max-height=720,max-bitrate=4M" 这样的描述；"720p" 等同于 max-height=720"""
+        policy = cls()
+        for item in filter(None, (part.strip().lower() for part in spec.split(","))):
+            if item in ("best", "highest"):
+                continue
+            if re.fullmatch(r"\d+p", item):
+                policy.max_height = int(item[:-1])
+                continue
+            name, sep, value = item.partition("=")
+            if not sep or name not in cls._KEYS:
+                raise ValueError(f"无法解析的版本选择策略: {item}")
+            attr = cls._KEYS[name]
+            setattr(policy, attr, _parse_bitrate(value) if attr.endswith("bitrate") else int(value.rstrip("p")))
+        return policy
+
+    @property
+    def spec(self) -> str:
+        """规范化的描述，用于判断缓存的版本是否按同一策略选出"""
+        parts = [f"{name}={getattr(self, attr)}" for name, attr in self._KEYS.items() if getattr(self, attr)]
+        return ",".join(parts) or "best"
+
+    def select(self, playlist: Playlist) -> Optional[Variant]:
+        variants = playlist.variants
+        if not variants:
+            return None
+        size = lambda v: (v.bandwidth, v.height)
+        allowed = [v for v in variants
+                   if (not self.max_height or not v.height or v.height <= self.max_height)
+                   and (not self.max_bitrate or v.bandwidth <= self.max_bitrate)]
+        if not allowed:
+            # 所有版本都超过上限时取最小的
+            return min(variants, key=size)
+        if self.min_height or self.min_bitrate:
+            above = [v for v in allowed
+                     if v.height >= self.min_height and v.bandwidth >= self.min_bitrate]
+            return min(above, key=size) if above else max(allowed, key=size)
+        return max(allowed, key=size)
+
+def describe_variant(variant: Variant) -> str:
+    resolution = f"{variant.width}x{variant.height}" if variant.height else "未知分辨率"
+    return f"{resolution} {variant.bandwidth / 1000 / 1000:.2f}Mbps"
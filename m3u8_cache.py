@@ -0,0 +1,148 @@
+import json
+import os
+import time
+import logging
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qsl
+
+from settings import state_path
+from state_store import StateStore, STATE_DB_FILE, LEGACY_SUFFIX
+from hls_playlist import VariantPolicy, parse_playlist, describe_variant
+
+# 旧版全局JSON缓存文件，首次使用状态库时导入
+M3U8_CACHE_FILE = "m3u8_cache.json"
+
+# 没有签名参数的链接，视为长期有效
+UNSIGNED_TTL = 7 * 24 * 3600
+# 有签名/令牌但解析不出过期时间的链接
+SIGNED_TTL = 3600
+# 过期前这么多秒就视为失效，给下载留出时间
+EXPIRY_MARGIN = 300
+PROBE_TIMEOUT = 10
+
+# 直接给出过期时间（绝对时间戳或相对秒数）的参数
+_EXPIRY_PARAMS = ("expires", "expire", "exp", "e", "deadline", "validto", "x-expires", "x-amz-expires")
+# 只表明链接带签名的参数
+_SIGNATURE_PARAMS = ("token", "sign", "signature", "auth", "auth_key", "key", "st", "wssecret",
+                     "txsecret", "policy", "x-amz-signature", "hdnts", "hdnea", "verify")
+
+def _parse_timestamp(value: str) -> Optional[int]:
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    # 部分CDN使用十六进制时间戳（如 wsTime、txTime）
+    try:
+        return int(value, 16)
+    except ValueError:
+        return None
+
+def infer_expiry(m3u8_url: str, resolved_at: float) -> float:
+    """根据链接中的令牌/过期参数推断失效时间（epoch秒）"""
+    params = {k.lower(): v for k, v in parse_qsl(urlparse(m3u8_url).query)}
+
+    for name in _EXPIRY_PARAMS:
+        if name in params:
+            ts = _parse_timestamp(params[name])
+            if ts is None:
+                continue
+            # 大于1e9认为是绝对时间戳，否则是相对秒数
+            return float(ts) if ts > 1_000_000_000 else resolved_at + ts
+
+    # 阿里云 auth_key=时间戳-随机数-uid-md5，时间戳为签发时间
+    if "auth_key" in params:
+        ts = _parse_timestamp(params["auth_key"].split("-", 1)[0])
+        if ts and ts > 1_000_000_000:
+            return float(ts) + SIGNED_TTL
+    # 网宿/腾讯: wsTime/txTime 为过期时间
+    for name in ("wstime", "txtime"):
+        if name in params:
+            ts = _parse_timestamp(params[name])
+            if ts and ts > 1_000_000_000:
+                return float(ts)
+
+    if any(name in params for name in _SIGNATURE_PARAMS):
+        return resolved_at + SIGNED_TTL
+    return resolved_at + UNSIGNED_TTL
+
+def probe_m3u8(m3u8_url: str) -> bool:
+    """廉价的有效性探测：只读取响应开头，确认仍是m3u8"""
+    from hls_downloader import get_http_session
+    try:
+        with get_http_session().get(m3u8_url, timeout=PROBE_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                return False
+            head = next(response.iter_content(64), b"")
+            return head.lstrip(b"\xef\xbb\xbf \r\n\t").startswith(b"#EXTM3U")
+    except Exception:
+        return False
+
+def resolve_variant(m3u8_url: str, policy: VariantPolicy) -> Tuple[str, Optional[str]]:
+    """按策略从主播放列表中选择版本，返回 (媒体播放列表链接, 版本描述)；不是主播放列表时原样返回"""
+    from hls_downloader import get_http_session
+    response = get_http_session().get(m3u8_url, timeout=PROBE_TIMEOUT)
+    response.raise_for_status()
+    playlist = parse_playlist(response.text, m3u8_url)
+    variant = policy.select(playlist) if playlist.master else None
+    if variant is None:
+        return m3u8_url, None
+    return variant.url, describe_variant(variant)
+
+class M3u8Cache:
+    """全局m3u8解析缓存，以剧集页面URL为键，记录解析时间和推断的过期时间
+
+    保存在全局SQLite状态库中，多个进程/线程可以同时读写。
+    """
+
+    def __init__(self, path: Optional[str] = None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        db_path = path or state_path(STATE_DB_FILE)
+        existed = os.path.exists(db_path)
+        self.store = StateStore(db_path)
+        if not existed:
+            self._import_legacy_json(os.path.join(os.path.dirname(db_path), M3U8_CACHE_FILE))
+
+    def _import_legacy_json(self, json_path: str):
+        """导入旧版全局JSON缓存文件"""
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for page_url, entry in data.items():
+            self.store.cache_put(page_url, entry["m3u8_url"], entry["resolved_at"], entry["expires_at"])
+        os.replace(json_path, json_path + LEGACY_SUFFIX)
+
+    def put(self, page_url: str, m3u8_url: str, resolved_at: Optional[float] = None):
+        resolved_at = resolved_at or time.time()
+        self.store.cache_put(page_url, m3u8_url, resolved_at, infer_expiry(m3u8_url, resolved_at))
+
+    def invalidate(self, page_url: str):
+        self.store.cache_delete(page_url)
+
+    def peek(self, page_url: str) -> Optional[Dict]:
+        return self.store.cache_get(page_url)
+
+    def set_variant(self, page_url: str, policy: VariantPolicy, variant_url: str, info: Optional[str]):
+        self.store.cache_set_variant(page_url, policy.spec, variant_url, info or "",
+                                     infer_expiry(variant_url, time.time()))
+
+    def get(self, page_url: str, probe: bool = True, policy: Optional[VariantPolicy] = None) -> Optional[str]:
+        """返回仍然有效的m3u8链接；过期或探测失败时删除条目并返回None
+
+        指定了版本选择策略且缓存中有按同一策略选出的版本时，直接返回该版本的链接，
+        省去请求主播放列表；否则返回原始链接，由调用方选择版本后调用 set_variant。
+        """
+        entry = self.peek(page_url)
+        if not entry:
+            return None
+        if entry["expires_at"] - EXPIRY_MARGIN < time.time():
+            self.invalidate(page_url)
+            return None
+        url = entry["m3u8_url"]
+        if policy is not None and entry.get("variant_url") and entry.get("variant_policy") == policy.spec:
+            url = entry["variant_url"]
+        if probe and not probe_m3u8(url):
+            self.logger.info(f"缓存的m3u8链接已失效，重新解析: {page_url}")
+            self.invalidate(page_url)
+            return None
+        return url
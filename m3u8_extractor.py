@@ -1,61 +1,154 @@
 import logging
-import cloudscraper
-import re,time,random
+import re
 import json
-from urllib.parse import urljoin,unquote
-from url_parser import create_scraper,USER_AGENTS
+import threading
+from typing import Dict, Optional
+from urllib.parse import urljoin,unquote,urlparse
+from url_parser import scraper_pool, fetch_page
+from metrics import m3u8_rule_total
 import html
 
-def extract_m3u8_url(page_url):
-    """优化后的m3u8链接提取函数"""
-    def normalize_m3u8_url(url):
-        """统一处理URL标准化"""
-        if not url:
-            return None
+# 页面中m3u8链接的提取规则，按优先级排列：
+#   player_json 播放器JSON对象（player_xxx = {...}）
+#   play_url    直接赋值的play_url
+#   var_url     加密的url变量
+#   iframe      iframe嵌套
+#   generic     通用m3u8链接
+M3U8_RULES = ("player_json", "play_url", "var_url", "iframe", "generic")
+
+# 每条规则一个与规则同名的命名分组：player_json 为JSON开始的位置，其余为链接文本；
+# generic 为整个匹配（不加分组，合并后的正则才能按首字符快速跳过）。
+# 只匹配有界的片段（引号内、标签内、单个词），避免大页面上 .*? 的回溯；
+# play_url 和 generic 消耗整段匹配，其余规则只消耗开头，其后的文本仍会被其他规则扫描到。
+_RULE_PATTERNS = {
+    "player_json": r'player_\w+\s*=\s*(?P<player_json>)(?=\{)',
+    "play_url": r'play_url\s*=\s*["\'](?P<play_url>[^"\']*?\.m3u8)["\']',
+    "var_url": r'var\s+url\s*=\s*(?=["\'](?P<var_url>[^"\']*)["\'])',
+    "iframe": r'<iframe(?=[^<>]+src=["\'](?P<iframe>[^"\']*)["\'])',
+    "generic": r'https?:[\\/]+[^\s"\']+',
+}
+_RULE_RES = {name: re.compile(pattern) for name, pattern in _RULE_PATTERNS.items()}
+# 所有规则合并成一个正则，一次遍历页面找出全部候选
+_SCANNER = re.compile("|".join(_RULE_PATTERNS[name] for name in M3U8_RULES))
+# 优先级高于某条规则的所有规则合并成的正则（第一条规则没有）
+_HIGHER_RES = {name: re.compile("|".join(_RULE_PATTERNS[higher] for higher in M3U8_RULES[:index]))
+               for index, name in enumerate(M3U8_RULES) if index}
+_UNESCAPE_RE = re.compile(r'\\([\\"\/n])')
+_JSON_DECODER = json.JSONDecoder()
+# 每条规则最多尝试的候选数；解析失败的代价与位置成正比，限制次数保证最坏情况线性
+MAX_RULE_ATTEMPTS = 8
+
+def normalize_m3u8_url(url):
+    """统一处理URL标准化"""
+    if not url:
+        return None
 
-        # 去除所有反斜杠（包括转义和未转义的）
-        url = url.replace('\\\\', '/').replace('\\/', '/').replace('\/', '/')
-        url = url.replace('\//','/').replace('\\','/')
+    # 去除所有反斜杠（包括转义和未转义的）
+    url = url.replace('\\\\', '/').replace('\\/', '/').replace('\/', '/')
+    url = url.replace('\//','/').replace('\\','/')
 
-        # URL解码
-        url = unquote(url)
+    # URL解码
+    url = unquote(url)
 
-        # 补全协议头
-        if url.startswith('//'):
-            url = 'https:' + url
-        elif not url.startswith(('http://', 'https://')):
-            url = 'https://' + url.lstrip('/')
+    # 补全协议头
+    if url.startswith('//'):
+        url = 'https:' + url
+    elif not url.startswith(('http://', 'https://')):
+        url = 'https://' + url.lstrip('/')
 
-        # 验证是否为有效的m3u8链接
-        if not url.lower().endswith('.m3u8'):
-            return None
+    # 验证是否为有效的m3u8链接
+    if not url.lower().endswith('.m3u8'):
+        return None
 
-        return url
+    return url
 
+def _candidate(rule, match, html_text, page_url):
+    """把一个规则匹配转换为标准化的m3u8链接，无效时返回None"""
     try:
-        # 使用cloudscraper绕过Cloudflare
-        scraper = create_scraper()
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Referer': 'https://www.google.com/',
-            'X-Requested-With': 'XMLHttpRequest'
-        }
-
-        # 带重试机制的请求
-        for attempt in range(3):
-            try:
-                response = scraper.get(page_url, headers=headers, timeout=30)
-                time.sleep(1) # 确保请求间隔, 防止内部服务器错误
-                if response.status_code == 403:
-                    headers['User-Agent'] = random.choice(USER_AGENTS)
-                    response = scraper.get(page_url + '?bypass=1', headers=headers)
-                response.raise_for_status()
+        if rule == "player_json":
+            player, _ = _JSON_DECODER.raw_decode(html_text, match.start(rule))
+            url = player.get('url')
+        elif rule == "generic":
+            # 单词内最后一个 .m3u8 为止（与贪婪匹配 [^\s"']+\.m3u8 相同）
+            token = match.group()
+            end = token.rfind('.m3u8')
+            if end <= token.find(':') + 2:
+                return None
+            url = token[:end + len('.m3u8')]
+        elif rule == "var_url":
+            url = decrypt_url(match.group(rule))
+        elif rule == "iframe":
+            url = urljoin(page_url, match.group(rule))
+        else:
+            url = match.group(rule)
+        return normalize_m3u8_url(url)
+    except (ValueError, AttributeError, KeyError):
+        return None
+
+def _worth_trying(rule, match):
+    # 页面中大部分链接是图片、脚本，不计入尝试次数
+    return rule != "generic" or '.m3u8' in match.group()
+
+def scan_m3u8(html_text, page_url, preferred=None):
+    """在（已反转义的）页面中查找m3u8链接，返回 (链接, 命中的规则)
+
+    给出 preferred 时，页面中没有更高优先级规则的匹配才只用这一条规则查找（结果与全文扫描相同），
+    否则或查找失败时对全文做一次合并扫描，取优先级最高的规则中第一个有效的链接。
+    """
+    if preferred in _RULE_RES and (preferred not in _HIGHER_RES
+                                   or not _HIGHER_RES[preferred].search(html_text)):
+        attempts = 0
+        for match in _RULE_RES[preferred].finditer(html_text):
+            if not _worth_trying(preferred, match):
+                continue
+            attempts += 1
+            if attempts > MAX_RULE_ATTEMPTS:
                 break
-            except Exception as e:
-                if attempt == 2:
-                    raise
-                time.sleep(5 * (attempt + 1))
+            url = _candidate(preferred, match, html_text, page_url)
+            if url:
+                return url, preferred
+
+    found = {}
+    attempts = dict.fromkeys(M3U8_RULES, 0)
+    for match in _SCANNER.finditer(html_text):
+        rule = match.lastgroup or "generic"
+        if rule in found or attempts[rule] >= MAX_RULE_ATTEMPTS or not _worth_trying(rule, match):
+            continue
+        attempts[rule] += 1
+        url = _candidate(rule, match, html_text, page_url)
+        if url:
+            found[rule] = url
+            if rule == M3U8_RULES[0]:
+                break  # 不会有更高优先级的结果
+    for rule in M3U8_RULES:
+        if rule in found:
+            return found[rule], rule
+    return None, None
+
+class RuleMemo:
+    """记录每个站点上次成功的提取规则，同一站点的页面结构通常相同"""
+
+    def __init__(self):
+        self._rules: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[str]:
+        with self._lock:
+            return self._rules.get(urlparse(url).netloc.lower())
+
+    def set(self, url: str, rule: str):
+        with self._lock:
+            self._rules[urlparse(url).netloc.lower()] = rule
+
+# 进程内共享的规则记录
+rule_memo = RuleMemo()
+
+def extract_m3u8_url(page_url):
+    """优化后的m3u8链接提取函数"""
+    try:
+        # 使用cloudscraper绕过Cloudflare（从会话池借用，复用连接和clearance）
+        with scraper_pool.session(page_url) as scraper:
+            response = fetch_page(scraper, page_url)
 
         # 检查Cloudflare防护
         if "Cloudflare" in response.text or "Just a moment" in response.text:
@@ -63,40 +156,14 @@ def extract_m3u8_url(page_url):
 
         # 反转义，去除所有反斜杠.
         response.encoding = 'utf-8'
-        html_text = html.unescape(response.text)
-        html_text = re.sub(r'\\([\\"\/n])', r'\1', html_text)
-
-        # 所有可能的提取方法（按优先级排序）
-        extraction_patterns = [
-            # 1. 提取JSON格式的player对象
-            (r'player_\w+\s*=\s*({.*?});', lambda m: json.loads(m.group(1)).get('url')),
-
-            # 2. 提取直接赋值的play_url
-            (r'play_url\s*=\s*["\'](.*?\.m3u8)["\']', lambda m: m.group(1)),
-
-            # 3. 提取加密的url变量
-            (r'var\s+url\s*=\s*["\'](.*?)["\']', lambda m: decrypt_url(m.group(1))),
-
-            # 4. 提取iframe嵌套
-            (r'<iframe[^>]+src=["\'](.*?)["\']', lambda m: urljoin(page_url, m.group(1))),
-
-            # 5. 通用m3u8链接匹配
-            (r'(https?:[\\/]+[^\s"\']+\.m3u8)', lambda m: m.group(1))
-        ]
-
-        # 尝试每种提取方法
-        for pattern, processor in extraction_patterns:
-            try:
-                match = re.search(pattern, html_text, re.DOTALL)
-                if match:
-                    url = processor(match)
-                    normalized_url = normalize_m3u8_url(url)
-                    if normalized_url:
-                        return normalized_url
-            except (json.JSONDecodeError, AttributeError, KeyError):
-                continue
+        html_text = _UNESCAPE_RE.sub(r'\1', html.unescape(response.text))
 
-        return None
+        preferred = rule_memo.get(page_url)
+        url, rule = scan_m3u8(html_text, page_url, preferred)
+        m3u8_rule_total.inc(rule=rule or "none")
+        if rule and rule != preferred:
+            rule_memo.set(page_url, rule)
+        return url
 
     except Exception as e:
         logging.error(f"提取m3u8时出错: {str(e)}", exc_info=True)
@@ -0,0 +1,65 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Set
+
+# 剧集选择：编号为剧集列表（排序后）中的序号，从1开始
+SELECT_ALL = "all"
+SELECT_NEW_ONLY = "new-only"  # 尚未下载完成的剧集
+DEFAULT_SELECTOR = SELECT_NEW_ONLY
+
+_RANGE_RE = re.compile(r'^(\d+)?\s*-\s*(\d+)?$')
+
+def parse_selector(spec: str, count: int, completed: Iterable[int] = ()) -> List[int]:
+    """解析剧集选择，返回排好序、去重的序号列表
+
+    支持 "1-5,8,12-"（12- 表示第12个到最后）、"all"、"new-only"，可以混用，
+    例如 "new-only,3" 表示所有未完成的剧集再加上第3个。
+    completed 为已完成的序号，只在 new-only 中使用。
+    """
+    selected: Set[int] = set()
+    completed = set(completed)
+    for part in filter(None, (item.strip().lower() for item in spec.split(","))):
+        if part == SELECT_ALL:
+            selected.update(range(1, count + 1))
+        elif part == SELECT_NEW_ONLY:
+            selected.update(idx for idx in range(1, count + 1) if idx not in completed)
+        elif part.isdigit():
+            selected.add(int(part))
+        else:
+            match = _RANGE_RE.match(part)
+            if not match or not any(match.groups()):
+                raise ValueError(f"无法解析的剧集选择: {part}")
+            start = int(match.group(1) or 1)
+            end = int(match.group(2) or count)
+            selected.update(range(start, end + 1))
+    return sorted(idx for idx in selected if 1 <= idx <= count)
+
+@dataclass
+class ManifestEntry:
+    """清单中的一行：剧集页面URL和剧集选择"""
+    url: str
+    selector: str = DEFAULT_SELECTOR
+    line: int = 0
+
+def load_manifest(path: str) -> List[ManifestEntry]:
+    """读取批量下载清单
+
+    每行一个剧集页面URL，后面可以跟剧集选择（默认 new-only）；空行和 # 开头的行忽略：
+        https://example.com/show/123.html 1-5,8,12-
+        https://example.com/show/456.html all
+    """
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, raw in enumerate(f, start=1):
+            line = raw.strip()
+            if not line or line.startswith('#'):
+                continue
+            url, _, selector = line.partition(' ')
+            selector = selector.strip() or DEFAULT_SELECTOR
+            # 只校验语法，剧集数量在解析页面后才知道
+            try:
+                parse_selector(selector, 0)
+            except ValueError as e:
+                raise ValueError(f"{path} 第 {lineno} 行: {e}")
+            entries.append(ManifestEntry(url=url, selector=selector, line=lineno))
+    return entries
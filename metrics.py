@@ -0,0 +1,301 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 每个下载目录中定期写入的指标快照（守护进程写在全局状态目录）
+METRICS_FILE = "metrics.json"
+METRICS_FLUSH_INTERVAL = 10
+
+# 请求、写盘等短操作的耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 单集下载、排队等待、封装等长阶段的耗时分桶（秒）
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key: Iterable[Tuple[str, str]]) -> str:
+    escape = lambda value: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    pairs = [f'{name}="{escape(value)}"' for name, value in key]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """只增不减的计数器，按标签分别计数"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+    def samples(self, buckets: bool = True) -> List[Dict]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [{"labels": dict(key), "value": value} for key, value in items]
+
+class Histogram:
+    """分桶直方图（与Prometheus相同，le 为桶的上界），可估算分位数"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各桶计数（最后一个为 +Inf，非累计）, 总和, 次数]
+        self._values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块的耗时；需要在块内决定的标签可以写入 yield 的字典"""
+        extra: Dict = {}
+        started = time.monotonic()
+        try:
+            yield extra
+        finally:
+            self.observe(time.monotonic() - started, **labels, **extra)
+
+    def _quantile(self, counts: List[int], total: int, q: float) -> Optional[float]:
+        """按桶内线性分布估算分位数（与 Prometheus histogram_quantile 相同）"""
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # 落在 +Inf 桶，只能给出下界
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total_sum, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (None,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound is None else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def samples(self, buckets: bool = True) -> List[Dict]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        result = []
+        for key, (counts, total_sum, count) in items:
+            sample = {"labels": dict(key), "count": count, "sum": round(total_sum, 6),
+                      "p50": self._quantile(counts, count, 0.5),
+                      "p95": self._quantile(counts, count, 0.95)}
+            if buckets:
+                cumulative, sample["buckets"] = 0, {}
+                for bound, bucket_count in zip(self.buckets + (None,), counts):
+                    cumulative += bucket_count
+                    sample["buckets"]["+Inf" if bound is None else _format_value(bound)] = cumulative
+            result.append(sample)
+        return result
+
+class MetricsRegistry:
+    """进程内的指标集合，可输出Prometheus文本格式或JSON快照"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, buckets: bool = True) -> Dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            "pid": os.getpid(),
+            "updated_at": time.time(),
+            "metrics": {metric.name: {"type": metric.kind, "help": metric.help,
+                                      "samples": metric.samples(buckets)}
+                        for metric in metrics},
+        }
+
+    def write(self, path: str):
+        """原子写入JSON快照"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+# 进程内共享的指标集合
+metrics = MetricsRegistry()
+
+# ---- 下载流程各阶段的指标 ----
+# 站点（页面请求）、CDN（分片请求）、本地磁盘（写入）分开统计，便于判断瓶颈
+page_parse_seconds = metrics.histogram(
+    "ov_page_parse_seconds", "剧集页面解析耗时（含请求）")
+page_fetch_seconds = metrics.histogram(
+    "ov_page_fetch_seconds", "站点页面请求耗时（含限速等待）")
+m3u8_extract_seconds = metrics.histogram(
+    "ov_m3u8_extract_seconds", "单集m3u8链接提取耗时")
+m3u8_resolved_total = metrics.counter(
+    "ov_m3u8_resolved_total", "m3u8链接解析次数（来源: cache/extracted/failed）")
+m3u8_rule_total = metrics.counter(
+    "ov_m3u8_rule_total", "m3u8链接命中的提取规则")
+queue_wait_seconds = metrics.histogram(
+    "ov_queue_wait_seconds", "剧集从可以启动到实际开始下载的排队时间", DURATION_BUCKETS)
+episode_download_seconds = metrics.histogram(
+    "ov_episode_download_seconds", "单集下载耗时", DURATION_BUCKETS)
+episodes_total = metrics.counter(
+    "ov_episodes_total", "单集下载结果（completed/failed/retrying）")
+retries_total = metrics.counter(
+    "ov_retries_total", "按失败类型统计的重试次数")
+downloaded_bytes_total = metrics.counter(
+    "ov_downloaded_bytes_total", "已下载的字节数")
+segment_fetch_seconds = metrics.histogram(
+    "ov_segment_fetch_seconds", "CDN分片请求耗时（含重试）")
+request_errors_total = metrics.counter(
+    "ov_request_errors_total", "请求失败次数（stage: page/segment）")
+disk_write_seconds = metrics.histogram(
+    "ov_disk_write_seconds", "分片写入本地文件的耗时（含落盘和分片日志）")
+merge_seconds = metrics.histogram(
+    "ov_merge_seconds", "TS封装为MP4（yt-dlp 为合并和修复封装）的耗时", DURATION_BUCKETS)
+segment_cache_requests_total = metrics.counter(
+    "ov_segment_cache_requests_total", "分片缓存查询结果（hit/miss）")
+segment_cache_saved_bytes_total = metrics.counter(
+    "ov_segment_cache_saved_bytes_total", "分片缓存命中省下的下载字节数")
+
+class MetricsFlusher:
+    """后台线程定期把快照写入 metrics.json，停止时再写一次"""
+
+    def __init__(self, paths: Sequence[str], registry: MetricsRegistry = metrics,
+                 interval: float = METRICS_FLUSH_INTERVAL, logger=None):
+        self.paths = list(paths)
+        self.registry = registry
+        self.interval = interval
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def flush(self):
+        for path in self.paths:
+            try:
+                self.registry.write(path)
+            except OSError as e:
+                if self.logger:
+                    self.logger.warning(f"写入指标文件失败 {path}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = metrics) -> ThreadingHTTPServer:
+    """在后台线程中提供 Prometheus 文本格式的 /metrics"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def load_snapshot(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def format_snapshot(snapshot: Dict) -> List[str]:
+    """把快照整理成便于阅读的行：计数器显示数值，直方图显示次数、平均、p50、p95"""
+    lines = []
+    for name, metric in snapshot.get("metrics", {}).items():
+        for sample in metric["samples"]:
+            labels = ",".join(f"{key}={value}" for key, value in sample["labels"].items())
+            label_text = f"{{{labels}}}" if labels else ""
+            if metric["type"] == "counter":
+                lines.append(f"{name}{label_text}  {_format_value(sample['value'])}")
+            else:
+                count = sample["count"]
+                average = sample["sum"] / count if count else 0
+                p50 = "-" if sample["p50"] is None else f"{sample['p50']:.3f}s"
+                p95 = "-" if sample["p95"] is None else f"{sample['p95']:.3f}s"
+                lines.append(f"{name}{label_text}  次数 {count}  平均 {average:.3f}s  p50 {p50}  p95 {p95}")
+    return lines
@@ -3,12 +3,34 @@ import os
 import json
 import time
 import psutil
+import signal
 import subprocess
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from progress_log import read_latest_progress
+from state_store import open_store, open_store_readonly, store_signature, STATE_DB_FILE
+from bandwidth import save_config, load_config, current_rate, format_rate
+from daemon_client import is_running as daemon_running, request as daemon_request, DaemonError
+from metrics import METRICS_FILE, load_snapshot, format_snapshot
+from settings import state_path
+
+# watch模式：每集保留的速度采样数、多长时间没有进展视为停滞
+WATCH_SAMPLES = 5
+DEFAULT_STALL_SECONDS = 60
+DEFAULT_WATCH_INTERVAL = 1.0
 
 def get_active_downloads(output_dir: str) -> Dict:
     """获取活动下载信息"""
+    store = open_store_readonly(output_dir)
+    if store is not None:
+        try:
+            return store.get_active()
+        finally:
+            store.close()
+
+    # 尚未迁移到状态库的旧版目录
     active_file = os.path.join(output_dir, "active_downloads.json")
     if os.path.exists(active_file):
         with open(active_file, 'r', encoding='utf-8') as f:
@@ -17,6 +39,14 @@ def get_active_downloads(output_dir: str) -> Dict:
 
 def get_download_status(output_dir: str) -> Dict:
     """获取下载状态"""
+    store = open_store_readonly(output_dir)
+    if store is not None:
+        try:
+            return store.get_status()
+        finally:
+            store.close()
+
+    # 尚未迁移到状态库的旧版目录
     status_file = os.path.join(output_dir, "download_status.json")
     if os.path.exists(status_file):
         with open(status_file, 'r', encoding='utf-8') as f:
@@ -24,28 +54,15 @@ def get_download_status(output_dir: str) -> Dict:
     return {"completed": [], "failed": [], "progress": {}}
 
 def get_progress(output_dir: str, ep_num: int) -> Optional[float]:
-    """从日志文件中获取下载进度"""
+    """从日志文件末尾读取下载进度（只读最后几KB，与日志大小无关）"""
     log_file = os.path.join(output_dir, f"ep_{ep_num}_progress.log")
-    if not os.path.exists(log_file):
-        return None
-
     try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            if not lines:
-                return 0.0
-
-            # 从最后100行中查找进度
-            for line in reversed(lines[-100:]):
-                if "[download]" in line and "%" in line:
-                    try:
-                        percent = float(line.split("[download]")[1].split("%")[0].strip())
-                        return min(100.0, max(0.0, percent))
-                    except (IndexError, ValueError):
-                        continue
-        return 0.0
-    except Exception:
+        record = read_latest_progress(log_file)
+    except OSError:
         return None
+    if record is None:
+        return None
+    return record.get("percent") or 0.0
 
 def is_process_running(pid: int) -> bool:
     """检查进程是否在运行"""
@@ -64,13 +81,20 @@ def monitor_downloads(output_dir: str):
 
     # 检查已完成和失败的下载
     print("\n✅ 已完成下载:")
+    variants = status.get("variants", {})
     for ep_num in status.get("completed", []):
-        print(f"  第 {ep_num} 集: 已完成")
+        variant = variants.get(str(ep_num))
+        print(f"  第 {ep_num} 集: 已完成" + (f" ({variant})" if variant else ""))
 
     print("\n❌ 下载失败:")
     for ep_num in status.get("failed", []):
         print(f"  第 {ep_num} 集: 失败")
 
+    if status.get("retrying"):
+        print("\n🔁 等待重试:")
+        for ep_num in status["retrying"]:
+            print(f"  第 {ep_num} 集: 等待重试")
+
     # 检查活动下载
     print("\n⏳ 正在下载:")
     if not active_downloads:
@@ -84,8 +108,489 @@ def monitor_downloads(output_dir: str):
             progress_str = f"{progress:.1f}%" if progress is not None else "未知"
             print(f"  第 {ep_num} 集: {status} (PID: {pid}, 进度: {progress_str})")
 
+def signal_manager(output_dir: str, timeout: float = 30) -> bool:
+    """向下载管理进程发送SIGTERM，由它立即终止子进程并记录状态；成功返回True"""
+    pid_file = os.path.join(output_dir, "download_manager.pid")
+    try:
+        with open(pid_file, 'r') as f:
+            main_pid = int(f.read().strip())
+        main_process = psutil.Process(main_pid)
+        main_process.send_signal(signal.SIGTERM)
+    except (FileNotFoundError, ValueError, psutil.NoSuchProcess):
+        return False
+
+    print(f"已向下载管理进程发送停止请求 (PID: {main_pid})")
+    try:
+        main_process.wait(timeout=timeout)
+        print("下载管理进程已退出")
+    except psutil.TimeoutExpired:
+        print("下载管理进程仍在收尾，可稍后再次查看状态")
+    return True
+
+def format_size(num_bytes: Optional[float]) -> str:
+    if num_bytes is None:
+        return "未知"
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if num_bytes < 1024 or unit == 'GiB':
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None or seconds < 0:
+        return "未知"
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class EpisodeState:
+    """watch模式下单集在内存中的状态"""
+
+    def __init__(self, now: float):
+        self.samples = deque(maxlen=WATCH_SAMPLES)  # (时间, 已下载字节)
+        self.first_sample: Optional[tuple] = None
+        self.last_change = now
+        self.record: Dict = {}
+        self.log_stat = None
+
+    def add_sample(self, now: float, downloaded: Optional[float]):
+        if downloaded is None:
+            return
+        if self.samples and downloaded != self.samples[-1][1]:
+            self.last_change = now
+        self.samples.append((now, downloaded))
+        if self.first_sample is None:
+            self.first_sample = (now, downloaded)
+
+    @property
+    def downloaded(self) -> Optional[float]:
+        return self.record.get("downloaded")
+
+    def instant_speed(self) -> Optional[float]:
+        """最近几次采样之间的速度"""
+        if len(self.samples) >= 2:
+            (t0, b0), (t1, b1) = self.samples[0], self.samples[-1]
+            if t1 > t0:
+                return max(0.0, (b1 - b0) / (t1 - t0))
+        return self.record.get("speed")
+
+    def average_speed(self, now: float) -> Optional[float]:
+        """从开始观察到现在的平均速度"""
+        if self.first_sample and self.samples:
+            t0, b0 = self.first_sample
+            t1, b1 = self.samples[-1]
+            if t1 > t0:
+                return max(0.0, (b1 - b0) / (t1 - t0))
+        return self.record.get("speed")
+
+    def eta(self) -> Optional[float]:
+        total, downloaded, speed = self.record.get("total"), self.downloaded, self.instant_speed()
+        if total and downloaded is not None and speed:
+            return (total - downloaded) / speed
+        return self.record.get("eta")
+
+class DownloadWatcher:
+    """常驻的监控：只重新读取发生变化的文件，各集状态保存在内存中"""
+
+    def __init__(self, output_dir: str, stall_seconds: float = DEFAULT_STALL_SECONDS):
+        self.output_dir = output_dir
+        self.stall_seconds = stall_seconds
+        self._json_cache: Dict[str, tuple] = {}
+        self._store_cache: Optional[tuple] = None
+        self._episodes: Dict[str, EpisodeState] = {}
+        self._pid_cache: Dict[int, tuple] = {}
+
+    def _load_json(self, name: str, default):
+        """按(mtime, size)缓存JSON文件，未变化时不重新解析"""
+        path = os.path.join(self.output_dir, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._json_cache.pop(name, None)
+            return default
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._json_cache.get(name)
+        if cached and cached[0] == key:
+            return cached[1]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (ValueError, OSError):
+            return cached[1] if cached else default
+        self._json_cache[name] = (key, data)
+        return data
+
+    def _is_running(self, pid: int, now: float) -> bool:
+        # 进程状态每5秒确认一次即可
+        cached = self._pid_cache.get(pid)
+        if cached and now - cached[0] < 5:
+            return cached[1]
+        running = is_process_running(pid)
+        self._pid_cache[pid] = (now, running)
+        return running
+
+    def _load_state(self):
+        """状态库(含WAL)未变化时直接使用上次的查询结果"""
+        signature = store_signature(self.output_dir)
+        if signature is None:
+            return (self._load_json("active_downloads.json", {}),
+                    self._load_json("download_status.json", {"completed": [], "failed": []}))
+        if self._store_cache and self._store_cache[0] == signature:
+            return self._store_cache[1]
+        state = (get_active_downloads(self.output_dir), get_download_status(self.output_dir))
+        self._store_cache = (signature, state)
+        return state
+
+    def refresh(self) -> Dict:
+        now = time.time()
+        active, status = self._load_state()
+
+        for ep_num in list(self._episodes):
+            if ep_num not in active:
+                del self._episodes[ep_num]
+
+        for ep_num in active:
+            state = self._episodes.get(ep_num)
+            if state is None:
+                state = self._episodes[ep_num] = EpisodeState(now)
+            log_file = os.path.join(self.output_dir, f"ep_{ep_num}_progress.log")
+            try:
+                st = os.stat(log_file)
+            except FileNotFoundError:
+                continue
+            log_stat = (st.st_mtime_ns, st.st_size)
+            if log_stat != state.log_stat:
+                state.log_stat = log_stat
+                state.record = read_latest_progress(log_file) or {}
+            state.add_sample(now, state.downloaded)
+
+        return {"now": now, "active": active, "status": status}
+
+    def render(self, snapshot: Dict) -> str:
+        now, active, status = snapshot["now"], snapshot["active"], snapshot["status"]
+        completed = status.get("completed", [])
+        failed = status.get("failed", [])
+        lines = [
+            f"=== 下载状态监控 ({time.strftime('%H:%M:%S')}) ===",
+            f"存储目录: {self.output_dir}",
+            f"已完成: {len(completed)}  失败: {len(failed)}  等待重试: {len(status.get('retrying', []))}  "
+            f"下载中: {len(active)}",
+            "",
+            f"{'集数':>6} {'状态':<6} {'进度':>7} {'已下载':>10} {'瞬时速度':>12} {'平均速度':>12} {'剩余时间':>9}",
+        ]
+
+        total_instant = total_average = 0.0
+        remaining_bytes = 0.0
+        sizes = []
+        for ep_num in sorted(active, key=lambda x: int(x)):
+            state = self._episodes.get(ep_num)
+            if state is None:
+                continue
+            info = active[ep_num]
+            instant = state.instant_speed() or 0.0
+            average = state.average_speed(now) or 0.0
+            total_instant += instant
+            total_average += average
+            record = state.record
+            if record.get("total"):
+                sizes.append(record["total"])
+                remaining_bytes += max(0.0, record["total"] - (state.downloaded or 0))
+
+            if not self._is_running(info["pid"], now):
+                label = "已停止"
+            elif now - state.last_change > self.stall_seconds:
+                label = "停滞"
+            else:
+                label = "运行中"
+            percent = record.get("percent")
+            lines.append(
+                f"{ep_num:>6} {label:<6} "
+                f"{(f'{percent:.1f}%' if percent is not None else '未知'):>7} "
+                f"{format_size(state.downloaded):>10} "
+                f"{format_size(instant) + '/s':>12} {format_size(average) + '/s':>12} "
+                f"{format_eta(state.eta()):>9}"
+            )
+
+        # 队列中尚未开始的集按当前平均单集大小估算
+        queue = status.get("queue", [])
+        finished = set(completed) | set(failed) | {int(ep) for ep in active}
+        pending = [ep for ep in queue if ep not in finished]
+        if sizes:
+            remaining_bytes += len(pending) * (sum(sizes) / len(sizes))
+        queue_eta = remaining_bytes / total_instant if total_instant and remaining_bytes else None
+
+        lines.append("")
+        lines.append(f"总速度: {format_size(total_instant)}/s (平均 {format_size(total_average)}/s)  "
+                     f"排队: {len(pending)}  队列剩余时间: {format_eta(queue_eta)}")
+        return "\n".join(lines)
+
+def watch_downloads(output_dir: str, interval: float = DEFAULT_WATCH_INTERVAL, stall_seconds: float = DEFAULT_STALL_SECONDS):
+    """常驻刷新监控，Ctrl-C 退出"""
+    watcher = DownloadWatcher(output_dir, stall_seconds)
+    try:
+        while True:
+            text = watcher.render(watcher.refresh())
+            # 清屏并移动光标到左上角
+            print("\033[H\033[2J" + text, flush=True)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+# ---- 多目录总览 ----
+# 含有这些文件之一的目录视为剧集下载目录
+SERIES_MARKERS = (STATE_DB_FILE, "download_status.json", "active_downloads.json")
+# 跨次运行保存的扫描缓存（按目录记录mtime和汇总结果）
+FLEET_CACHE_FILE = "fleet_cache.json"
+DEFAULT_FLEET_DEPTH = 2
+# 首次读取大量状态库时的并发数
+FLEET_READ_WORKERS = 8
+
+def _stat_key(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+class FleetScanner:
+    """扫描下载根目录下的所有剧集目录，汇总各目录的下载中/失败/完成数和总速度
+
+    目录的mtime未变时不重新列目录，状态库（含WAL）和进度日志的(mtime, size)未变时
+    不重新读取；缓存保存在全局状态目录，单次运行的 --root 也能跳过未变化的目录。
+    """
+
+    def __init__(self, root: str, max_depth: int = DEFAULT_FLEET_DEPTH,
+                 stall_seconds: float = DEFAULT_STALL_SECONDS, use_cache_file: bool = True):
+        self.root = os.path.abspath(root)
+        self.max_depth = max_depth
+        self.stall_seconds = stall_seconds
+        self.cache_path = state_path(FLEET_CACHE_FILE) if use_cache_file else None
+        # 目录路径 -> {"mtime", "series", "subdirs", "signature", "summary", "logs"}
+        self._cache: Dict[str, Dict] = self._load_cache()
+        self._pid_cache: Dict[int, tuple] = {}
+        self._visited = set()
+
+    def _load_cache(self) -> Dict[str, Dict]:
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + ".tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            pass
+
+    def _entry(self, path: str, mtime: int) -> Dict:
+        """目录的文件列表信息，mtime未变时使用缓存（不列目录）"""
+        entry = self._cache.get(path)
+        if entry is not None and entry.get("mtime") == mtime:
+            return entry
+        series, subdirs = False, []
+        try:
+            with os.scandir(path) as it:
+                for child in it:
+                    if child.name in SERIES_MARKERS:
+                        series = True
+                    elif child.is_dir(follow_symlinks=False) and not child.name.startswith('.'):
+                        subdirs.append(child.name)
+        except OSError:
+            pass
+        # 汇总结果是否有效由状态库的签名决定，列目录后保留
+        entry = {**(entry or {}), "mtime": mtime, "series": series, "subdirs": subdirs}
+        self._cache[path] = entry
+        return entry
+
+    def find_series(self) -> List[str]:
+        """一次 os.scandir 遍历找出所有剧集目录（剧集目录内部不再深入）"""
+        found = []
+        self._visited = set()
+        stack = [(self.root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            self._visited.add(path)
+            entry = self._entry(path, mtime)
+            if entry["series"]:
+                found.append(path)
+            elif depth < self.max_depth:
+                stack.extend((os.path.join(path, name), depth + 1) for name in entry["subdirs"])
+        return sorted(found)
+
+    @staticmethod
+    def _signature(path: str) -> Optional[list]:
+        signature = store_signature(path)
+        if signature is not None:
+            # 只读连接会创建空的WAL文件，空WAL与没有WAL等价
+            db, wal = signature
+            return [list(db), list(wal) if wal and wal[1] else None]
+        legacy = [_stat_key(os.path.join(path, name)) for name in ("active_downloads.json", "download_status.json")]
+        return legacy if any(legacy) else None
+
+    @staticmethod
+    def _read_state(path: str) -> Dict:
+        active, status = get_active_downloads(path), get_download_status(path)
+        completed, failed = status.get("completed", []), status.get("failed", [])
+        finished = set(completed) | set(failed) | {int(ep) for ep in active}
+        return {
+            "active": active,
+            "completed": len(completed),
+            "failed": sorted(failed),
+            "retrying": len(status.get("retrying", [])),
+            "pending": len([ep for ep in status.get("queue", []) if ep not in finished]),
+        }
+
+    def _is_running(self, pid: int, now: float) -> bool:
+        cached = self._pid_cache.get(pid)
+        if cached and now - cached[0] < 5:
+            return cached[1]
+        running = is_process_running(pid)
+        self._pid_cache[pid] = (now, running)
+        return running
+
+    def _active_speed(self, path: str, entry: Dict, now: float) -> Tuple[float, int]:
+        """正在下载的集的总速度和其中停滞的集数；进度日志未变化时使用上次的记录"""
+        logs = entry.setdefault("logs", {})
+        speed, stalled = 0.0, 0
+        for ep_num, info in entry["summary"]["active"].items():
+            log_file = os.path.join(path, f"ep_{ep_num}_progress.log")
+            key = _stat_key(log_file)
+            cached = logs.get(ep_num)
+            if key is None:
+                continue
+            if not cached or cached[0] != key:
+                try:
+                    record = read_latest_progress(log_file) or {}
+                except OSError:
+                    record = {}
+                cached = logs[ep_num] = [key, record.get("speed")]
+            if not self._is_running(info["pid"], now) or now - key[0] / 1e9 > self.stall_seconds:
+                stalled += 1
+            elif cached[1]:
+                speed += cached[1]
+        for ep_num in list(logs):
+            if ep_num not in entry["summary"]["active"]:
+                del logs[ep_num]
+        return speed, stalled
+
+    def refresh(self) -> Dict:
+        started = time.time()
+        paths = self.find_series()
+        signatures = {path: self._signature(path) for path in paths}
+        changed = [path for path in paths
+                   if self._cache[path].get("signature") != signatures[path] or "summary" not in self._cache[path]]
+
+        # 只重新读取有变化的状态库；首次扫描大量目录时并发读取
+        with ThreadPoolExecutor(max_workers=FLEET_READ_WORKERS) as pool:
+            for path, summary in zip(changed, pool.map(self._read_state, changed)):
+                self._cache[path]["summary"] = summary
+                self._cache[path]["signature"] = signatures[path]
+
+        # 本次没有遍历到的目录（已删除或超出深度）从缓存中移除
+        prefix = os.path.join(self.root, "")
+        for path in [p for p in self._cache if p.startswith(prefix) and p not in self._visited]:
+            del self._cache[path]
+
+        now = time.time()
+        series = []
+        for path in paths:
+            entry = self._cache[path]
+            summary = entry["summary"]
+            speed, stalled = self._active_speed(path, entry, now) if summary["active"] else (0.0, 0)
+            series.append({
+                "path": path,
+                "name": os.path.relpath(path, self.root),
+                "active": len(summary["active"]),
+                "stalled": stalled,
+                "retrying": summary["retrying"],
+                "failed": len(summary["failed"]),
+                "failed_episodes": summary["failed"],
+                "completed": summary["completed"],
+                "pending": summary["pending"],
+                "speed": speed,
+            })
+        return {"now": now, "root": self.root, "series": series, "changed": len(changed),
+                "elapsed": time.time() - started}
+
+    @staticmethod
+    def render(snapshot: Dict, show_all: bool = False) -> str:
+        series = snapshot["series"]
+        totals = {key: sum(item[key] for item in series)
+                  for key in ("active", "stalled", "retrying", "failed", "completed", "pending", "speed")}
+        # 默认只列出有下载、排队、重试或失败的目录
+        rows = series if show_all else [item for item in series
+                                        if item["active"] or item["pending"] or item["retrying"] or item["failed"]]
+        rows = sorted(rows, key=lambda item: (-item["active"], -item["speed"], item["name"]))
+        width = max([len("剧集目录")] + [len(item["name"]) for item in rows])
+        lines = [
+            f"=== 下载总览 ({time.strftime('%H:%M:%S')}) ===",
+            f"根目录: {snapshot['root']}  剧集目录: {len(series)}  "
+            f"(本次重新读取 {snapshot['changed']} 个, 用时 {snapshot['elapsed'] * 1000:.0f} ms)",
+            "",
+            f"{'剧集目录':<{width}} {'下载中':>6} {'停滞':>4} {'重试':>4} {'失败':>4} {'完成':>6} {'排队':>4} {'速度':>12}",
+        ]
+        for item in rows:
+            lines.append(f"{item['name']:<{width}} {item['active']:>6} {item['stalled']:>4} {item['retrying']:>4} "
+                         f"{item['failed']:>4} {item['completed']:>6} {item['pending']:>4} "
+                         f"{format_size(item['speed']) + '/s':>12}")
+        if not rows:
+            lines.append("（没有进行中的下载，--all 显示全部目录）")
+        lines.append("")
+        lines.append(f"{'合计':<{width}} {totals['active']:>6} {totals['stalled']:>4} {totals['retrying']:>4} "
+                     f"{totals['failed']:>4} {totals['completed']:>6} {totals['pending']:>4} "
+                     f"{format_size(totals['speed']) + '/s':>12}")
+        return "\n".join(lines)
+
+def show_fleet(root: str, watch: Optional[float] = None, show_all: bool = False, as_json: bool = False,
+               max_depth: int = DEFAULT_FLEET_DEPTH, stall_seconds: float = DEFAULT_STALL_SECONDS):
+    """多目录总览：单次输出，或 watch 秒刷新一次直到 Ctrl-C"""
+    scanner = FleetScanner(root, max_depth, stall_seconds)
+    try:
+        while True:
+            snapshot = scanner.refresh()
+            if as_json:
+                print(json.dumps(snapshot, ensure_ascii=False), flush=True)
+            elif watch is None:
+                print(scanner.render(snapshot, show_all))
+            else:
+                print("\033[H\033[2J" + scanner.render(snapshot, show_all), flush=True)
+            if watch is None:
+                break
+            time.sleep(watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scanner.save_cache()
+
 def stop_downloads(output_dir: str):
     """停止所有下载进程"""
+    # 守护进程：取消该目录排队中和正在下载的剧集，其它剧不受影响
+    if daemon_running():
+        try:
+            result = daemon_request("cancel", output_dir=os.path.abspath(output_dir))
+        except DaemonError as e:
+            print(f"通知守护进程失败: {e}")
+        else:
+            if result['removed'] or result['stopped']:
+                print(f"已从队列移除: {result['removed'] or '无'}，已终止下载: {result['stopped'] or '无'}")
+                return
+            # 守护进程没有这部剧的任务，可能由 --no-daemon 的管理进程下载
+
+    # 单独的管理进程监听SIGTERM，直接通知即可
+    if signal_manager(output_dir):
+        return
+
+    # 兼容旧版管理进程：设置停止标志并逐个终止子进程
     active_downloads = get_active_downloads(output_dir)
 
     if not active_downloads:
@@ -94,16 +599,33 @@ def stop_downloads(output_dir: str):
 
     print("正在停止下载进程...")
     stopped = 0
+    signalled = set()
 
-    # 1. 设置停止标志
-    stop_flag = os.path.join(output_dir, "stop_flag")
-    with open(stop_flag, 'w') as f:
-        f.write('1')
-
-    # 2. 终止所有活动进程
+    # 1. 终止所有活动进程
     for ep_num, info in active_downloads.items():
         pid = info["pid"]
 
+        # native引擎没有单独的子进程，记录的是下载管理进程的PID，由它收到SIGTERM后停止所有下载
+        if info.get("engine") == "native":
+            if pid in signalled:
+                stopped += 1
+                continue
+            try:
+                process = psutil.Process(pid)
+                if any(os.path.basename(arg) == "daemon.py" for arg in process.cmdline()):
+                    # 守护进程上面已经取消过，这是过期的记录，不能停止整个守护进程
+                    print(f"第 {ep_num} 集的记录属于下载守护进程且已不在下载，跳过")
+                    continue
+                process.send_signal(signal.SIGTERM)
+                signalled.add(pid)
+                stopped += 1
+                print(f"第 {ep_num} 集由进程内引擎下载，已向下载管理进程发送停止请求 (PID: {pid})")
+            except psutil.NoSuchProcess:
+                print(f"进程 {pid} (第 {ep_num} 集) 已不存在")
+            except psutil.Error as e:
+                print(f"停止进程 {pid} 时出错: {str(e)}")
+            continue
+
         try:
             # 尝试优雅地停止进程
             process = psutil.Process(pid)
@@ -124,12 +646,14 @@ def stop_downloads(output_dir: str):
         except Exception as e:
             print(f"停止进程 {pid} 时出错: {str(e)}")
 
-    # 3. 清除活动下载记录
+    # 2. 清除活动下载记录
     active_file = os.path.join(output_dir, "active_downloads.json")
     if os.path.exists(active_file):
         os.remove(active_file)
+    if os.path.exists(os.path.join(output_dir, STATE_DB_FILE)):
+        open_store(output_dir).clear_active()
 
-    # 4. 检查并终止主进程
+    # 3. 检查并终止主进程
     pid_file = os.path.join(output_dir, "download_manager.pid")
     if os.path.exists(pid_file):
         with open(pid_file, 'r') as f:
@@ -148,20 +672,161 @@ def stop_downloads(output_dir: str):
 
     print(f"\n已成功停止 {stopped} 个下载进程")
 
+def set_bandwidth(limit: Optional[str], schedule: Optional[str]):
+    """修改全局带宽配置，运行中的下载几秒内按新限速继续，无需重启"""
+    try:
+        config = save_config(limit=limit, schedule=schedule)
+    except ValueError as e:
+        print(f"错误: 带宽设置无效: {e}")
+        return
+    print(f"固定限速: {config.get('limit') or '无'}")
+    print(f"时间表: {config.get('schedule') or '无'}")
+    print(f"当前生效: {format_rate(current_rate())}")
+
+def show_queue():
+    """列出守护进程全局队列中的剧集"""
+    try:
+        result = daemon_request("list")
+    except DaemonError as e:
+        print(f"下载守护进程未运行: {e}")
+        return
+    print(f"\n=== 守护进程队列 (同时 {result['max_workers']} 集, 每主机 {result['per_host_limit']} 集) ===")
+    if not result["jobs"]:
+        print("队列为空")
+    labels = {"running": "下载中", "queued": "排队", "paused": "已暂停"}
+    for job in result["jobs"]:
+        state = labels.get(job["state"], job["state"])
+        if job["state"] == "queued" and job["not_before"] > time.time():
+            state = f"{format_eta(job['not_before'] - time.time())}后重试"
+        print(f"  [{state}] {job['title']} 第 {job['ep_num']} 集 "
+              f"(优先级 {job['priority']}, 重试 {job['attempt']} 次, {job['host']})")
+
+def control_queue(command: str, output_dir: str, **params):
+    """向守护进程发送 pause/resume/priority 请求"""
+    try:
+        result = daemon_request(command, output_dir=os.path.abspath(output_dir), **params)
+    except DaemonError as e:
+        print(f"操作失败: {e}")
+        return
+    if command == "priority":
+        print(f"已修改 {result['updated']} 个排队任务的优先级")
+    else:
+        print("已暂停（正在下载的集会继续完成）" if command == "pause" else "已恢复")
+
+def show_metrics(output_dir: Optional[str]):
+    """显示各阶段的计时和计数：指定目录时读取其 metrics.json（--no-daemon 下载时写入），
+    否则取守护进程的实时指标或最近写入的 ~/.ov_downloader/metrics.json
+
+    守护进程的指标按进程统计、不区分下载目录，目录中没有 metrics.json 时显示守护进程的指标并加以说明。
+    """
+    snapshot = None
+    if output_dir is not None:
+        snapshot = load_snapshot(os.path.join(output_dir, METRICS_FILE))
+    if snapshot is None and daemon_running():
+        try:
+            snapshot = daemon_request("metrics")["snapshot"]
+        except DaemonError as e:
+            print(f"获取守护进程指标失败: {e}")
+    if snapshot is None:
+        snapshot = load_snapshot(state_path(METRICS_FILE))
+    if snapshot is None:
+        print("没有指标数据")
+        return
+    if output_dir is not None and not os.path.exists(os.path.join(output_dir, METRICS_FILE)):
+        print("该目录由下载守护进程下载，以下为守护进程中所有剧集的合计指标")
+    updated = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['updated_at']))
+    print(f"\n=== 下载指标 (PID {snapshot['pid']}, 更新于 {updated}) ===")
+    for line in format_snapshot(snapshot):
+        print(f"  {line}")
+
+def show_bandwidth():
+    config = load_config()
+    if config:
+        print(f"📶 带宽限制: {format_rate(current_rate())} "
+              f"(固定: {config.get('limit') or '无'}, 时间表: {config.get('schedule') or '无'})")
+
 def main():
     parser = argparse.ArgumentParser(description="下载监控和管理工具")
-    parser.add_argument("output_dir", help="下载目录路径")
+    parser.add_argument("output_dir", nargs="?", help="下载目录路径")
+    parser.add_argument("--root", default=None,
+                        help="总览模式：汇总该目录下所有剧集目录的下载中/失败/完成数和总速度")
+    parser.add_argument("--all", action="store_true", help="配合 --root 列出全部剧集目录（默认只列有活动的）")
+    parser.add_argument("--json", action="store_true", help="配合 --root 输出JSON")
+    parser.add_argument("--depth", type=int, default=DEFAULT_FLEET_DEPTH,
+                        help=f"配合 --root 查找剧集目录的最大深度 (默认: {DEFAULT_FLEET_DEPTH})")
     parser.add_argument("--stop", action="store_true", help="停止所有下载进程")
+    parser.add_argument("-w", "--watch", action="store_true", help="持续刷新监控")
+    parser.add_argument("--interval", type=float, default=DEFAULT_WATCH_INTERVAL, metavar="SECONDS",
+                        help=f"配合 --watch 的刷新间隔秒数 (默认: {DEFAULT_WATCH_INTERVAL:g})")
+    parser.add_argument("--stall", type=float, default=DEFAULT_STALL_SECONDS,
+                        help=f"多少秒没有进展视为停滞 (默认: {DEFAULT_STALL_SECONDS})")
+    parser.add_argument("--limit", default=None,
+                        help="修改全局带宽上限，如 20Mbit、2.5M、0（不限速）")
+    parser.add_argument("--schedule", default=None,
+                        help='修改按时间段限速，如 "08:00-23:00=20Mbit,23:00-08:00=0"，空字符串清除')
+
+    parser.add_argument("--list", action="store_true", help="列出下载守护进程的全局队列")
+    parser.add_argument("--pause", action="store_true", help="暂停该目录排队中的剧集")
+    parser.add_argument("--resume", action="store_true", help="恢复已暂停的目录")
+    parser.add_argument("--priority", type=int, default=None,
+                        help="修改该目录排队中剧集的优先级（越大越先下载）")
+    parser.add_argument("--episodes", default=None,
+                        help="配合 --stop/--priority 只作用于指定集数，如 3,5,7")
+    parser.add_argument("--shutdown", action="store_true", help="停止下载守护进程及其所有下载")
+    parser.add_argument("--metrics", action="store_true",
+                        help="显示各阶段的耗时和计数（页面解析、m3u8提取、排队、下载、分片、写盘、封装）")
 
     args = parser.parse_args()
 
+    if args.shutdown:
+        try:
+            daemon_request("shutdown")
+            print("已通知下载守护进程退出")
+        except DaemonError as e:
+            print(f"下载守护进程未运行: {e}")
+        return
+    if args.list:
+        show_queue()
+        return
+    if args.metrics:
+        show_metrics(args.output_dir)
+        return
+    if args.root is not None:
+        if not os.path.isdir(args.root):
+            print(f"错误: 目录 {args.root} 不存在")
+            return
+        show_fleet(args.root, args.interval if args.watch else None, args.all, args.json, args.depth, args.stall)
+        return
+
+    if args.limit is not None or args.schedule is not None:
+        set_bandwidth(args.limit, args.schedule)
+        if args.output_dir is None:
+            return
+
+    if args.output_dir is None:
+        parser.error("需要指定下载目录")
+
     if not os.path.exists(args.output_dir):
         print(f"错误: 目录 {args.output_dir} 不存在")
         return
 
-    if args.stop:
+    episodes = [int(ep) for ep in args.episodes.split(",")] if args.episodes else None
+    if args.pause or args.resume:
+        control_queue("pause" if args.pause else "resume", args.output_dir)
+    elif args.priority is not None:
+        control_queue("priority", args.output_dir, priority=args.priority, episodes=episodes)
+    elif args.stop and episodes:
+        try:
+            result = daemon_request("cancel", output_dir=os.path.abspath(args.output_dir), episodes=episodes)
+            print(f"已从队列移除: {result['removed'] or '无'}，已终止下载: {result['stopped'] or '无'}")
+        except DaemonError as e:
+            print(f"操作失败: {e}")
+    elif args.stop:
         stop_downloads(args.output_dir)
+    elif args.watch:
+        watch_downloads(args.output_dir, args.interval, args.stall)
     else:
+        show_bandwidth()
         monitor_downloads(args.output_dir)
 
 if __name__ == "__main__":
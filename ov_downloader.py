@@ -1,6 +1,17 @@
 import sys
-from url_parser import parse_video_page
-from core_downloader import download_episodes, save_download_status, get_download_status  # 添加导入
+import argparse
+# 默认通过常驻守护进程下载，客户端只导入标准库模块，不加载 cloudscraper/bs4
+from daemon_client import ensure_daemon, daemon_supported, request as daemon_request, DaemonError, PARSE_TIMEOUT
+from rate_limiter import site_limiter, DEFAULT_REQUESTS_PER_SECOND, DEFAULT_BURST
+from retry_policy import DEFAULT_MAX_RETRIES
+from bandwidth import save_config, parse_rate
+from hls_playlist import VariantPolicy
+from manifest import load_manifest, parse_selector
+from completion_index import completed_episodes
+from state_store import STATE_DB_FILE
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import (DEFAULT_MAX_WORKERS, DEFAULT_PER_HOST_LIMIT, ENGINES, ENGINE_AUTO,
+                       OUTPUT_MODES, OUTPUT_REMUX)
 import os
 import logging
 from datetime import datetime
@@ -28,14 +39,90 @@ def extract_episode_number(text):
     match = re.search(r'第(\d+)(?:集|话)', text)
     return int(match.group(1)) if match else None
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="在线视频(m3u8)下载工具")
+    parser.add_argument("url", nargs="?", help="在线视频链接")
+    parser.add_argument("-m", "--manifest", default=None,
+                        help="批量下载清单：每行一个剧集页面URL，后跟剧集选择如 1-5,8,12- / all / new-only")
+    parser.add_argument("--parse-workers", type=int, default=4,
+                        help="批量模式并发解析剧集页面的数量 (默认: 4)")
+    # 不指定时沿用守护进程当前的设置
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help=f"同时下载的集数 (默认: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("--per-host", type=int, default=None,
+                        help=f"每个CDN主机同时下载的集数 (默认: {DEFAULT_PER_HOST_LIMIT})")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="根据实测吞吐和错误率自动调整每个CDN主机的并发数（-j 为上限）")
+    parser.add_argument("--engine", choices=ENGINES + (ENGINE_AUTO,), default=ENGINE_AUTO,
+                        help="下载引擎: yt-dlp; yt-dlp-aria2c (aria2c多连接下载分片); aria2c (直接下载分片列表); "
+                             "native (进程内并发分片下载); auto (默认, 按 ~/.ov_downloader/backends.json "
+                             "为各CDN/站点选择, 未配置时为 yt-dlp)")
+    parser.add_argument("--output", choices=OUTPUT_MODES, default=OUTPUT_REMUX, dest="output_mode",
+                        help="remux: 下载TS后封装MP4（可续传）; stream: 边下载边封装，只写一次盘; ts: 只输出单个TS文件")
+    parser.add_argument("--segment-workers", type=int, default=None,
+                        help="native/aria2c/yt-dlp-aria2c 引擎每集并发下载的分片数 (默认: 8)")
+    parser.add_argument("--extract-workers", type=int, default=None,
+                        help="并发提取m3u8链接的线程数 (默认: 4)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"单集失败后自动重试的次数 (默认: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help=f"每个站点每秒最多请求数 (默认: {DEFAULT_REQUESTS_PER_SECOND})")
+    parser.add_argument("--burst", type=float, default=DEFAULT_BURST,
+                        help=f"每个站点允许的突发请求数 (默认: {DEFAULT_BURST})")
+    parser.add_argument("--variant", default=None,
+                        help='主播放列表的版本选择策略，如 720p、"max-bitrate=4M"、"min-height=720"（不低于720p的最小版本）')
+    parser.add_argument("--limit", default=None,
+                        help="所有剧集共享的总带宽上限，如 20Mbit、2.5M（字节/秒）、0 为不限速")
+    parser.add_argument("--schedule", default=None,
+                        help='按时间段限速，如 "08:00-23:00=20Mbit,23:00-08:00=0"')
+    parser.add_argument("--priority", type=int, default=0,
+                        help="在守护进程的全局队列中的优先级，越大越先下载 (默认: 0)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="启动守护进程时在该端口提供Prometheus格式的 /metrics（仅本机）")
+    parser.add_argument("--hash-outputs", action="store_true",
+                        help="完成索引同时记录输出文件的SHA-256，检查已下载剧集时校验内容（需要读取整个文件）")
+    parser.add_argument("--segment-cache", default=None, metavar="SIZE",
+                        help="native引擎的本地分片缓存上限，如 2G；各集共用的片头、片尾、广告分片只下载一次 (默认不启用)")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="不使用常驻守护进程，为本次下载单独启动后台进程（旧方式）")
+    args = parser.parse_args()
+    if not args.url and not args.manifest:
+        parser.error("需要提供在线视频链接或 --manifest 清单")
+    return args
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <url>")
+    args = parse_args()
+    site_limiter.configure(args.rate, args.burst)
+    try:
+        variant_policy = VariantPolicy.parse(args.variant) if args.variant else None
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+    try:
+        args.segment_cache = parse_rate(args.segment_cache)
+    except ValueError as e:
+        print(f"错误: 分片缓存大小无效: {e}")
         return
+    if args.limit is not None or args.schedule is not None:
+        # 写入全局带宽配置，下载过程中可用 monitor.py --limit/--schedule 修改
+        try:
+            save_config(limit=args.limit, schedule=args.schedule)
+        except ValueError as e:
+            print(f"错误: 带宽设置无效: {e}")
+            return
+
+    # 守护进程不可用时（如Windows）退回到单独的后台进程
+    use_daemon = daemon_supported() and not args.no_daemon
+    if use_daemon and not ensure_daemon(args.jobs, args.per_host, args.adaptive, args.metrics_port):
+        print("⚠️ 无法启动下载守护进程，改为单独的后台进程下载")
+        use_daemon = False
 
-    original_url = sys.argv[1]  # 用户提供的原始URL
-    result = parse_video_page(original_url)
+    if args.manifest:
+        run_manifest(args, use_daemon, variant_policy)
+        return
 
+    original_url = args.url  # 用户提供的原始URL
+    result = parse_series(original_url, use_daemon, args)
     if not result:
         print("Failed to parse the URL")
         return
@@ -48,52 +135,36 @@ def main():
     logger.info(f"总集数: {len(result['episode_urls'])}\n")
     logger.info(f"=== 所有剧集URL ===")
 
-    # 按字符串顺序排序
-    sorted_episodes = sorted(
-        result['episode_urls'],
-        key=lambda item: format_number(item[0])  # 使用URL进行排序
-    )
+    sorted_episodes = sort_episodes(result)
 
     # 按字符串顺序排序
     for idx, (url, text) in enumerate(sorted_episodes, start=1):
         logger.info(f"{idx}. {text} ({url})")
 
     # 创建下载目录
-    download_dir = os.path.join(os.path.dirname(__file__), result['title'])
+    download_dir = series_dir(result['title'])
     os.makedirs(download_dir, exist_ok=True)
 
-    # 保存初始状态并记录原始URL
-    status = get_download_status(download_dir)
-    save_download_status(download_dir, status, original_url=original_url)
-
     # 获取用户输入后添加确认提示
-    user_input = input("\n请输入要下载的编号(如: 1 或 1-5): ").strip()
+    user_input = input("\n请输入要下载的编号(如: 1、1-5、1-5,8,12-、all、new-only): ").strip()
 
     # 处理用户输入
     if not user_input:
         logger.error("未输入编号范围")
         return
 
-    # 处理编号范围
-    if '-' in user_input:
-        start, end = map(int, user_input.split('-'))
-        idxs_to_download = list(range(start, end + 1))
-    else:
-        idxs_to_download = [int(user_input)]
-
-    # 验证输入范围
-    max_episode = len(sorted_episodes)
-    idxs_to_download = [idx for idx in idxs_to_download if 1 <= idx <= max_episode]
+    # 处理编号范围（超出范围的编号会被忽略）
+    try:
+        idxs_to_download = parse_selector(user_input, len(sorted_episodes),
+                                          completed_positions(sorted_episodes, download_dir, result['title']))
+    except ValueError as e:
+        logger.error(str(e))
+        return
 
     if not idxs_to_download:
         logger.error("无效的编号范围")
         return
 
-    # 提取对应的集数编号（第X集的X）
-    episode_numbers = [
-        extract_episode_number(sorted_episodes[ep - 1][1]) for ep in idxs_to_download
-    ]
-
     # 处理输入后添加详细反馈
     logger.info("=== 下载设置 ===")
     logger.info(f"电视剧名称: {result['title']}")
@@ -107,16 +178,136 @@ def main():
         return
 
     logger.info(f"准备下载以下编号集: {idxs_to_download}")
+    start_downloads([build_series(result, sorted_episodes, idxs_to_download, download_dir, original_url)],
+                    use_daemon, args, variant_policy, logger)
+
+def parse_series(url, use_daemon, args):
+    """解析剧集页面（优先交给守护进程），失败返回None"""
+    if not use_daemon:
+        from url_parser import parse_video_page
+        return parse_video_page(url)
+    try:
+        return daemon_request("parse", timeout=PARSE_TIMEOUT, url=url,
+                              rate=args.rate, burst=args.burst)["result"]
+    except DaemonError as e:
+        print(f"解析失败 {url}: {e}")
+        return None
+
+def sort_episodes(result):
+    """按URL的字符串顺序排序（数字补零后比较）"""
+    return sorted(result['episode_urls'], key=lambda item: format_number(item[0]))
 
-    # 确保下载时也使用排序后的URL列表
-    download_episodes(
-        urls=[sorted_episodes[ep - 1][0] for ep in idxs_to_download],
-        output_dir=download_dir,
-        title=result['title'],
-        episode_numbers=episode_numbers,  # 传递实际的集数编号
-        logger=logger
+def series_dir(title):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), title)
+
+def completed_positions(sorted_episodes, download_dir, title):
+    """输出文件完整的剧集在排序列表中的序号，供 new-only 使用（丢失或损坏的剧集算作未下载）"""
+    if not os.path.exists(os.path.join(download_dir, STATE_DB_FILE)):
+        return set()
+    completed = completed_episodes(download_dir, title)
+    return {idx for idx, (_, text) in enumerate(sorted_episodes, start=1)
+            if extract_episode_number(text) in completed}
+
+def build_series(result, sorted_episodes, idxs, download_dir, original_url):
+    """一部剧的下载请求：页面URL和对应的集数编号（第X集的X）"""
+    return {
+        "urls": [sorted_episodes[idx - 1][0] for idx in idxs],
+        "episode_numbers": [extract_episode_number(sorted_episodes[idx - 1][1]) for idx in idxs],
+        "output_dir": download_dir,
+        "title": result['title'],
+        "original_url": original_url,
+    }
+
+def start_downloads(series, use_daemon, args, variant_policy, logger):
+    """把一部或多部剧交给下载阶段：守护进程的全局队列，或单独的后台进程"""
+    bandwidth = args.limit is not None or args.schedule is not None
+
+    if use_daemon:
+        for item in series:
+            try:
+                daemon_request(
+                    "enqueue",
+                    **item,
+                    max_workers=args.jobs,
+                    per_host_limit=args.per_host,
+                    engine=args.engine,
+                    segment_workers=args.segment_workers,
+                    extract_workers=args.extract_workers,
+                    max_retries=args.retries,
+                    variant=args.variant,
+                    output_mode=args.output_mode,
+                    bandwidth=bandwidth,
+                    priority=args.priority,
+                    rate=args.rate,
+                    burst=args.burst,
+                    hash_outputs=args.hash_outputs,
+                    segment_cache=args.segment_cache
+                )
+            except DaemonError as e:
+                logger.error(f"{item['title']} 加入下载队列失败: {e}")
+                continue
+            logger.info(f"✅ {item['title']}: 已加入下载守护进程的队列 {item['episode_numbers']}")
+            logger.info(f"📁 下载目录: {item['output_dir']}")
+        logger.info("m3u8链接在后台解析")
+        logger.info(f"🔍 查看队列: python monitor.py --list")
+        logger.info(f"🔍 检查下载: python monitor.py [下载目录] --watch")
+        logger.info(f"🛑 停止某部剧: python monitor.py [下载目录] --stop")
+        return
+
+    from core_downloader import download_series, record_original_url, DEFAULT_EXTRACT_WORKERS
+    for item in series:
+        # 记录原始URL（守护进程在入队时记录）
+        os.makedirs(item["output_dir"], exist_ok=True)
+        record_original_url(item["output_dir"], item.pop("original_url"))
+    download_series(
+        series,
+        logger=logger,
+        max_workers=args.jobs or DEFAULT_MAX_WORKERS,
+        per_host_limit=args.per_host or DEFAULT_PER_HOST_LIMIT,
+        engine=args.engine,
+        segment_workers=args.segment_workers,
+        extract_workers=args.extract_workers or DEFAULT_EXTRACT_WORKERS,
+        max_retries=args.retries,
+        adaptive=args.adaptive,
+        bandwidth=bandwidth,
+        variant_policy=variant_policy,
+        output_mode=args.output_mode,
+        hash_outputs=args.hash_outputs,
+        segment_cache=args.segment_cache
     )
 
+def run_manifest(args, use_daemon, variant_policy):
+    """批量模式：并发解析清单中的所有剧，按清单顺序全部放入一个下载队列，不需要交互"""
+    logger = setup_logging("batch")
+    try:
+        entries = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        logger.error(f"读取清单失败: {e}")
+        return
+    logger.info(f"清单中共 {len(entries)} 部剧，正在并发解析...")
+
+    # 请求速率由站点令牌桶限制（守护进程或本进程内共享）
+    with ThreadPoolExecutor(max_workers=max(1, args.parse_workers)) as pool:
+        results = list(pool.map(lambda entry: parse_series(entry.url, use_daemon, args), entries))
+
+    series = []
+    for entry, result in zip(entries, results):
+        if not result:
+            logger.error(f"第 {entry.line} 行解析失败，跳过: {entry.url}")
+            continue
+        sorted_episodes = sort_episodes(result)
+        download_dir = series_dir(result['title'])
+        idxs = parse_selector(entry.selector, len(sorted_episodes),
+                              completed_positions(sorted_episodes, download_dir, result['title']))
+        logger.info(f"{result['title']}: 共 {len(sorted_episodes)} 集，选择 {entry.selector} -> {idxs}")
+        if idxs:
+            series.append(build_series(result, sorted_episodes, idxs, download_dir, entry.url))
+
+    if not series:
+        logger.info("没有需要下载的剧集")
+        return
+    start_downloads(series, use_daemon, args, variant_policy, logger)
+
 def format_number(url):
     """
     将url中所有小于100的数字扩展成3位数（高位补0）
@@ -0,0 +1,227 @@
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin
+
+# lxml 为可选依赖，安装后自动使用（C实现，快一个数量级）
+try:
+    import lxml.html as _lxml_html
+except ImportError:
+    _lxml_html = None
+
+BACKEND_LXML = "lxml"
+BACKEND_HTMLPARSER = "html.parser"
+
+# 没有结束标签的元素，不入栈
+_VOID_ELEMENTS = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+                            "meta", "param", "source", "track", "wbr", "basefont", "bgsound",
+                            "frame", "keygen", "menuitem", "spacer"))
+# 其中的文本不计入 get_text()（与 BeautifulSoup 一致）
+_SKIP_TEXT = frozenset(("script", "style", "template"))
+
+@dataclass
+class PageCandidates:
+    """一次遍历收集到的标题候选和全部链接"""
+    og_title: Optional[str] = None
+    title: Optional[str] = None
+    h1: Optional[str] = None
+    anchors: List[Tuple[str, str]] = field(default_factory=list)  # (href, 链接文本)
+
+class _Capture:
+    """正在收集文本的元素（链接、首个title/h1）"""
+    __slots__ = ("kind", "parts", "index")
+
+    def __init__(self, kind: str, index: int = -1):
+        self.kind = kind
+        self.parts: List[str] = []
+        self.index = index
+
+class _CandidateParser(HTMLParser):
+    """流式解析：不建树，只维护打开的标签栈，边读边收集候选
+
+    结束标签的处理与 BeautifulSoup(html.parser) 相同：关闭到最近的同名标签，
+    没有对应的打开标签时忽略，因此链接文本与 get_text() 一致。
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.result = PageCandidates()
+        self._stack: List[Tuple[str, Optional[_Capture]]] = []
+        self._captures: List[_Capture] = []
+        self._skip = 0
+        self._title_seen = False
+        self._h1_seen = False
+
+    def handle_starttag(self, tag, attrs):
+        capture = None
+        if tag == "a":
+            href = None
+            for name, value in attrs:
+                if name == "href":
+                    href = value  # 重复属性以最后一个为准
+            if href is not None:
+                self.result.anchors.append((href, ""))
+                capture = _Capture("a", len(self.result.anchors) - 1)
+        elif tag == "meta":
+            if self.result.og_title is None:
+                values = dict(attrs)
+                if values.get("property") == "og:title" and values.get("content"):
+                    self.result.og_title = values["content"]
+        elif tag == "title" and not self._title_seen:
+            self._title_seen = True
+            capture = _Capture("title")
+        elif tag == "h1" and not self._h1_seen:
+            self._h1_seen = True
+            capture = _Capture("h1")
+
+        if tag in _VOID_ELEMENTS:
+            return
+        if capture is not None:
+            self._captures.append(capture)
+        if tag in _SKIP_TEXT:
+            self._skip += 1
+        self._stack.append((tag, capture))
+
+    def handle_endtag(self, tag):
+        for pos in range(len(self._stack) - 1, -1, -1):
+            if self._stack[pos][0] == tag:
+                while len(self._stack) > pos:
+                    self._pop()
+                return
+
+    def _pop(self):
+        tag, capture = self._stack.pop()
+        if tag in _SKIP_TEXT:
+            self._skip -= 1
+        if capture is not None:
+            self._captures.remove(capture)
+            self._finish(capture)
+
+    def _finish(self, capture: _Capture):
+        text = "".join(capture.parts)
+        if capture.kind == "a":
+            href, _ = self.result.anchors[capture.index]
+            self.result.anchors[capture.index] = (href, text)
+        elif capture.kind == "title":
+            self.result.title = text
+        else:
+            self.result.h1 = text
+
+    def handle_data(self, data):
+        if self._skip or not self._captures:
+            return
+        for capture in self._captures:
+            capture.parts.append(data)
+
+    def close(self):
+        super().close()
+        # 文档结束时仍未关闭的元素
+        while self._stack:
+            self._pop()
+
+def _collect_htmlparser(html_text: str) -> PageCandidates:
+    parser = _CandidateParser()
+    parser.feed(html_text)
+    parser.close()
+    return parser.result
+
+def _lxml_text(el) -> str:
+    """与 get_text() 相同：拼接后代文本，跳过注释和 script/style 的内容"""
+    parts = []
+
+    def walk(node):
+        if isinstance(node.tag, str) and node.tag not in _SKIP_TEXT and node.text:
+            parts.append(node.text)
+        for child in node:
+            walk(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    walk(el)
+    return "".join(parts)
+
+def _collect_lxml(html_text: str) -> PageCandidates:
+    result = PageCandidates()
+    root = _lxml_html.document_fromstring(html_text)
+    for el in root.iter("a", "meta", "title", "h1"):
+        tag = el.tag
+        if tag == "a":
+            href = el.get("href")
+            if href is not None:
+                result.anchors.append((href, _lxml_text(el)))
+        elif tag == "meta":
+            if result.og_title is None and el.get("property") == "og:title" and el.get("content"):
+                result.og_title = el.get("content")
+        elif tag == "title":
+            if result.title is None:
+                result.title = _lxml_text(el)
+        elif result.h1 is None:
+            result.h1 = _lxml_text(el)
+    return result
+
+def collect_candidates(html_text: str, backend: Optional[str] = None) -> PageCandidates:
+    """一次遍历页面，收集标题候选和所有 <a href> 链接
+
+    标准库后端的结果与 BeautifulSoup(html.parser) 完全一致；lxml 按HTML规范处理不规范的标记
+    （例如未闭合的 <a> 遇到下一个 <a> 时自动闭合），这类页面上链接文本可能更准确但不完全相同。
+    """
+    if backend is None:
+        backend = BACKEND_LXML if _lxml_html is not None else BACKEND_HTMLPARSER
+    if backend == BACKEND_LXML:
+        try:
+            return _collect_lxml(html_text)
+        except ValueError:
+            # 例如带编码声明的XML文档，退回标准库解析器
+            pass
+    return _collect_htmlparser(html_text)
+
+def pick_title(candidates: PageCandidates) -> Optional[str]:
+    """按 og:title、<title>、<h1> 的顺序选择剧名，有《》时只取其中内容"""
+    title = candidates.og_title
+
+    if not title and candidates.title is not None:
+        # 清理标题中的不必要部分
+        title = candidates.title.strip().split('-')[0].split('|')[0].split('_')[0].strip()
+
+    if not title and candidates.h1 is not None:
+        title = candidates.h1.strip()
+
+    if title and '《' in title and '》' in title:
+        match = re.search(r'《(.*?)》', title)
+        if match:
+            title = match.group(1)
+
+    return title
+
+def pick_episode_urls(candidates: PageCandidates, base_url: str) -> List[Tuple[str, str]]:
+    """从链接中选出分集URL，规则与 url_parser.extract_episode_urls 相同"""
+    rules = [
+        # 规则1：匹配明确包含"第X集"或"第X话"的链接
+        ('explicit_episode_links',
+         lambda text: '第' in (stripped := text.strip()) and ('集' in stripped or '话' in stripped)),
+        # 规则2：匹配包含数字的链接文本
+        ('numeric_links', lambda text: any(char.isdigit() for char in text)),
+    ]
+
+    episode_urls = []
+    for name, matches in rules:
+        seen_urls = set()
+        for href, text in candidates.anchors:
+            if not matches(text):
+                continue
+            full_url = urljoin(base_url, href)
+            if full_url not in seen_urls:
+                seen_urls.add(full_url)
+                episode_urls.append((full_url, text))
+        if episode_urls:
+            print(f"分集URL提取方式: {name}")
+            break
+
+    # 过滤仅包含'-'的URL
+    return [(url, text) for url, text in episode_urls if '-' in url]
+
+def parse_series_page(html_text: str, url: str, backend: Optional[str] = None) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+    """解析剧集页面，返回 (剧名, [(分集URL, 链接文本)])"""
+    candidates = collect_candidates(html_text, backend)
+    return pick_title(candidates), pick_episode_urls(candidates, url)
@@ -0,0 +1,87 @@
+import os
+from typing import Dict, List, Optional
+
+# 结构化进度记录的行前缀
+PROGRESS_PREFIX = "[progress]"
+
+# yt-dlp --progress-template，每次进度更新输出一行紧凑记录:
+# [progress] 已下载字节 总字节 速度(B/s) ETA(秒) 当前分片 分片总数 （缺失字段为NA）
+YTDLP_PROGRESS_TEMPLATE = (
+    "download:" + PROGRESS_PREFIX +
+    " %(progress.downloaded_bytes)s"
+    " %(progress.total_bytes,progress.total_bytes_estimate)s"
+    " %(progress.speed)s"
+    " %(progress.eta)s"
+    " %(progress.fragment_index)s"
+    " %(progress.fragment_count)s"
+)
+
+_FIELDS = ("downloaded", "total", "speed", "eta", "frag", "frag_count")
+
+# 只读取日志末尾这么多字节，与日志总大小无关
+TAIL_BYTES = 8192
+
+def format_progress(downloaded: float, total: Optional[float] = None, speed: Optional[float] = None,
+                    eta: Optional[float] = None, frag: Optional[int] = None,
+                    frag_count: Optional[int] = None) -> str:
+    """生成与yt-dlp进度模板相同格式的一行记录（供进程内引擎使用）"""
+    values = (downloaded, total, speed, eta, frag, frag_count)
+    return PROGRESS_PREFIX + "".join(
+        " NA" if v is None else f" {v:.0f}" if isinstance(v, float) else f" {v}" for v in values
+    ) + "\n"
+
+def _number(text: str) -> Optional[float]:
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def parse_progress_line(line: str) -> Optional[Dict]:
+    """解析一行进度，支持结构化记录和旧版 "[download]  12.3%" 文本；无法解析返回None"""
+    if line.startswith(PROGRESS_PREFIX):
+        parts = line[len(PROGRESS_PREFIX):].split()
+        if len(parts) < len(_FIELDS):
+            return None
+        record = {name: _number(value) for name, value in zip(_FIELDS, parts)}
+        if record["downloaded"] is None:
+            return None
+        if record["total"]:
+            record["percent"] = min(100.0, record["downloaded"] / record["total"] * 100)
+        elif record["frag"] and record["frag_count"]:
+            record["percent"] = min(100.0, record["frag"] / record["frag_count"] * 100)
+        else:
+            record["percent"] = None
+        return record
+
+    if "[download]" in line and "%" in line:
+        try:
+            percent = float(line.split("[download]")[1].split("%")[0].strip())
+        except (IndexError, ValueError):
+            return None
+        return {"percent": min(100.0, max(0.0, percent))}
+    return None
+
+def read_tail(path: str, max_bytes: int = TAIL_BYTES) -> List[str]:
+    """从文件末尾向前读取最多max_bytes字节，返回完整的行（不含可能被截断的第一行）"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        start = max(0, size - max_bytes)
+        f.seek(start)
+        data = f.read()
+    lines = data.decode('utf-8', 'replace').splitlines()
+    if start > 0 and lines:
+        lines = lines[1:]
+    return lines
+
+def read_latest_progress(path: str, max_bytes: int = TAIL_BYTES) -> Optional[Dict]:
+    """读取日志中最新的一条进度；文件不存在返回None，尚无进度返回空字典"""
+    try:
+        lines = read_tail(path, max_bytes)
+    except FileNotFoundError:
+        return None
+    for line in reversed(lines):
+        record = parse_progress_line(line.strip())
+        if record is not None and record.get("percent") is not None:
+            return record
+    return {}
@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+# 默认每个站点每秒的请求数和突发量
+DEFAULT_REQUESTS_PER_SECOND = 1.0
+DEFAULT_BURST = 2
+
+class TokenBucket:
+    """线程安全的令牌桶，rate为每秒补充的令牌数，capacity为桶容量"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def set_rate(self, rate: float, capacity: Optional[float] = None):
+        """运行中调整速率，已累积的令牌保留"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+            if capacity is not None:
+                self.capacity = float(capacity)
+                self._tokens = min(self._tokens, self.capacity)
+
+    def acquire(self, tokens: float = 1):
+        """阻塞直到取得指定数量的令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate if self.rate > 0 else 1
+            time.sleep(wait)
+
+class DomainRateLimiter:
+    """按域名划分的令牌桶集合，同一站点的所有请求共享一个桶"""
+
+    def __init__(self, rate: float = DEFAULT_REQUESTS_PER_SECOND, burst: float = DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate: float, burst: Optional[float] = None):
+        """修改所有站点的速率（包括已创建的桶）"""
+        with self._lock:
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+            for bucket in self._buckets.values():
+                bucket.set_rate(self.rate, self.burst)
+
+    def bucket(self, url: str) -> TokenBucket:
+        domain = urlparse(url).netloc.lower()
+        with self._lock:
+            if domain not in self._buckets:
+                self._buckets[domain] = TokenBucket(self.rate, self.burst)
+            return self._buckets[domain]
+
+    def acquire(self, url: str):
+        """在对url所在站点发请求前调用"""
+        self.bucket(url).acquire()
+
+# 进程内共享的站点请求限速器
+site_limiter = DomainRateLimiter()
@@ -0,0 +1,46 @@
+import random
+import re
+from typing import Optional
+
+# 失败类型
+FAILURE_TRANSIENT = "transient"  # CDN 5xx、超时、连接被重置等，稍后重试
+FAILURE_EXPIRED = "expired"      # 签名/令牌链接过期，需要重新解析m3u8
+FAILURE_PERMANENT = "permanent"  # 重试也不会成功
+FAILURE_STOPPED = "stopped"      # 用户主动停止
+
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 30
+BACKOFF_CAP = 900
+
+# 按顺序匹配，先匹配到的为准
+_PATTERNS = [
+    (FAILURE_EXPIRED, re.compile(
+        r"HTTP Error (401|403|404|410)|\b(401|403|404|410) Client Error|"
+        r"Forbidden|Signature.*expired|token.*(expired|invalid)|auth.*fail", re.I)),
+    (FAILURE_PERMANENT, re.compile(
+        r"Unsupported URL|is not a valid URL|No space left on device|Permission denied|"
+        r"ffmpeg not found|ffprobe.*not found|不支持的加密方式|需要安装", re.I)),
+    (FAILURE_TRANSIENT, re.compile(
+        r"HTTP Error 5\d\d|\b5\d\d Server Error|HTTP Error 429|\b429 Client Error|"
+        r"timed out|timeout|Connection (reset|refused|aborted)|RemoteDisconnected|"
+        r"IncompleteRead|Temporary failure in name resolution|Name or service not known|"
+        r"Unable to download fragment|fragment .* not found|giving up after", re.I)),
+]
+
+def classify_failure(returncode: Optional[int], output: str = "", stopped: bool = False) -> str:
+    """根据下载进程的退出状态和输出判断失败类型
+
+    只有用户主动停止（stopped）才算 FAILURE_STOPPED；被信号终止（如内存不足被系统杀掉）按其它失败重试。
+    """
+    if stopped:
+        return FAILURE_STOPPED
+    for kind, pattern in _PATTERNS:
+        if pattern.search(output or ""):
+            return kind
+    # 未知错误按临时错误处理，由重试次数上限兜底
+    return FAILURE_TRANSIENT
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """第attempt次重试前的等待时间：指数退避 + 抖动（取上限的一半到全部之间的随机值）"""
+    delay = min(cap, base * (2 ** max(0, attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
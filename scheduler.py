@@ -0,0 +1,247 @@
+import threading
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+from metrics import queue_wait_seconds
+
+# 默认同时下载的剧集数量
+DEFAULT_MAX_WORKERS = 3
+# 默认每个CDN主机同时下载的剧集数量
+DEFAULT_PER_HOST_LIMIT = 2
+
+# 下载引擎（backends.py 中的后端）：yt-dlp子进程、yt-dlp+aria2c多连接、
+# aria2c直接下载分片列表、进程内HLS分片引擎；auto 按站点/CDN主机的配置选择
+ENGINE_YTDLP = "yt-dlp"
+ENGINE_YTDLP_ARIA2C = "yt-dlp-aria2c"
+ENGINE_ARIA2C = "aria2c"
+ENGINE_NATIVE = "native"
+ENGINES = (ENGINE_YTDLP, ENGINE_YTDLP_ARIA2C, ENGINE_ARIA2C, ENGINE_NATIVE)
+ENGINE_AUTO = "auto"
+
+# 输出方式：先下载TS再封装MP4（可分片续传）、边下载边封装MP4、只输出单个TS文件
+OUTPUT_REMUX = "remux"
+OUTPUT_STREAM = "stream"
+OUTPUT_TS = "ts"
+OUTPUT_MODES = (OUTPUT_REMUX, OUTPUT_STREAM, OUTPUT_TS)
+
+@dataclass
+class EpisodeJob:
+    """一个待下载剧集的任务描述"""
+    ep_num: int
+    page_url: str
+    m3u8_url: str
+    output_dir: str
+    title: str
+    engine: str = ENGINE_YTDLP
+    extra: Dict = field(default_factory=dict)
+    attempt: int = 0            # 已失败重试的次数
+    not_before: float = 0.0     # 重试任务在此时间之前不启动
+    failure: Optional[str] = None  # 最近一次失败的类型（retry_policy.FAILURE_*）
+    priority: int = 0           # 越大越先启动，相同优先级按入队顺序
+    queued_at: float = 0.0      # 入队时间，用于统计排队等待
+    expected_duration: Optional[float] = None  # 播放列表总时长（native引擎填入），用于检查输出是否截断
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.m3u8_url).netloc.lower()
+
+    @property
+    def key(self) -> str:
+        return f"{self.output_dir}#{self.ep_num}"
+
+class EpisodeScheduler:
+    """有界并发的剧集调度器
+
+    全局最多 max_workers 集同时下载，每个CDN主机最多 per_host_limit 集。
+    按优先级和队列顺序启动：总是启动优先级最高、所属主机还有空闲名额的任务中最早入队的一个；
+    已暂停的下载目录中的任务留在队列里不启动。
+    任务结束或调用 stop() 时立即唤醒；只有传入 should_stop 轮询函数时才需要 poll_interval。
+    keep_alive 为 True 时（守护进程）队列清空后继续等待新任务，直到 stop()。
+    停止后仍在队列中、被丢弃的任务在 run() 返回前传给 on_dropped。
+    """
+
+    def __init__(self, worker: Callable[[EpisodeJob], None],
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                 should_stop: Optional[Callable[[], bool]] = None,
+                 poll_interval: Optional[float] = None,
+                 keep_alive: bool = False,
+                 on_dropped: Optional[Callable[[List[EpisodeJob]], None]] = None,
+                 logger=None):
+        self.worker = worker
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.should_stop = should_stop or (lambda: False)
+        self.poll_interval = poll_interval
+        self.keep_alive = keep_alive
+        self.on_dropped = on_dropped
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._cond = threading.Condition()
+        self._queue: List[EpisodeJob] = []
+        self._running: Dict[str, EpisodeJob] = {}
+        self._host_counts: Dict[str, int] = {}
+        self._host_limits: Dict[str, int] = {}
+        self._paused: Set[str] = set()
+        self._stopped = False
+
+    def submit(self, job: EpisodeJob, delay: float = 0):
+        """把任务追加到队尾；delay>0 时在等待期间让后面的任务先运行"""
+        with self._cond:
+            job.not_before = time.time() + delay if delay > 0 else 0.0
+            job.queued_at = time.time()
+            self._queue.append(job)
+            self._cond.notify_all()
+
+    def stop(self):
+        """停止调度新任务（已在运行的任务由worker自行处理停止）"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def running_jobs(self) -> List[EpisodeJob]:
+        with self._cond:
+            return list(self._running.values())
+
+    def queued_jobs(self) -> List[EpisodeJob]:
+        with self._cond:
+            return list(self._queue)
+
+    def configure(self, max_workers: Optional[int] = None, per_host_limit: Optional[int] = None):
+        """运行中修改全局并发数和默认的每主机并发数"""
+        with self._cond:
+            if max_workers:
+                self.max_workers = max(1, int(max_workers))
+            if per_host_limit:
+                self.per_host_limit = max(1, int(per_host_limit))
+            self._cond.notify_all()
+
+    def pause(self, output_dir: str):
+        """暂停某个下载目录：排队中的任务不再启动，正在下载的集继续完成"""
+        with self._cond:
+            self._paused.add(output_dir)
+
+    def resume(self, output_dir: str):
+        with self._cond:
+            self._paused.discard(output_dir)
+            self._cond.notify_all()
+
+    def is_paused(self, output_dir: str) -> bool:
+        with self._cond:
+            return output_dir in self._paused
+
+    def remove(self, match: Callable[[EpisodeJob], bool]) -> List[EpisodeJob]:
+        """从队列中移除符合条件的任务（不影响正在运行的任务），返回被移除的任务"""
+        with self._cond:
+            removed = [job for job in self._queue if match(job)]
+            self._queue = [job for job in self._queue if not match(job)]
+            return removed
+
+    def set_priority(self, match: Callable[[EpisodeJob], bool], priority: int) -> int:
+        """修改排队中任务的优先级，返回修改的任务数"""
+        with self._cond:
+            count = 0
+            for job in self._queue:
+                if match(job):
+                    job.priority = priority
+                    count += 1
+            self._cond.notify_all()
+            return count
+
+    def pending_hosts(self) -> Dict[str, int]:
+        """各主机排队中的任务数"""
+        with self._cond:
+            counts: Dict[str, int] = {}
+            for job in self._queue:
+                counts[job.host] = counts.get(job.host, 0) + 1
+            return counts
+
+    def host_limit(self, host: str) -> int:
+        return self._host_limits.get(host, self.per_host_limit)
+
+    def set_host_limit(self, host: str, limit: int):
+        """运行中调整某个主机的并发上限（不超过全局上限）"""
+        with self._cond:
+            self._host_limits[host] = max(1, min(int(limit), self.max_workers))
+            self._cond.notify_all()
+
+    def _next_runnable(self) -> Optional[EpisodeJob]:
+        """按队列顺序找出第一个可以启动的任务"""
+        if len(self._running) >= self.max_workers:
+            return None
+        now = time.time()
+        best = None
+        for idx, job in enumerate(self._queue):
+            if job.not_before > now or job.output_dir in self._paused:
+                continue
+            if best is not None and job.priority <= self._queue[best].priority:
+                continue
+            if self._host_counts.get(job.host, 0) < self.host_limit(job.host):
+                best = idx
+        return self._queue.pop(best) if best is not None else None
+
+    def _wait_timeout(self) -> Optional[float]:
+        """等待到最早的延迟任务可以启动（或下一次轮询）"""
+        timeouts = [self.poll_interval] if self.poll_interval else []
+        delayed = [job.not_before for job in self._queue if job.not_before > time.time()]
+        if delayed:
+            timeouts.append(max(0.0, min(delayed) - time.time()))
+        return min(timeouts) if timeouts else None
+
+    def _run_job(self, job: EpisodeJob, host: str):
+        # host 在启动时确定：重新解析链接后 job.host 可能已经变化
+        try:
+            self.worker(job)
+        except Exception as e:
+            self.logger.error(f"第 {job.ep_num} 集下载线程异常: {e}", exc_info=True)
+        finally:
+            with self._cond:
+                if self._running.get(job.key) is job:
+                    del self._running[job.key]
+                count = self._host_counts.get(host, 1) - 1
+                if count > 0:
+                    self._host_counts[host] = count
+                else:
+                    self._host_counts.pop(host, None)
+                self._cond.notify_all()
+
+    def run(self):
+        """阻塞运行，直到队列清空且所有任务结束（或收到停止请求）"""
+        threads = []
+        dropped: List[EpisodeJob] = []
+        with self._cond:
+            while True:
+                if not self._stopped and self.should_stop():
+                    self.logger.info("检测到停止请求，不再启动新的下载")
+                    self._stopped = True
+
+                if self._stopped:
+                    # 停止后运行中的任务失败时仍可能提交重试，一并丢弃
+                    dropped.extend(self._queue)
+                    self._queue.clear()
+                    if not self._running:
+                        break
+                else:
+                    job = self._next_runnable()
+                    if job is not None:
+                        # 重试任务从退避结束时算起
+                        queue_wait_seconds.observe(max(0.0, time.time() - max(job.queued_at, job.not_before)))
+                        self._running[job.key] = job
+                        self._host_counts[job.host] = self._host_counts.get(job.host, 0) + 1
+                        thread = threading.Thread(target=self._run_job, args=(job, job.host),
+                                                  name=f"ep-{job.ep_num}", daemon=True)
+                        threads.append(thread)
+                        thread.start()
+                        continue
+                    if not self._queue and not self._running and not self.keep_alive:
+                        break
+
+                self._cond.wait(self._wait_timeout())
+
+        for thread in threads:
+            thread.join()
+        if dropped and self.on_dropped:
+            self.on_dropped(dropped)
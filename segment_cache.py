@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+from m3u8_cache import _EXPIRY_PARAMS, _SIGNATURE_PARAMS
+from metrics import segment_cache_requests_total, segment_cache_saved_bytes_total
+from settings import state_path
+from state_store import StateStore, STATE_DB_FILE
+
+# 分片内容按sha256保存在全局状态目录下，索引在全局状态库中
+SEGMENT_CACHE_DIR = "segments"
+DEFAULT_SEGMENT_CACHE_SIZE = 2 * 1024 ** 3
+# 同一链接第几次下载到相同内容时写入缓存；只出现一次的分片（绝大多数）不占用缓存和磁盘写入
+ADMIT_AFTER = 2
+# 没有缓存内容的链接记录保留时间
+URL_RECORD_TTL = 30 * 24 * 3600
+# 每次淘汰时读取的候选数量
+EVICT_BATCH = 64
+
+def segment_key(url: str, byterange: Optional[Tuple[int, int]] = None) -> str:
+    """缓存键：去掉签名/过期参数的分片链接（加上字节范围），同一分片每次解析出的令牌不同"""
+    parts = urlparse(url)
+    ignored = set(_EXPIRY_PARAMS) | set(_SIGNATURE_PARAMS)
+    query = urlencode([(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if name.lower() not in ignored])
+    key = urlunparse(parts._replace(query=query, fragment=""))
+    if byterange:
+        key += f"#{byterange[0]}+{byterange[1]}"
+    return key
+
+class SegmentCache:
+    """按内容寻址的本地分片缓存，去重各集共用的片头、片尾和广告分片
+
+    下载前按链接查找，命中时直接读取本地内容（校验sha256）；
+    同一链接第 ADMIT_AFTER 次下载到相同内容时才写入缓存，相同内容只保存一份。
+    总大小超过 max_bytes 时按最近使用时间淘汰。多个进程可以共用。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_SEGMENT_CACHE_SIZE, root: Optional[str] = None,
+                 db_path: Optional[str] = None, logger=None):
+        self.max_bytes = int(max_bytes)
+        self.root = root or state_path(SEGMENT_CACHE_DIR)
+        self.store = StateStore(db_path or state_path(STATE_DB_FILE))
+        self.logger = logger or logging.getLogger(__name__)
+        self._evict_lock = threading.Lock()
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _remove_blob(self, sha256: str):
+        self.store.segment_blob_delete(sha256)
+        try:
+            os.remove(self._blob_path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def get(self, url: str, byterange: Optional[Tuple[int, int]] = None) -> Optional[bytes]:
+        """返回缓存的分片内容（未解密的原始数据），未命中时返回None"""
+        sha256 = self.store.segment_lookup(segment_key(url, byterange))
+        data = None
+        if sha256 is not None:
+            try:
+                with open(self._blob_path(sha256), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                pass
+            if data is None or hashlib.sha256(data).hexdigest() != sha256:
+                # 被其它进程淘汰或文件损坏
+                self._remove_blob(sha256)
+                data = None
+        if data is None:
+            segment_cache_requests_total.inc(result="miss")
+            return None
+        self.store.segment_blob_touch(sha256)
+        segment_cache_requests_total.inc(result="hit")
+        segment_cache_saved_bytes_total.inc(len(data))
+        return data
+
+    def put(self, url: str, byterange: Optional[Tuple[int, int]], data: bytes):
+        """记录一次从网络下载的分片，重复出现的内容写入缓存"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        seen = self.store.segment_seen(segment_key(url, byterange), sha256)
+        # 相同内容已经缓存（可能来自其它链接），链接记录指向它即可
+        if seen < ADMIT_AFTER or self.store.segment_blob_exists(sha256):
+            return
+        if len(data) > self.max_bytes:
+            return
+        path = self._blob_path(sha256)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.warning(f"写入分片缓存失败: {e}")
+            return
+        self.store.segment_blob_put(sha256, len(data))
+        self._evict()
+
+    def _evict(self):
+        with self._evict_lock:
+            _, total = self.store.segment_blob_usage()
+            while total > self.max_bytes:
+                batch = self.store.segment_blobs_lru(EVICT_BATCH)
+                if not batch:
+                    break
+                for sha256, size in batch:
+                    if total <= self.max_bytes:
+                        break
+                    self._remove_blob(sha256)
+                    total -= size
+            self.store.segment_prune_urls(time.time() - URL_RECORD_TTL)
+
+    def stats(self) -> Dict:
+        entries, total = self.store.segment_blob_usage()
+        return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes}
@@ -0,0 +1,9 @@
+import os
+
+# 跨下载目录共享的全局状态目录（会话/缓存等），可通过环境变量修改
+STATE_HOME = os.path.expanduser(os.environ.get("OV_DOWNLOADER_HOME", "~/.ov_downloader"))
+
+def state_path(*parts: str) -> str:
+    """返回全局状态目录下的路径，并确保目录存在"""
+    os.makedirs(STATE_HOME, exist_ok=True)
+    return os.path.join(STATE_HOME, *parts)
@@ -0,0 +1,473 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# 每个下载目录一个状态库；全局状态库（m3u8缓存等）位于 settings.STATE_HOME
+STATE_DB_FILE = "state.db"
+
+# 旧版JSON状态文件，首次打开状态库时自动导入
+LEGACY_STATUS_FILE = "download_status.json"
+LEGACY_ACTIVE_FILE = "active_downloads.json"
+LEGACY_SUFFIX = ".migrated"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    ep_num INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_episodes_state ON episodes(state);
+CREATE TABLE IF NOT EXISTS active (
+    ep_num INTEGER PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    m3u8_url TEXT,
+    engine TEXT,
+    start_time TEXT
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ep_num INTEGER NOT NULL,
+    m3u8_url TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    returncode INTEGER,
+    success INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_ep ON attempts(ep_num);
+CREATE TABLE IF NOT EXISTS m3u8_cache (
+    page_url TEXT PRIMARY KEY,
+    m3u8_url TEXT NOT NULL,
+    resolved_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_m3u8_cache_expires ON m3u8_cache(expires_at);
+CREATE TABLE IF NOT EXISTS host_stats (
+    host TEXT PRIMARY KEY,
+    concurrency INTEGER NOT NULL,
+    best_rate REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fragment_plans (
+    ep_num INTEGER PRIMARY KEY,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fragments (
+    ep_num INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    PRIMARY KEY (ep_num, pos)
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    ep_num INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL,
+    sha256 TEXT,
+    recorded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segment_urls (
+    url_key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    seen INTEGER NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_segment_urls_seen ON segment_urls(last_seen);
+CREATE TABLE IF NOT EXISTS segment_blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_segment_blobs_used ON segment_blobs(last_used);
+"""
+
+# 旧库中缺少的列，打开时用 ALTER TABLE 补上
+ADDED_COLUMNS = {
+    "m3u8_cache": [("variant_policy", "TEXT"), ("variant_url", "TEXT"), ("variant_info", "TEXT")],
+}
+
+# 剧集状态
+EP_COMPLETED = "completed"
+EP_FAILED = "failed"
+EP_RETRYING = "retrying"
+
+class StateStore:
+    """WAL模式的SQLite状态库
+
+    每次更新都是一条带索引的语句或一个小事务，不再整文件重写；
+    WAL模式下只读连接（monitor.py）不会阻塞写入者。
+    每个线程使用独立连接，fork后的子进程会重新建立连接。
+    """
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            self.conn.executescript(SCHEMA)
+            self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for name, sql_type in columns:
+                if name not in existing:
+                    try:
+                        self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+                    except sqlite3.OperationalError as e:
+                        # 其它进程同时补上了这一列
+                        if "duplicate column" not in str(e):
+                            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.readonly:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = self._connect()
+            local.pid = os.getpid()
+        return local.conn
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            conn.close()
+        self._local = threading.local()
+
+    # ---- 元数据 ----
+    def set_meta(self, key: str, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                          (key, json.dumps(value, ensure_ascii=False)))
+
+    def get_meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    # ---- 剧集状态 ----
+    def record_result(self, ep_num: int, success: bool):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO episodes(ep_num, state, updated_at) VALUES (?, ?, ?)",
+            (ep_num, EP_COMPLETED if success else EP_FAILED, time.time())
+        )
+
+    def episodes_in_state(self, state: str) -> List[int]:
+        rows = self.conn.execute(
+            "SELECT ep_num FROM episodes WHERE state = ? ORDER BY updated_at", (state,))
+        return [row["ep_num"] for row in rows]
+
+    def get_status(self) -> Dict:
+        """与旧版 download_status.json 相同结构的状态字典"""
+        status = {
+            "completed": self.episodes_in_state(EP_COMPLETED),
+            "failed": self.episodes_in_state(EP_FAILED),
+            "retrying": self.episodes_in_state(EP_RETRYING),
+            "progress": {},
+        }
+        for row in self.conn.execute("SELECT key, value FROM meta"):
+            status[row["key"]] = json.loads(row["value"])
+        return status
+
+    def save_status(self, status: Dict):
+        """写入旧版结构的状态字典（兼容接口），逐集更新，不会删除字典中没有的剧集"""
+        now = time.time()
+        with self.transaction() as conn:
+            # 旧版文件中同一集可能同时出现在多个列表里（重试成功后没有移出 failed），最后写入的 completed 优先
+            for state in (EP_FAILED, EP_RETRYING, EP_COMPLETED):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO episodes(ep_num, state, updated_at) VALUES (?, ?, ?)",
+                    [(int(ep), state, now) for ep in status.get(state, [])])
+            for key, value in status.items():
+                if key not in (EP_COMPLETED, EP_FAILED, EP_RETRYING, "progress"):
+                    conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                                 (key, json.dumps(value, ensure_ascii=False)))
+
+    # ---- 活动下载 ----
+    def set_active(self, ep_num: int, pid: int, m3u8_url: str, engine: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO active(ep_num, pid, m3u8_url, engine, start_time) VALUES (?, ?, ?, ?, ?)",
+            (ep_num, pid, m3u8_url, engine, time.strftime('%Y-%m-%d %H:%M:%S'))
+        )
+
+    def transition(self, ep_num: int, state: str):
+        """原子地更新剧集状态并移除活动记录"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO episodes(ep_num, state, updated_at) VALUES (?, ?, ?)",
+                (ep_num, state, time.time()))
+            conn.execute("DELETE FROM active WHERE ep_num = ?", (ep_num,))
+
+    def finish_active(self, ep_num: int, success: bool):
+        """原子地记录结果并移除活动记录"""
+        self.transition(ep_num, EP_COMPLETED if success else EP_FAILED)
+
+    def remove_active(self, ep_num: int):
+        self.conn.execute("DELETE FROM active WHERE ep_num = ?", (ep_num,))
+
+    def clear_active(self):
+        self.conn.execute("DELETE FROM active")
+
+    def get_active(self) -> Dict[str, Dict]:
+        """与旧版 active_downloads.json 相同结构的字典"""
+        return {
+            str(row["ep_num"]): {
+                "pid": row["pid"],
+                "m3u8_url": row["m3u8_url"],
+                "engine": row["engine"],
+                "start_time": row["start_time"],
+            }
+            for row in self.conn.execute("SELECT * FROM active ORDER BY ep_num")
+        }
+
+    # ---- 下载尝试 ----
+    def start_attempt(self, ep_num: int, m3u8_url: str) -> int:
+        cursor = self.conn.execute(
+            "INSERT INTO attempts(ep_num, m3u8_url, started_at) VALUES (?, ?, ?)",
+            (ep_num, m3u8_url, time.time()))
+        return cursor.lastrowid
+
+    def finish_attempt(self, attempt_id: int, returncode: Optional[int], success: bool,
+                       error: Optional[str] = None):
+        self.conn.execute(
+            "UPDATE attempts SET finished_at = ?, returncode = ?, success = ?, error = ? WHERE id = ?",
+            (time.time(), returncode, int(success), error, attempt_id))
+
+    def attempt_count(self, ep_num: int) -> int:
+        row = self.conn.execute("SELECT COUNT(*) AS n FROM attempts WHERE ep_num = ?", (ep_num,)).fetchone()
+        return row["n"]
+
+    # ---- m3u8缓存 ----
+    def cache_get(self, page_url: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM m3u8_cache WHERE page_url = ?", (page_url,)).fetchone()
+        return dict(row) if row else None
+
+    def cache_put(self, page_url: str, m3u8_url: str, resolved_at: float, expires_at: float):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO m3u8_cache(page_url, m3u8_url, resolved_at, expires_at) VALUES (?, ?, ?, ?)",
+                (page_url, m3u8_url, resolved_at, expires_at))
+            conn.execute("DELETE FROM m3u8_cache WHERE expires_at < ?", (time.time(),))
+
+    def cache_set_variant(self, page_url: str, policy: str, variant_url: str, info: str,
+                          expires_at: float):
+        """记录按策略从主播放列表选出的版本，下次运行直接使用"""
+        self.conn.execute(
+            "UPDATE m3u8_cache SET variant_policy = ?, variant_url = ?, variant_info = ?, "
+            "expires_at = MIN(expires_at, ?) WHERE page_url = ?",
+            (policy, variant_url, info, expires_at, page_url))
+
+    def cache_delete(self, page_url: str):
+        self.conn.execute("DELETE FROM m3u8_cache WHERE page_url = ?", (page_url,))
+
+    # ---- CDN主机统计（自适应并发） ----
+    def host_stats_get(self, host: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM host_stats WHERE host = ?", (host,)).fetchone()
+        return dict(row) if row else None
+
+    def host_stats_put(self, host: str, concurrency: int, best_rate: float):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO host_stats(host, concurrency, best_rate, updated_at) VALUES (?, ?, ?, ?)",
+            (host, concurrency, best_rate, time.time()))
+
+    # ---- 完成索引（已下载的输出文件） ----
+    def record_output(self, ep_num: int, path: str, size: int, mtime_ns: int,
+                      duration: Optional[float] = None, sha256: Optional[str] = None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO outputs(ep_num, path, size, mtime_ns, duration, sha256, recorded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (ep_num, path, size, mtime_ns, duration, sha256, time.time()))
+
+    def get_output(self, ep_num: int) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM outputs WHERE ep_num = ?", (ep_num,)).fetchone()
+        return dict(row) if row else None
+
+    def output_episodes(self) -> List[int]:
+        return [row["ep_num"] for row in self.conn.execute("SELECT ep_num FROM outputs ORDER BY ep_num")]
+
+    def forget_episode(self, ep_num: int):
+        """输出文件丢失或损坏时，在同一事务中清除完成索引和剧集状态"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM outputs WHERE ep_num = ?", (ep_num,))
+            conn.execute("DELETE FROM episodes WHERE ep_num = ?", (ep_num,))
+
+    # ---- 分片缓存索引 ----
+    def segment_lookup(self, url_key: str) -> Optional[str]:
+        """返回该分片链接对应的、已缓存内容的sha256"""
+        row = self.conn.execute(
+            "SELECT u.sha256 FROM segment_urls u JOIN segment_blobs b ON b.sha256 = u.sha256 "
+            "WHERE u.url_key = ?", (url_key,)).fetchone()
+        return row["sha256"] if row else None
+
+    def segment_seen(self, url_key: str, sha256: str) -> int:
+        """记录一次分片下载，返回该链接（同一内容）被下载的次数"""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT sha256, seen FROM segment_urls WHERE url_key = ?", (url_key,)).fetchone()
+            seen = row["seen"] + 1 if row and row["sha256"] == sha256 else 1
+            conn.execute(
+                "INSERT OR REPLACE INTO segment_urls(url_key, sha256, seen, last_seen) VALUES (?, ?, ?, ?)",
+                (url_key, sha256, seen, time.time()))
+        return seen
+
+    def segment_blob_exists(self, sha256: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM segment_blobs WHERE sha256 = ?", (sha256,)).fetchone() is not None
+
+    def segment_blob_put(self, sha256: str, size: int):
+        self.conn.execute("INSERT OR REPLACE INTO segment_blobs(sha256, size, last_used) VALUES (?, ?, ?)",
+                          (sha256, size, time.time()))
+
+    def segment_blob_touch(self, sha256: str):
+        self.conn.execute("UPDATE segment_blobs SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+
+    def segment_blob_delete(self, sha256: str):
+        self.conn.execute("DELETE FROM segment_blobs WHERE sha256 = ?", (sha256,))
+
+    def segment_blob_usage(self) -> tuple:
+        row = self.conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS total FROM segment_blobs").fetchone()
+        return row["n"], row["total"]
+
+    def segment_blobs_lru(self, limit: int) -> List[tuple]:
+        """最久未使用的缓存内容 (sha256, size)"""
+        return [tuple(row) for row in self.conn.execute(
+            "SELECT sha256, size FROM segment_blobs ORDER BY last_used LIMIT ?", (limit,))]
+
+    def segment_prune_urls(self, before: float):
+        """删除很久没有再出现、也没有缓存内容的链接记录"""
+        self.conn.execute(
+            "DELETE FROM segment_urls WHERE last_seen < ? AND sha256 NOT IN (SELECT sha256 FROM segment_blobs)",
+            (before,))
+
+    def fragment_journal(self, ep_num: int) -> "FragmentJournal":
+        return FragmentJournal(self, ep_num)
+
+class FragmentJournal:
+    """记录某一集已经按顺序写入输出文件的分片（位置、偏移、大小、CRC32）
+
+    signature 标识播放列表的分片布局，布局变化（如换了清晰度）时旧记录作废。
+    """
+
+    def __init__(self, store: StateStore, ep_num: int):
+        self.store = store
+        self.ep_num = ep_num
+
+    def load(self, signature: str) -> List[tuple]:
+        """返回按位置排序的 (pos, offset, size, crc) 列表"""
+        conn = self.store.conn
+        row = conn.execute("SELECT signature FROM fragment_plans WHERE ep_num = ?", (self.ep_num,)).fetchone()
+        if row is None or row["signature"] != signature:
+            with self.store.transaction() as tx:
+                tx.execute("DELETE FROM fragments WHERE ep_num = ?", (self.ep_num,))
+                tx.execute("INSERT OR REPLACE INTO fragment_plans(ep_num, signature) VALUES (?, ?)",
+                           (self.ep_num, signature))
+            return []
+        return [tuple(r) for r in conn.execute(
+            "SELECT pos, offset, size, crc FROM fragments WHERE ep_num = ? ORDER BY pos", (self.ep_num,))]
+
+    def commit(self, pos: int, offset: int, size: int, crc: int):
+        self.store.conn.execute(
+            "INSERT OR REPLACE INTO fragments(ep_num, pos, offset, size, crc) VALUES (?, ?, ?, ?, ?)",
+            (self.ep_num, pos, offset, size, crc))
+
+    def truncate(self, from_pos: int):
+        """删除 from_pos 及之后的记录"""
+        self.store.conn.execute("DELETE FROM fragments WHERE ep_num = ? AND pos >= ?", (self.ep_num, from_pos))
+
+    def clear(self):
+        with self.store.transaction() as tx:
+            tx.execute("DELETE FROM fragments WHERE ep_num = ?", (self.ep_num,))
+            tx.execute("DELETE FROM fragment_plans WHERE ep_num = ?", (self.ep_num,))
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK，避免并发写入时的锁升级死锁"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+_stores: Dict[str, StateStore] = {}
+_stores_lock = threading.Lock()
+
+def _import_legacy_json(store: StateStore, output_dir: str):
+    """把旧版JSON状态文件导入状态库，导入后重命名为 *.migrated"""
+    status_file = os.path.join(output_dir, LEGACY_STATUS_FILE)
+    active_file = os.path.join(output_dir, LEGACY_ACTIVE_FILE)
+
+    for path, importer in ((status_file, store.save_status), (active_file, None)):
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (ValueError, OSError):
+            continue
+        if importer:
+            importer(data)
+        else:
+            with store.transaction() as conn:
+                for ep_num, info in data.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO active(ep_num, pid, m3u8_url, engine, start_time) VALUES (?, ?, ?, ?, ?)",
+                        (int(ep_num), info.get("pid", 0), info.get("m3u8_url"),
+                         info.get("engine", "yt-dlp"), info.get("start_time")))
+        os.replace(path, path + LEGACY_SUFFIX)
+
+def open_store(output_dir: str) -> StateStore:
+    """打开（必要时创建并导入旧版JSON）下载目录的状态库，同一进程内复用"""
+    path = os.path.join(output_dir, STATE_DB_FILE)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            existed = os.path.exists(path)
+            store = StateStore(path)
+            if not existed:
+                _import_legacy_json(store, output_dir)
+            _stores[path] = store
+        return store
+
+def open_store_readonly(output_dir: str) -> Optional[StateStore]:
+    """只读打开状态库（不存在时返回None），供监控使用"""
+    path = os.path.join(output_dir, STATE_DB_FILE)
+    if not os.path.exists(path):
+        return None
+    return StateStore(path, readonly=True)
+
+def store_signature(output_dir: str) -> Optional[tuple]:
+    """状态库及WAL文件的(mtime, size)，用于判断是否有新写入"""
+    path = os.path.join(output_dir, STATE_DB_FILE)
+    signature = []
+    for candidate in (path, path + "-wal"):
+        try:
+            st = os.stat(candidate)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature) if signature[0] else None
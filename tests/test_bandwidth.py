@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from bandwidth import parse_rate, BandwidthSchedule
+
+def _at(hour, minute):
+    """本地时间某天 hour:minute 的时间戳"""
+    return time.mktime((2026, 1, 15, hour, minute, 0, 0, 0, -1))
+
+@pytest.mark.parametrize("text, expected", [
+    ("20Mbit", 20 * 1000 ** 2 / 8),
+    ("20Mbps", 20 * 1000 ** 2 / 8),
+    ("20 mbit/s", 20 * 1000 ** 2 / 8),
+    ("800Kbit", 800 * 1000 / 8),
+    ("2Mb", 2 * 1000 ** 2 / 8),
+    # 没有单位时按字节、1024进制，与yt-dlp的 --limit-rate 一致
+    ("500K", 500 * 1024),
+    ("2M", 2 * 1024 ** 2),
+    ("1.5m", 1.5 * 1024 ** 2),
+    ("2MiB", 2 * 1024 ** 2),
+    ("1G", 1024 ** 3),
+    ("4096", 4096),
+])
+def test_parse_rate_units(text, expected):
+    assert parse_rate(text) == pytest.approx(expected)
+
+@pytest.mark.parametrize("text", [None, "", "0", "none", "Unlimited", "off", "0M"])
+def test_parse_rate_unlimited(text):
+    assert parse_rate(text) is None
+
+@pytest.mark.parametrize("text", ["fast", "10X", "M", "-1M"])
+def test_parse_rate_rejects_bad_input(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+def test_schedule_window_boundaries():
+    schedule = BandwidthSchedule.parse("08:00-20:00=20Mbit,20:00-08:00=0")
+    limited = 20 * 1000 ** 2 / 8
+    # 开始时间包含在时间段内，结束时间不包含
+    assert schedule.rate_at(_at(8, 0)) == pytest.approx(limited)
+    assert schedule.rate_at(_at(19, 59)) == pytest.approx(limited)
+    assert schedule.rate_at(_at(20, 0)) is None
+    assert schedule.rate_at(_at(7, 59)) is None
+
+def test_schedule_wraps_midnight():
+    schedule = BandwidthSchedule.parse("23:00-08:00=1M, 12:00-13:00=0")
+    assert schedule.rules[1] == (12 * 60, 13 * 60, None)
+    for hour, minute in ((23, 0), (23, 59), (0, 0), (3, 30), (7, 59)):
+        assert schedule.rate_at(_at(hour, minute)) == 1024 ** 2
+    # 不在任何时间段内、以及 =0 的时间段都不限速
+    for hour, minute in ((8, 0), (22, 59), (12, 30)):
+        assert schedule.rate_at(_at(hour, minute)) is None
+
+def test_schedule_rejects_bad_spec():
+    with pytest.raises(ValueError):
+        BandwidthSchedule.parse("08:00=1M")
+    with pytest.raises(ValueError):
+        BandwidthSchedule.parse("08:00-20:00=fast")
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import completion_index
+from completion_index import (record_completion, check_output, skip_completed, output_base,
+                              CORRUPT_SUFFIX, OUTPUT_OK, OUTPUT_CORRUPT)
+from state_store import open_store, EP_COMPLETED
+
+TITLE = "剧"
+URLS = ["https://www.example.com/show/1/1.html", "https://www.example.com/show/1/2.html",
+        "https://www.example.com/show/1/3.html"]
+
+@pytest.fixture
+def durations(monkeypatch):
+    """按文件名返回的ffprobe时长，没有列出的文件返回0（无法解析）"""
+    durations = {}
+    monkeypatch.setattr(completion_index, "probe_duration",
+                        lambda path: durations.get(os.path.basename(path), 0.0))
+    return durations
+
+def _write_output(output_dir, ep_num, size=1000, duration=None, durations=None):
+    path = output_base(output_dir, TITLE, ep_num) + ".mp4"
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    if durations is not None:
+        durations[os.path.basename(path)] = duration
+    return path
+
+def _complete(output_dir, ep_num, durations, duration=1200.0):
+    path = _write_output(output_dir, ep_num, duration=duration, durations=durations)
+    assert record_completion(output_dir, TITLE, ep_num, expected_duration=1200.0) == (True, "")
+    open_store(output_dir).transition(ep_num, EP_COMPLETED)
+    return path
+
+def test_record_completion_rejects_short_output(tmp_path, durations):
+    output_dir = str(tmp_path)
+    _write_output(output_dir, 1, duration=600.0, durations=durations)
+    ok, reason = record_completion(output_dir, TITLE, 1, expected_duration=1200.0)
+    assert not ok and "截断" in reason
+    assert open_store(output_dir).get_output(1) is None
+
+def test_skip_completed_keeps_intact_episodes(tmp_path, durations):
+    output_dir = str(tmp_path)
+    _complete(output_dir, 1, durations)
+    _complete(output_dir, 3, durations)
+
+    assert skip_completed(URLS, [1, 2, 3], output_dir, TITLE) == ([URLS[1]], [2])
+
+def test_missing_output_clears_state(tmp_path, durations):
+    output_dir = str(tmp_path)
+    path = _complete(output_dir, 1, durations)
+    os.remove(path)
+
+    assert skip_completed(URLS, [1, 2, 3], output_dir, TITLE) == (URLS, [1, 2, 3])
+    store = open_store(output_dir)
+    assert store.get_output(1) is None
+    assert 1 not in store.episodes_in_state(EP_COMPLETED)
+
+def test_truncated_output_is_renamed_and_requeued(tmp_path, durations):
+    output_dir = str(tmp_path)
+    path = _complete(output_dir, 2, durations)
+    os.truncate(path, 400)
+
+    assert skip_completed(URLS, [1, 2, 3], output_dir, TITLE) == (URLS, [1, 2, 3])
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + CORRUPT_SUFFIX) == 400
+    store = open_store(output_dir)
+    assert store.get_output(2) is None
+    assert 2 not in store.episodes_in_state(EP_COMPLETED)
+
+def test_modified_output_is_probed_again(tmp_path, durations):
+    output_dir = str(tmp_path)
+    path = _complete(output_dir, 1, durations)
+    store = open_store(output_dir)
+    # 大小不变但被改写：重新读取时长
+    with open(path, "r+b") as f:
+        f.write(b"\1")
+    os.utime(path, ns=(0, 0))
+    durations[os.path.basename(path)] = 300.0
+
+    state, reason = check_output(store, output_dir, TITLE, 1, completed=True)
+    assert state == OUTPUT_CORRUPT and "时长不完整" in reason
+
+def test_backfill_legacy_completed_episode(tmp_path, durations):
+    output_dir = str(tmp_path)
+    store = open_store(output_dir)
+    # 旧版本下载的剧集：只有完成状态，没有完成索引
+    store.transition(1, EP_COMPLETED)
+    store.transition(2, EP_COMPLETED)
+    _write_output(output_dir, 1, size=2048, duration=1180.0, durations=durations)
+    broken = _write_output(output_dir, 2, duration=0.0, durations=durations)
+
+    assert check_output(store, output_dir, TITLE, 1, completed=True) == (OUTPUT_OK, "")
+    record = store.get_output(1)
+    assert record["size"] == 2048 and record["duration"] == 1180.0
+
+    assert skip_completed(URLS, [1, 2, 3], output_dir, TITLE) == (URLS[1:], [2, 3])
+    assert os.path.exists(broken + CORRUPT_SUFFIX)
+    assert 2 not in store.episodes_in_state(EP_COMPLETED)
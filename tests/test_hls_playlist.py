@@ -0,0 +1,67 @@
+import pytest
+
+from hls_playlist import parse_playlist, VariantPolicy, best_variant
+
+MASTER_URL = "https://cdn.example.com/show/1/index.m3u8"
+MASTER = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+360/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720
+720/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1400000,RESOLUTION=854x480
+480/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080
+https://cdn2.example.com/show/1/1080/index.m3u8
+"""
+
+@pytest.fixture
+def master():
+    return parse_playlist(MASTER, MASTER_URL)
+
+def _select(master, spec):
+    return VariantPolicy.parse(spec).select(master).height
+
+def test_parse_master(master):
+    assert master.master
+    assert [(v.height, v.bandwidth) for v in master.variants] == [
+        (360, 800000), (720, 2800000), (480, 1400000), (1080, 5000000)]
+    assert master.variants[0].url == "https://cdn.example.com/show/1/360/index.m3u8"
+    assert master.variants[0].codecs == "avc1.4d401e,mp4a.40.2"
+    assert master.variants[3].url == "https://cdn2.example.com/show/1/1080/index.m3u8"
+
+def test_policy_parse():
+    assert VariantPolicy.parse("720p") == VariantPolicy(max_height=720)
+    assert VariantPolicy.parse("max-height=480p, min-bitrate=1.5M") == VariantPolicy(max_height=480, min_bitrate=1500000)
+    assert VariantPolicy.parse("MAX-BITRATE=800k").max_bitrate == 800000
+    assert VariantPolicy.parse("best") == VariantPolicy()
+    assert VariantPolicy.parse("720p").spec == "max-height=720"
+    assert VariantPolicy.parse("").spec == "best"
+
+@pytest.mark.parametrize("spec", ["hd", "height=720", "max-height"])
+def test_policy_rejects_bad_spec(spec):
+    with pytest.raises(ValueError, match="无法解析的版本选择策略"):
+        VariantPolicy.parse(spec)
+
+def test_select_max(master):
+    assert _select(master, "best") == best_variant(master).height == 1080
+    assert _select(master, "720p") == 720
+    assert _select(master, "max-height=600") == 480
+    assert _select(master, "max-bitrate=3M") == 720
+    # 所有版本都超过上限时取最小的
+    assert _select(master, "max-height=240") == 360
+
+def test_select_min(master):
+    # 不低于下限的版本中最小的
+    assert _select(master, "min-bitrate=1M") == 480
+    assert _select(master, "min-height=720") == 720
+    assert _select(master, "min-height=480,max-bitrate=3M") == 480
+
+def test_select_min_falls_back_to_highest_allowed(master):
+    # 没有版本达到下限时取上限内最高的
+    assert _select(master, "min-bitrate=10M") == 1080
+    assert _select(master, "max-height=720,min-height=1080") == 720
+
+def test_select_without_variants():
+    media = parse_playlist("#EXTM3U\n#EXTINF:4,\n0.ts\n#EXT-X-ENDLIST\n", MASTER_URL)
+    assert VariantPolicy.parse("720p").select(media) is None
@@ -0,0 +1,15 @@
+from m3u8_extractor import scan_m3u8
+
+PAGE_URL = "https://www.example.com/play/1-1.html"
+AD_URL = "https://ads.example.com/ad.m3u8"
+PLAYER_URL = "https://cdn.example.com/ep1/index.m3u8"
+
+def test_preferred_rule_does_not_override_higher_priority():
+    page = (f'<a href="{AD_URL}">ad</a>'
+            f'<script>var player_aaa={{"url":"{PLAYER_URL}"}}</script>')
+    assert scan_m3u8(page, PAGE_URL) == (PLAYER_URL, "player_json")
+    assert scan_m3u8(page, PAGE_URL, preferred="generic") == (PLAYER_URL, "player_json")
+
+def test_preferred_rule_fast_path():
+    page = f'<a href="{AD_URL}">ad</a>'
+    assert scan_m3u8(page, PAGE_URL, preferred="generic") == (AD_URL, "generic")
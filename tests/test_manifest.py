@@ -0,0 +1,44 @@
+import pytest
+
+from manifest import parse_selector, load_manifest, ManifestEntry, DEFAULT_SELECTOR
+
+def test_parse_selector_ranges():
+    assert parse_selector("1-5,8,12-", 14) == [1, 2, 3, 4, 5, 8, 12, 13, 14]
+    assert parse_selector("-3", 10) == [1, 2, 3]
+    assert parse_selector(" 2 - 4 , 4 ,3", 10) == [2, 3, 4]
+    # 超出剧集数量的序号忽略
+    assert parse_selector("8-12,20", 9) == [8, 9]
+
+def test_parse_selector_keywords():
+    assert parse_selector("all", 4) == [1, 2, 3, 4]
+    assert parse_selector("ALL", 2) == [1, 2]
+    assert parse_selector("new-only", 5, completed=[1, 3]) == [2, 4, 5]
+    assert parse_selector("new-only,3", 5, completed=[1, 3]) == [2, 3, 4, 5]
+    assert parse_selector("new-only", 3, completed=[1, 2, 3]) == []
+
+@pytest.mark.parametrize("spec", ["abc", "-", "1-2-3", "3x", "1..5"])
+def test_parse_selector_rejects_bad_input(spec):
+    with pytest.raises(ValueError, match="无法解析的剧集选择"):
+        parse_selector(spec, 10)
+
+def test_load_manifest(tmp_path):
+    path = tmp_path / "list.txt"
+    path.write_text("# 批量下载\n"
+                    "\n"
+                    "https://www.example.com/show/1.html 1-5,8,12-\n"
+                    "  https://www.example.com/show/2.html all  \n"
+                    "https://www.example.com/show/3.html\n", encoding="utf-8")
+
+    assert load_manifest(str(path)) == [
+        ManifestEntry("https://www.example.com/show/1.html", "1-5,8,12-", 3),
+        ManifestEntry("https://www.example.com/show/2.html", "all", 4),
+        ManifestEntry("https://www.example.com/show/3.html", DEFAULT_SELECTOR, 5),
+    ]
+
+def test_load_manifest_reports_bad_line(tmp_path):
+    path = tmp_path / "list.txt"
+    path.write_text("https://www.example.com/show/1.html all\n"
+                    "https://www.example.com/show/2.html 1-3,oops\n", encoding="utf-8")
+
+    with pytest.raises(ValueError, match="第 2 行: 无法解析的剧集选择: oops"):
+        load_manifest(str(path))
@@ -0,0 +1,11 @@
+from retry_policy import classify_failure, FAILURE_EXPIRED, FAILURE_STOPPED, FAILURE_TRANSIENT
+
+def test_killed_by_signal_is_retried():
+    assert classify_failure(-9) == FAILURE_TRANSIENT
+    assert classify_failure(-11, "Segmentation fault") == FAILURE_TRANSIENT
+
+def test_user_stop():
+    assert classify_failure(-15, stopped=True) == FAILURE_STOPPED
+
+def test_expired_link():
+    assert classify_failure(1, "ERROR: HTTP Error 403: Forbidden") == FAILURE_EXPIRED
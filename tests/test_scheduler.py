@@ -0,0 +1,118 @@
+import threading
+import time
+
+from core_downloader import fail_pending_retries
+from scheduler import EpisodeJob, EpisodeScheduler
+from state_store import open_store, EP_RETRYING
+
+M3U8_URL = "https://cdn.example.com/index.m3u8"
+
+def test_stop_fails_queued_retries(tmp_path):
+    output_dir = str(tmp_path)
+
+    def worker(job):
+        # 第一次失败后排入重试，随后收到停止请求
+        open_store(output_dir).transition(job.ep_num, EP_RETRYING)
+        scheduler.submit(EpisodeJob(job.ep_num, "", M3U8_URL, output_dir, "剧", attempt=1), delay=60)
+        scheduler.stop()
+
+    scheduler = EpisodeScheduler(worker, on_dropped=fail_pending_retries)
+    scheduler.submit(EpisodeJob(1, "", M3U8_URL, output_dir, "剧"))
+    scheduler.submit(EpisodeJob(2, "", M3U8_URL, output_dir, "剧"), delay=60)
+    scheduler.run()
+
+    status = open_store(output_dir).get_status()
+    assert status["retrying"] == []
+    assert status["failed"] == [1]
+    # 没有开始过的剧集不记状态
+    assert 2 not in status["completed"] + status["failed"]
+
+def _start(scheduler):
+    thread = threading.Thread(target=scheduler.run, daemon=True)
+    thread.start()
+    return thread
+
+def _blocking_worker(started, release):
+    """记录启动顺序；第1集一直运行到 release 被设置"""
+    def worker(job):
+        started.append(job.ep_num)
+        if job.ep_num == 1:
+            release.wait(5)
+    return worker
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_priority_then_fifo(tmp_path):
+    started, release = [], threading.Event()
+    scheduler = EpisodeScheduler(_blocking_worker(started, release), max_workers=1)
+    scheduler.submit(EpisodeJob(1, "", M3U8_URL, str(tmp_path), "剧"))
+    thread = _start(scheduler)
+    _wait_for(lambda: started == [1])
+
+    for ep_num, priority in ((2, 0), (3, 5), (4, 0), (5, 5), (6, 1)):
+        scheduler.submit(EpisodeJob(ep_num, "", M3U8_URL, str(tmp_path), "剧", priority=priority))
+    release.set()
+    thread.join(5)
+
+    assert started == [1, 3, 5, 6, 2, 4]
+
+def test_pause_holds_queued_jobs(tmp_path):
+    paused_dir, other_dir = str(tmp_path / "a"), str(tmp_path / "b")
+    started, release = [], threading.Event()
+    scheduler = EpisodeScheduler(_blocking_worker(started, release), max_workers=1)
+    scheduler.submit(EpisodeJob(1, "", M3U8_URL, paused_dir, "剧"))
+    thread = _start(scheduler)
+    _wait_for(lambda: started == [1])
+
+    scheduler.submit(EpisodeJob(2, "", M3U8_URL, paused_dir, "剧"))
+    scheduler.submit(EpisodeJob(3, "", M3U8_URL, other_dir, "剧"))
+    scheduler.pause(paused_dir)
+    # 正在下载的集继续完成，暂停目录中排队的集不启动
+    release.set()
+    _wait_for(lambda: started == [1, 3] and not scheduler.running_jobs())
+    time.sleep(0.1)
+    assert [job.ep_num for job in scheduler.queued_jobs()] == [2]
+
+    scheduler.resume(paused_dir)
+    thread.join(5)
+    assert started == [1, 3, 2]
+
+def test_remove_queued_jobs(tmp_path):
+    started, release = [], threading.Event()
+    scheduler = EpisodeScheduler(_blocking_worker(started, release), max_workers=1)
+    scheduler.submit(EpisodeJob(1, "", M3U8_URL, str(tmp_path), "剧"))
+    thread = _start(scheduler)
+    _wait_for(lambda: started == [1])
+
+    for ep_num in (2, 3, 4):
+        scheduler.submit(EpisodeJob(ep_num, "", M3U8_URL, str(tmp_path), "剧"))
+    # 正在运行的第1集不受影响
+    removed = scheduler.remove(lambda job: job.ep_num in (1, 3))
+    assert [job.ep_num for job in removed] == [3]
+    release.set()
+    thread.join(5)
+
+    assert started == [1, 2, 4]
+
+def test_due_job_on_full_host_does_not_spin(tmp_path):
+    started, release = [], threading.Event()
+    scheduler = EpisodeScheduler(_blocking_worker(started, release), max_workers=2, per_host_limit=1)
+    waits = []
+    wait_timeout = scheduler._wait_timeout
+    scheduler._wait_timeout = lambda: waits.append(1) or wait_timeout()
+
+    scheduler.submit(EpisodeJob(1, "", M3U8_URL, str(tmp_path), "剧"))
+    scheduler.submit(EpisodeJob(2, "", M3U8_URL, str(tmp_path), "剧"), delay=0.05)
+    thread = _start(scheduler)
+    # 第2集的延迟已过，但主机名额被第1集占用：应一直等待到第1集结束，而不是反复空转
+    time.sleep(0.5)
+    assert started == [1]
+    assert len(waits) < 10
+    release.set()
+    thread.join(5)
+
+    assert started == [1, 2]
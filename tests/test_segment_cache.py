@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+import settings
+from segment_cache import SegmentCache, segment_key, SEGMENT_CACHE_DIR
+
+SEGMENT_URL = "https://cdn.example.com/show/1/seg-0001.ts"
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """临时的全局状态目录（settings 在导入时读取 OV_DOWNLOADER_HOME，这里同时替换）"""
+    monkeypatch.setenv("OV_DOWNLOADER_HOME", str(tmp_path))
+    monkeypatch.setattr(settings, "STATE_HOME", str(tmp_path))
+    return tmp_path
+
+def _blob_files(home):
+    root = home / SEGMENT_CACHE_DIR
+    return sorted(path.name for path in root.rglob("*") if path.is_file()) if root.exists() else []
+
+def test_segment_key_strips_signature():
+    signed = SEGMENT_URL + "?token=abc&expires=1700000000&quality=hd&sign=x#t=1"
+    assert segment_key(signed) == SEGMENT_URL + "?quality=hd"
+    assert segment_key(SEGMENT_URL + "?Token=def&Expires=1800000000&quality=hd") == SEGMENT_URL + "?quality=hd"
+    assert segment_key(SEGMENT_URL, (1024, 512)) == SEGMENT_URL + "#1024+512"
+
+def test_admit_on_second_download(home):
+    cache = SegmentCache()
+    data = b"\x47" * 188
+
+    cache.put(SEGMENT_URL + "?token=a", None, data)
+    assert cache.get(SEGMENT_URL) is None
+    assert _blob_files(home) == []
+
+    # 签名不同的同一分片算第二次出现
+    cache.put(SEGMENT_URL + "?token=b", None, data)
+    assert cache.get(SEGMENT_URL + "?token=c") == data
+    assert cache.stats()["entries"] == 1
+
+def test_changed_content_restarts_admission(home):
+    cache = SegmentCache()
+    cache.put(SEGMENT_URL, None, b"old")
+    cache.put(SEGMENT_URL, None, b"new")
+    assert cache.get(SEGMENT_URL) is None
+    cache.put(SEGMENT_URL, None, b"new")
+    assert cache.get(SEGMENT_URL) == b"new"
+
+def test_corrupt_blob_is_dropped(home):
+    cache = SegmentCache()
+    for _ in range(2):
+        cache.put(SEGMENT_URL, None, b"segment")
+    [name] = _blob_files(home)
+    blob = home / SEGMENT_CACHE_DIR / name[:2] / name
+    blob.write_bytes(b"segmenT")
+
+    assert cache.get(SEGMENT_URL) is None
+    assert not blob.exists()
+    assert cache.stats()["entries"] == 0
+
+def test_lru_eviction(home):
+    cache = SegmentCache(max_bytes=250)
+    urls = [f"https://cdn.example.com/show/1/seg-{idx}.ts" for idx in range(3)]
+    for idx, url in enumerate(urls[:2]):
+        for _ in range(2):
+            cache.put(url, None, bytes([idx]) * 100)
+        time.sleep(0.01)
+    # 读取第0个后，第1个成为最久未使用的
+    assert cache.get(urls[0]) is not None
+    time.sleep(0.01)
+    for _ in range(2):
+        cache.put(urls[2], None, b"\x02" * 100)
+
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[0]) == b"\x00" * 100
+    assert cache.get(urls[2]) == b"\x02" * 100
+    assert cache.stats() == {"entries": 2, "bytes": 200, "max_bytes": 250}
+    assert len(_blob_files(home)) == 2
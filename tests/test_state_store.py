@@ -0,0 +1,58 @@
+import json
+import os
+
+from core_downloader import get_download_status, save_download_status, record_original_url
+from state_store import (open_store, LEGACY_STATUS_FILE, LEGACY_ACTIVE_FILE, LEGACY_SUFFIX,
+                         EP_COMPLETED, EP_FAILED, EP_RETRYING)
+
+def test_import_legacy_json(tmp_path):
+    output_dir = str(tmp_path)
+    with open(os.path.join(output_dir, LEGACY_STATUS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"completed": [1, 2], "failed": [3], "progress": {},
+                   "original_url": "https://www.example.com/show/1.html"}, f)
+    with open(os.path.join(output_dir, LEGACY_ACTIVE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"4": {"pid": 123, "m3u8_url": "https://cdn.example.com/4.m3u8",
+                         "start_time": "2024-01-01 00:00:00"}}, f)
+
+    status = get_download_status(output_dir)
+    assert status["completed"] == [1, 2]
+    assert status["failed"] == [3]
+    assert status["original_url"] == "https://www.example.com/show/1.html"
+    assert open_store(output_dir).get_active()["4"]["engine"] == "yt-dlp"
+    for name in (LEGACY_STATUS_FILE, LEGACY_ACTIVE_FILE):
+        assert not os.path.exists(os.path.join(output_dir, name))
+        assert os.path.exists(os.path.join(output_dir, name + LEGACY_SUFFIX))
+
+def test_import_legacy_json_completed_wins(tmp_path):
+    output_dir = str(tmp_path)
+    with open(os.path.join(output_dir, LEGACY_STATUS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"completed": [1, 2], "failed": [2, 3], "retrying": [1]}, f)
+
+    status = get_download_status(output_dir)
+    assert status["completed"] == [1, 2]
+    assert status["failed"] == [3]
+    assert status.get("retrying", []) == []
+
+def test_save_status_round_trip_keeps_retrying(tmp_path):
+    output_dir = str(tmp_path)
+    store = open_store(output_dir)
+    store.transition(1, EP_COMPLETED)
+    store.transition(2, EP_RETRYING)
+    store.transition(3, EP_FAILED)
+
+    save_download_status(output_dir, get_download_status(output_dir), "https://www.example.com/show/2.html")
+
+    status = get_download_status(output_dir)
+    assert status["completed"] == [1]
+    assert status["retrying"] == [2]
+    assert status["failed"] == [3]
+    assert status["original_url"] == "https://www.example.com/show/2.html"
+
+def test_record_original_url_keeps_episode_states(tmp_path):
+    output_dir = str(tmp_path)
+    open_store(output_dir).transition(5, EP_RETRYING)
+    record_original_url(output_dir, "https://www.example.com/show/3.html")
+
+    status = get_download_status(output_dir)
+    assert status["retrying"] == [5]
+    assert status["original_url"] == "https://www.example.com/show/3.html"
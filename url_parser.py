@@ -1,8 +1,17 @@
 import cloudscraper
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import re,time,random
 import html
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from requests.cookies import create_cookie
+from rate_limiter import site_limiter
+from settings import state_path
+from page_parser import parse_series_page
+from metrics import page_parse_seconds, page_fetch_seconds, request_errors_total
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
@@ -26,34 +35,166 @@ def create_scraper():
         }
     )
 
-def parse_video_page(url):
-    try:
-        # 使用cloudscraper绕过Cloudflare
-        scraper = create_scraper()
-
-        # 首次请求带完整headers
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Referer': 'https://www.google.com/',
-            'X-Requested-With': 'XMLHttpRequest'
-        }
+# Cloudflare clearance cookie 及对应User-Agent的持久化文件
+CLEARANCE_FILE = "cf_clearance.json"
+# 需要持久化的Cloudflare相关cookie
+CLEARANCE_COOKIES = ("cf_clearance", "__cf_bm", "__cfduid")
+DEFAULT_POOL_SIZE = 4
+
+class ScraperPool:
+    """线程安全的cloudscraper会话池
 
-        for attempt in range(3):
+    会话在线程间复用（同一时刻只被一个线程使用），保留keep-alive连接和cookie；
+    clearance cookie 和 User-Agent 按站点连同过期时间保存到磁盘，
+    下次运行时直接注入会话，跳过Cloudflare验证。
+    """
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, clearance_file: str = None):
+        self.size = max(1, size)
+        self.clearance_file = clearance_file
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._clearance = None
+
+    def _clearance_path(self):
+        return self.clearance_file or state_path(CLEARANCE_FILE)
+
+    def _load_clearance(self):
+        """读取未过期的clearance记录（调用方持有锁）"""
+        if self._clearance is None:
+            self._clearance = {}
             try:
-                response = scraper.get(url, headers=headers, timeout=30)
-                if response.status_code == 403:
-                    # 动态切换User-Agent
-                    headers['User-Agent'] = random.choice(USER_AGENTS)
-                    # 添加Cloudflare绕过参数
-                    response = scraper.get(url + '?bypass=1', headers=headers)
-
-                response.raise_for_status()
-                break
-            except Exception as e:
-                if attempt == 2:
-                    raise
-                time.sleep(5 * (attempt + 1))
+                with open(self._clearance_path(), 'r', encoding='utf-8') as f:
+                    self._clearance = json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+
+        now = time.time()
+        for domain in list(self._clearance):
+            entry = self._clearance[domain]
+            entry["cookies"] = [c for c in entry.get("cookies", [])
+                                if not c.get("expires") or c["expires"] > now]
+            if not entry["cookies"]:
+                del self._clearance[domain]
+        return self._clearance
+
+    def _save_clearance(self):
+        path = self._clearance_path()
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._clearance, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def _apply_clearance(self, scraper, domain: str):
+        with self._lock:
+            entry = self._load_clearance().get(domain)
+        if not entry:
+            return
+        for c in entry["cookies"]:
+            if scraper.cookies.get(c["name"], domain=c["domain"]) != c["value"]:
+                scraper.cookies.set_cookie(create_cookie(
+                    c["name"], c["value"], domain=c["domain"],
+                    path=c.get("path", "/"), expires=c.get("expires")))
+        # clearance与User-Agent绑定，必须使用获取时的UA
+        if entry.get("user_agent"):
+            scraper.headers['User-Agent'] = entry["user_agent"]
+
+    def _harvest_clearance(self, scraper, domain: str):
+        """把会话里新的clearance cookie写回磁盘"""
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain,
+             "path": c.path, "expires": c.expires}
+            for c in scraper.cookies
+            if c.name in CLEARANCE_COOKIES and domain.endswith(c.domain.lstrip('.'))
+        ]
+        if not cookies:
+            return
+        entry = {"user_agent": scraper.headers.get('User-Agent'), "cookies": cookies}
+        with self._lock:
+            clearance = self._load_clearance()
+            if clearance.get(domain) == entry:
+                return
+            clearance[domain] = entry
+            try:
+                self._save_clearance()
+            except OSError:
+                pass
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return create_scraper()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # 会话都在使用中，等待归还
+        return self._idle.get()
+
+    @contextmanager
+    def session(self, url: str):
+        """借出一个已注入该站点clearance的会话，用完自动归还"""
+        domain = urlparse(url).netloc.lower()
+        scraper = self._acquire()
+        try:
+            self._apply_clearance(scraper, domain)
+            yield scraper
+            self._harvest_clearance(scraper, domain)
+        finally:
+            self._idle.put(scraper)
+
+# 进程内共享的会话池
+scraper_pool = ScraperPool()
+
+def fetch_page(scraper, url):
+    """带限速和重试地获取页面"""
+    # 首次请求带完整headers
+    headers = {
+        'Accept': 'text/html,application/xhtml+xml',
+        'Accept-Language': 'zh-CN,zh;q=0.9',
+        'Referer': 'https://www.google.com/',
+        'X-Requested-With': 'XMLHttpRequest'
+    }
+
+    host = urlparse(url).netloc.lower()
+    for attempt in range(3):
+        started = time.monotonic()
+        try:
+            site_limiter.acquire(url)
+            response = scraper.get(url, headers=headers, timeout=30)
+            if response.status_code == 403:
+                # 动态切换User-Agent
+                headers['User-Agent'] = random.choice(USER_AGENTS)
+                # 添加Cloudflare绕过参数
+                site_limiter.acquire(url)
+                response = scraper.get(url + '?bypass=1', headers=headers)
+
+            response.raise_for_status()
+            page_fetch_seconds.observe(time.monotonic() - started, host=host)
+            return response
+        except Exception as e:
+            request_errors_total.inc(stage="page", host=host)
+            if attempt == 2:
+                raise
+            time.sleep(5 * (attempt + 1))
+
+def parse_video_page(url):
+    started = time.monotonic()
+    try:
+        # 使用cloudscraper绕过Cloudflare（从会话池借用，复用连接和clearance）
+        with scraper_pool.session(url) as scraper:
+            response = fetch_page(scraper, url)
 
         # 检查验证码页面
         if "Cloudflare" in response.text:
@@ -64,19 +205,12 @@ def parse_video_page(url):
             print("Cloudflare protection detected. Trying to bypass...")
             # 可以添加重试逻辑或其他处理
 
-        # 反转义，去除所有反斜杠.
         response.encoding = 'utf-8'
-        html_text = html.unescape(response.text)
-        html_text = re.sub(r'\\(["/])', r'\1', html_text)
-
-        # 生产soup对象
-        soup = BeautifulSoup(html_text, 'html.parser')
+        html_text = normalize_page(response.text)
 
-        # 提取电视剧名称
-        title = extract_title(soup, url)
-
-        # 提取每一集的播放URL
-        episode_urls = extract_episode_urls(soup, url)
+        # 一次遍历收集标题和分集链接（有lxml时使用lxml）
+        title, episode_urls = parse_series_page(html_text, url)
+        page_parse_seconds.observe(time.monotonic() - started)
 
         return {
             'title': title,
@@ -87,6 +221,13 @@ def parse_video_page(url):
         print(f"Error parsing {url}: {str(e)}")
         return None
 
+def normalize_page(text):
+    """反转义，去除所有反斜杠."""
+    html_text = html.unescape(text)
+    return re.sub(r'\\(["/])', r'\1', html_text)
+
+# 以下两个函数是基于BeautifulSoup的旧实现，保留用于 benchmarks/ 中的对比和结果校验
+
 def extract_title(soup, url):
     # 尝试多种方式提取标题
     title = None